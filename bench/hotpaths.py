@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""预处理、命名、外链和图片查找等热点路径的基准测试
+
+用法: python bench/hotpaths.py [-n 次数] [-k 过滤] [-o 输出文件] [--compare 上次的输出]
+
+在临时目录中生成合成图片（不同尺寸、模式，有无Alpha通道，PNG/JPEG/GIF），不访问网络。
+每个用例在独立的子进程中运行，峰值内存互不影响。每行输出一条JSON：
+{"case": ..., "runs": ..., "ops_per_s": ..., "p50_ms": ..., "p99_ms": ..., "peak_rss_kb": ..., ...}
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# 名称: (宽, 高, 模式, 格式)
+IMAGES = {
+    'jpeg-large': (4000, 3000, 'RGB', 'JPEG'),
+    'jpeg-medium-gray': (1920, 1080, 'L', 'JPEG'),
+    'png-medium': (1920, 1080, 'RGB', 'PNG'),
+    'png-medium-alpha': (1920, 1080, 'RGBA', 'PNG'),
+    'png-small': (320, 240, 'RGB', 'PNG'),
+    'gif-medium': (1920, 1080, 'P', 'GIF'),
+}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif'}
+# 查找最新图片时目录中的文件数
+DIR_FILES = 20000
+NAME_MODES = ('uuid', 'md5', 'sha1', 'sha256', 'datetime', 'hex-timestamp')
+CONF = {'AutoCompress': True, 'MaxSize': '1920x1080', 'FillAlpha': True, 'NameMode': 'uuid',
+        'UrlPrefix': 'https://img.example.com/bench/'}
+
+
+def image_path(corpus, name):
+    return os.path.join(corpus, 'images', name + EXTENSIONS[IMAGES[name][3]])
+
+
+def synthesize(w, h, mode):
+    """确定性的合成图片：渐变叠加几何图形，兼顾平滑区域和边缘"""
+    from PIL import Image, ImageDraw
+
+    gradient = Image.linear_gradient('L').resize((w, h))
+    radial = Image.radial_gradient('L').resize((w, h))
+    img = Image.merge('RGB', [gradient, radial, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)])
+    draw = ImageDraw.Draw(img)
+    step = max(w, h) // 24
+    for i in range(24):
+        draw.rectangle([i * step, (i * 7 % 24) * step // 2, i * step + step * 2, (i * 7 % 24) * step // 2 + step],
+                       fill=(i * 10, 255 - i * 10, (i * 37) % 256))
+        draw.line([0, i * step, w, h - i * step], fill=(255, 255, 255), width=3)
+    if mode == 'RGBA':
+        img.putalpha(radial)
+    elif mode == 'L':
+        img = img.convert('L')
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.Palette.ADAPTIVE, colors=128)
+    return img
+
+
+def make_corpus(corpus):
+    os.makedirs(os.path.join(corpus, 'images'))
+    for name, (w, h, mode, fmt) in IMAGES.items():
+        synthesize(w, h, mode).save(image_path(corpus, name), format=fmt)
+    many = os.path.join(corpus, 'many')
+    os.makedirs(many)
+    for i in range(DIR_FILES):
+        path = os.path.join(many, '{:05d}{}'.format(i, '.png' if i % 4 else '.txt'))
+        open(path, 'wb').close()
+        os.utime(path, (i, i))
+
+
+def new_lpic(corpus, **conf):
+    from lpic import LPic
+
+    class BenchLPic(LPic):
+        """假的云服务，读出待上传的数据后直接返回成功"""
+
+        def upload(self, file, prefix=''):
+            file = self.as_picture(file)
+            if not isinstance(file.data, bytes):
+                with open(file.data, 'rb') as fp:
+                    fp.read()
+            return True
+
+    lp = BenchLPic(adjust=True)
+    lp.use = 'bench'
+    lp.cloud = {'Bucket': 'bench'}
+    lp.conf = dict(CONF, TmpDir=os.path.join(corpus, 'tmp'), **conf)
+    return lp
+
+
+def cases(corpus):
+    """返回 {用例名: (默认次数, 准备函数)}，准备函数返回待测的无参函数"""
+    result = {}
+
+    def add(name, runs):
+        def wrap(setup):
+            result[name] = (runs, setup)
+            return setup
+        return wrap
+
+    for name, (w, h, _, _) in IMAGES.items():
+        pic = image_path(corpus, name)
+        runs = 5 if w * h > 4000000 else 20
+
+        @add('preprocess/' + name, runs)
+        def _(pic=pic):
+            lp = new_lpic(corpus)
+            return lambda: lp.preprocess(pic, True)
+
+        @add('upload_process/' + name, runs)
+        def _(pic=pic):
+            lp = new_lpic(corpus)
+            return lambda: lp.upload_process(pic)
+
+    for name in ('jpeg-large', 'png-medium'):
+        @add('preprocess_resize/' + name, 10)
+        def _(name=name):
+            from PIL import Image
+
+            lp = new_lpic(corpus, MaxSize='1280x720')
+            img = Image.open(image_path(corpus, name))
+            img.load()
+            return lambda: lp.preprocess_resize(img)
+
+    @add('preprocess_fill_alpha/png-medium-alpha', 20)
+    def _():
+        from PIL import Image
+
+        lp = new_lpic(corpus)
+        img = Image.open(image_path(corpus, 'png-medium-alpha'))
+        img.load()
+        return lambda: lp.preprocess_fill_alpha(img)
+
+    for mode in NAME_MODES:
+        @add('generate_picname/' + mode, 200)
+        def _(mode=mode):
+            lp = new_lpic(corpus, NameMode=mode)
+            pic = image_path(corpus, 'jpeg-large')
+
+            def run():
+                # 哈希结果会被缓存，每次清空以测量实际计算
+                lp._digests.clear()
+                return lp.generate_picname(pic)
+            return run
+
+    @add('generate_file_link/url', 20000)
+    def _():
+        lp = new_lpic(corpus)
+        return lambda: lp.generate_file_link('/tmp/shot.png', 'abcdef.jpg')
+
+    @add('generate_file_link/format', 20000)
+    def _():
+        lp = new_lpic(corpus, LinkFormat='![$BASEPART]($URL) $FILENAME $FILEEXT $DIRNAME %Y-%m-%d')
+        return lambda: lp.generate_file_link('/tmp/shot.png', 'abcdef.jpg')
+
+    for index in (False, True):
+        @add('get_default_pic/{}-files{}'.format(DIR_FILES, '-index' if index else ''), 20)
+        def _(index=index):
+            lp = new_lpic(corpus, PicDirs=[os.path.join(corpus, 'many')], PicIndex=index)
+            if index:
+                lp.get_default_pic()
+            return lp.get_default_pic
+
+    return result
+
+
+def peak_rss_kb():
+    """本进程的峰值内存。优先读VmHWM，ru_maxrss会继承父进程的峰值"""
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def worker(corpus, name, runs):
+    sys.path.insert(0, SRC)
+    os.environ['XDG_CACHE_HOME'] = os.path.join(corpus, 'cache')
+    default_runs, setup = cases(corpus)[name]
+    runs = runs or default_runs
+    fn = setup()
+    fn()
+    times = []
+    total = perf_counter()
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    total = perf_counter() - total
+    ms = [t * 1000 for t in times]
+    return {
+        'case': name,
+        'runs': runs,
+        'ops_per_s': round(runs / total, 2),
+        'min_ms': round(min(ms), 3),
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p90_ms': round(percentile(ms, 90), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(max(ms), 3),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC, capture_output=True,
+                                text=True, check=False).stdout.strip() or None
+    except OSError:
+        commit = None
+    import PIL
+
+    return {'commit': commit, 'python': platform.python_version(), 'pillow': PIL.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(results, path):
+    """与上次的结果比较p50，输出变化比例"""
+    with open(path, encoding='utf-8') as fp:
+        old = {r['case']: r for r in map(json.loads, fp) if 'case' in r}
+    for r in results:
+        if r['case'] in old and old[r['case']]['p50_ms']:
+            ratio = r['p50_ms'] / old[r['case']]['p50_ms']
+            print('{:<45} {:>10.3f}ms -> {:>10.3f}ms  {:+.1%}'.format(
+                r['case'], old[r['case']]['p50_ms'], r['p50_ms'], ratio - 1), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量热点路径的吞吐量、延迟分位数和峰值内存')
+    parser.add_argument('-n', type=int, help='每个用例运行的次数，默认按用例而定')
+    parser.add_argument('-k', '--filter', help='只运行名称匹配该正则的用例')
+    parser.add_argument('-o', '--output', help='把结果写入文件')
+    parser.add_argument('--compare', help='与之前保存的结果比较')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.corpus, args.worker, args.n)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as corpus:
+        make_corpus(corpus)
+        sys.path.insert(0, SRC)
+        names = [name for name in cases(corpus) if not args.filter or re.search(args.filter, name)]
+        env = environment()
+        for name in names:
+            argv = [sys.executable, os.path.abspath(__file__), '--worker', name, '--corpus', corpus]
+            if args.n:
+                argv += ['-n', str(args.n)]
+            out = subprocess.run(argv, stdout=subprocess.PIPE, check=True).stdout
+            result = dict(json.loads(out.decode('utf-8')), **env)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(''.join(json.dumps(r) + '\n' for r in results))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
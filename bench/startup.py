@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""各子命令的冷启动耗时
+
+用法: python bench/startup.py [-n 次数] [-o 输出文件]
+
+使用示例配置，不访问网络。每行输出一条JSON：{"cmd": ..., "min_ms": ..., "p50_ms": ..., ...}
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+MAIN = os.path.join(SRC, 'main.py')
+
+COMMANDS = {
+    'help': ['help'],
+    'use': ['use'],
+    'cache': ['cache'],
+    'put-missing': ['put', 'missing.png'],
+    'import-lpic': None,
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(argv, conf, cwd):
+    if argv is None:
+        cmd = [sys.executable, '-c', 'import sys; sys.path.insert(0, {!r}); import lpic'.format(SRC)]
+    else:
+        cmd = [sys.executable, MAIN, '-y', '-c', conf] + argv
+    start = perf_counter()
+    subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    return (perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量各子命令的冷启动耗时')
+    parser.add_argument('-n', type=int, default=10, help='每个命令运行的次数')
+    parser.add_argument('-o', '--output', help='把结果写入文件')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        conf = os.path.join(tmp, 'lpic.yml')
+        with open(os.path.join(SRC, 'lpic.example.yml'), encoding='utf-8') as fp:
+            raw = fp.read()
+        with open(conf, 'w', encoding='utf-8') as fp:
+            fp.write(raw.replace('UploadCache: true', 'UploadCache: false'))
+        for name, argv in COMMANDS.items():
+            run(argv, conf, tmp)
+            times = [run(argv, conf, tmp) for _ in range(args.n)]
+            results.append({
+                'cmd': name,
+                'runs': args.n,
+                'min_ms': round(min(times), 2),
+                'p50_ms': round(percentile(times, 50), 2),
+                'p90_ms': round(percentile(times, 90), 2),
+                'max_ms': round(max(times), 2),
+            })
+
+    lines = '\n'.join(json.dumps(r) for r in results)
+    print(lines)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(lines + '\n')
+
+
+if __name__ == '__main__':
+    main()
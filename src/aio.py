@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""异步的上传、列举和删除
+
+    provider = AsyncProvider(lp)            # lp为已认证的LPic实例
+    await provider.upload(file, prefix)
+    await provider.list(prefix, limit)
+    await provider.delete(key)
+
+云服务实现了LPic.presign时，请求由现有的SDK客户端签名，再用asyncio直接发送：
+每个端点一个有上限的长连接池，上百个并发传输也只占用一个线程。
+未实现presign的云服务（或不支持的操作）退回到线程池中调用同步的SDK。
+
+同步的CLI通过SyncProvider使用：所有请求都在同一个后台事件循环中执行。
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+import ssl
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+
+import retry
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+
+class HTTPError(IOError):
+    def __init__(self, status, body=b''):
+        super(HTTPError, self).__init__('HTTP {} {}'.format(status, body[:200].decode('utf-8', 'replace')).strip())
+        self.status = status
+        self.body = body
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        # 响应头的名称均为小写
+        self.headers = headers
+        self.body = body
+
+
+class ConnectionPool:
+    """一个端点（scheme, host, port）的HTTP/1.1长连接池，最多size个连接同时使用
+
+    timeout限制建立连接和每次读写等待的时间，而不是整个请求，大文件在慢速网络上也能传完。
+    """
+
+    def __init__(self, scheme, host, port, size=8, timeout=60):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+        self.ssl = ssl.create_default_context() if scheme == 'https' else None
+
+    async def wait(self, aw):
+        return await asyncio.wait_for(aw, self.timeout)
+
+    async def connect(self):
+        return await self.wait(asyncio.open_connection(self.host, self.port, ssl=self.ssl))
+
+    async def request(self, method, target, headers, body=None):
+        async with self.slots:
+            # 复用的连接可能已被服务端关闭，此时换新连接重试一次。任何失败都关闭当前连接
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else await self.connect()
+            while True:
+                try:
+                    resp, keep = await self.exchange(conn, method, target, headers, body)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    conn[1].close()
+                    if not reused:
+                        raise ConnectionError(str(e)) from e
+                    reused = False
+                    conn = await self.connect()
+                except BaseException:
+                    conn[1].close()
+                    raise
+            if keep:
+                self.idle.append(conn)
+            else:
+                conn[1].close()
+            return resp
+
+    async def exchange(self, conn, method, target, headers, body):
+        reader, writer = conn
+        lines = ['{} {} HTTP/1.1'.format(method, target)]
+        lines += ['{}: {}'.format(k, v) for k, v in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if isinstance(body, bytes):
+            writer.write(body)
+        elif body is not None:
+            # 本地文件分块发送，内存占用与文件大小无关
+            with open(body, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                    writer.write(chunk)
+                    await self.wait(writer.drain())
+        await self.wait(writer.drain())
+        return await self.read_response(reader, method)
+
+    async def read_response(self, reader, method):
+        status_line = await self.wait(reader.readline())
+        if not status_line:
+            raise ConnectionError('连接已关闭')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self.wait(reader.readline())
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, _, v = line.decode('latin-1').partition(':')
+            headers[k.strip().lower()] = v.strip()
+        status = int(status)
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await self.wait(reader.readline())).split(b';')[0], 16)
+                if size == 0:
+                    await self.wait(reader.readline())
+                    break
+                parts.append(await self.wait(reader.readexactly(size)))
+                await self.wait(reader.readexactly(2))
+            body = b''.join(parts)
+        elif 'content-length' in headers:
+            body = await self.wait(reader.readexactly(int(headers['content-length'])))
+        else:
+            return Response(status, headers, await self.wait(reader.read())), False
+        keep = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+        return Response(status, headers, body), keep
+
+    def close(self):
+        while self.idle:
+            self.idle.pop()[1].close()
+
+
+class HTTPClient:
+    """按端点复用连接池"""
+
+    def __init__(self, pool_size=8, timeout=60):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pools = {}
+
+    def pool(self, url):
+        scheme = url.scheme or 'http'
+        port = url.port or (443 if scheme == 'https' else 80)
+        key = (scheme, url.hostname, port)
+        if key not in self.pools:
+            self.pools[key] = ConnectionPool(scheme, url.hostname, port, self.pool_size, self.timeout)
+        return self.pools[key]
+
+    async def request(self, method, url, headers=None, body=None, size=None):
+        url = urlsplit(url)
+        target = (url.path or '/') + ('?' + url.query if url.query else '')
+        headers = dict(headers or {})
+        headers.setdefault('Host', url.netloc)
+        if body is not None or method in ('PUT', 'POST'):
+            if size is None:
+                size = len(body) if isinstance(body, bytes) else os.path.getsize(body) if body else 0
+            headers['Content-Length'] = str(size)
+        return await self.pool(url).request(method, target, headers, body)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
+
+
+def check(resp):
+    """限流和5xx抛出可重试的TransientError，其余非2xx抛出HTTPError"""
+    if 200 <= resp.status < 300:
+        return resp
+    retryable, throttled, retry_after = retry.classify_status(resp.status, resp.headers.get('retry-after'))
+    if retryable:
+        raise retry.TransientError(str(HTTPError(resp.status, resp.body)), resp.status, retry_after, throttled)
+    raise HTTPError(resp.status, resp.body)
+
+
+def parse_listing(body):
+    """解析S3风格的ListBucketResult，返回 ([(key, 修改时间戳)], 下一页的marker或None)"""
+    root = ElementTree.fromstring(body)
+    # 去掉命名空间
+    for el in root.iter():
+        el.tag = el.tag.rsplit('}', 1)[-1]
+    items = []
+    for contents in root.iter('Contents'):
+        mtime = datetime.strptime(contents.findtext('LastModified')[:19], '%Y-%m-%dT%H:%M:%S')
+        items.append((contents.findtext('Key'), mtime.replace(tzinfo=timezone.utc).timestamp()))
+    if root.findtext('IsTruncated') != 'true' or not items:
+        return items, None
+    return items, root.findtext('NextMarker') or items[-1][0]
+
+
+class AsyncProvider:
+    """云服务的异步接口。upload、list、delete失败时抛出异常，与同步接口的返回值一致"""
+
+    def __init__(self, lp, pool_size=None):
+        self.lp = lp
+        self.http = HTTPClient(pool_size or lp.conf.get('MaxInflight') or lp.conf.get('UploadThreads') or 8)
+
+    def presign(self, method, key, headers=None, params=None):
+        """返回 (url, headers)，不支持时返回None"""
+        try:
+            return self.lp.presign(method, key, headers or {}, params)
+        except NotImplementedError:
+            return None
+
+    async def upload(self, file, prefix=''):
+        file = self.lp.as_picture(file)
+        content_type = mimetypes.guess_type(file.name)[0]
+        headers = {'Content-Type': content_type} if content_type else {}
+        signed = None if self.lp.use_multipart(file) else self.presign('PUT', prefix + file.name, headers)
+        if signed is None:
+            # 分片上传等仍由SDK完成
+            return await asyncio.to_thread(self.lp.upload, file, prefix)
+        url, headers = signed
+        check(await self.http.request('PUT', url, headers, file.data, self.lp.picture_size(file)))
+        return True
+
+    async def delete(self, key):
+        signed = self.presign('DELETE', key)
+        if signed is None:
+            return await asyncio.to_thread(self.lp.delete, key)
+        resp = await self.http.request('DELETE', *signed)
+        if resp.status == 404:
+            return False
+        check(resp)
+        return True
+
+    async def iter_pages(self, prefix):
+        marker = ''
+        while marker is not None:
+            params = {'prefix': prefix, 'marker': marker, 'max-keys': str(self.lp.PAGE_SIZE)}
+            url, headers = self.presign('GET', '', params=params)
+            items, marker = parse_listing(check(await self.http.request('GET', url, headers)).body)
+            yield items
+
+    async def list(self, prefix, limit=None, oldest=False):
+        """与LPic.list相同：按修改时间排序，最多limit个"""
+        if self.presign('GET', '', params={'prefix': prefix}) is None:
+            return await asyncio.to_thread(self.lp.list, prefix, limit, oldest)
+        import heapq
+        import itertools
+        from operator import itemgetter
+
+        select = heapq.nsmallest if oldest else heapq.nlargest
+        items = []
+        async for page in self.iter_pages(prefix):
+            # 每页与已选出的合并后只保留limit个，内存占用与对象总数无关
+            items = select(limit or self.lp.MAX_KEYS, itertools.chain(items, page), key=itemgetter(1))
+        return [key for key, _ in items]
+
+    async def close(self):
+        self.http.close()
+
+
+class EventLoop:
+    """在后台线程中运行的事件循环，同步代码通过run提交协程"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='lpic-aio', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+class SyncProvider:
+    """AsyncProvider的同步适配：方法与LPic的upload、list、delete相同，可在多个线程中并发调用"""
+
+    def __init__(self, lp, pool_size=None):
+        self.events = EventLoop.get()
+        # 连接池中的Semaphore须在事件循环中创建
+        self.provider = self.events.run(self.create(lp, pool_size))
+
+    @staticmethod
+    async def create(lp, pool_size):
+        return AsyncProvider(lp, pool_size)
+
+    def upload(self, file, prefix=''):
+        return self.events.run(self.provider.upload(file, prefix))
+
+    def list(self, prefix, limit=None, oldest=False):
+        return self.events.run(self.provider.list(prefix, limit, oldest))
+
+    def delete(self, key):
+        return self.events.run(self.provider.delete(key))
+
+    def close(self):
+        self.events.run(self.provider.close())
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os
 import oss2
 
+import retry
 from lpic import LPic
 
 
 class AliyunLPic(LPic):
+    BATCH_DELETE_SIZE = 1000
+
     def __init__(self, conf=None, **option):
         super(AliyunLPic, self).__init__(conf, **option)
         self.cloud_name = '阿里云'
@@ -21,16 +23,52 @@ class AliyunLPic(LPic):
         return 'https://oss.console.aliyun.com/bucket/{}/{}/object'.format(self.cloud['Region'], self.cloud['Bucket'])
 
     def upload(self, file, prefix=''):
-        ret = self.client.put_object_from_file(prefix + os.path.basename(file), file)
+        file = self.as_picture(file)
+        if self.use_multipart(file):
+            return self.upload_multipart(file, prefix)
+        if isinstance(file.data, bytes):
+            ret = self.client.put_object(prefix + file.name, file.data)
+        else:
+            ret = self.client.put_object_from_file(prefix + file.name, file.data)
+        return 200 <= ret.status < 300
+
+    def upload_multipart(self, file, prefix=''):
+        file = self.as_picture(file)
+        ret = oss2.resumable_upload(self.client, prefix + file.name, file.data,
+                                    store=oss2.ResumableStore(root=self.journal_dir()),
+                                    multipart_threshold=self.part_size, part_size=self.part_size,
+                                    num_threads=self.part_threads)
         return 200 <= ret.status < 300
 
-    def list(self, prefix):
-        ret = self.client.list_objects(prefix=prefix, max_keys=self.MAX_KEYS)
-        return [obj.key for obj in sorted([obj for obj in ret.object_list], key=lambda o: -o.last_modified)]
+    def iter_objects(self, prefix):
+        for obj in oss2.ObjectIterator(self.client, prefix=prefix, max_keys=self.PAGE_SIZE):
+            yield obj.key, obj.last_modified
 
     def delete(self, key):
         ret = self.client.delete_object(key)
         return 200 <= ret.status < 300
 
+    def exists(self, key):
+        return self.client.object_exists(key)
+
+    def delete_many(self, keys):
+        ret = self.client.batch_delete_objects(keys)
+        deleted = set(ret.deleted_keys)
+        return list(deleted), {k: '删除失败' for k in keys if k not in deleted}
+
+    def presign(self, method, key, headers=None, params=None):
+        if not key:
+            # sign_url不支持Bucket级别的请求，列举仍由SDK完成
+            raise NotImplementedError
+        return self.client.sign_url(method, key, 600, headers=headers, params=params), dict(headers or {})
+
+    def classify_error(self, exc):
+        if isinstance(exc, oss2.exceptions.RequestError):
+            # 连接、超时等网络错误
+            return True, False, None
+        if isinstance(exc, oss2.exceptions.OssError):
+            return retry.classify_status(exc.status, (exc.headers or {}).get('Retry-After'))
+        return super(AliyunLPic, self).classify_error(exc)
+
     def close(self):
         self.client.session.session.close()
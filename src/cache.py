@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import traceback
+from time import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def cache_home():
+    """缓存目录，遵循XDG规范"""
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'lpic')
+
+
+def atomic_write(path, data, mode=None):
+    """先写临时文件再替换，避免并发读到半截内容。mode为替换后的文件权限"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.lpic-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class UploadCache:
+    """内容寻址的上传缓存：(内容哈希, 云服务, Bucket, 前缀, 预处理参数) -> 远程key"""
+
+    def __init__(self, path, max_entries=10000, max_age=30 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.removed = set()
+        # {key: [remote_key, created, accessed]}
+        self.entries = self.read()
+
+    @staticmethod
+    def make_key(digest, cloud, bucket, prefix, settings):
+        return json.dumps([digest, cloud, bucket, prefix, settings], sort_keys=True)
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                entries = json.loads(fp.read().decode('utf-8'))
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError):
+            logger.debug(traceback.format_exc())
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            if self.max_age and time() - entry[1] > self.max_age:
+                del self.entries[key]
+                self.removed.add(key)
+                self.dirty = True
+                return None
+            entry[2] = time()
+            self.dirty = True
+            return entry[0]
+
+    def put(self, key, remote_key):
+        with self.lock:
+            now = time()
+            self.entries[key] = [remote_key, now, now]
+            self.removed.discard(key)
+            self.dirty = True
+
+    def discard(self, cloud, bucket, *remote_keys):
+        """删除云服务中指向remote_keys的条目，未指定remote_keys时删除该云服务的全部条目"""
+        remote_keys = set(remote_keys)
+        with self.lock:
+            for k in [k for k, v in self.entries.items()
+                      if json.loads(k)[1:3] == [cloud, bucket] and (not remote_keys or v[0] in remote_keys)]:
+                del self.entries[k]
+                self.removed.add(k)
+                self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.removed = set()
+            self.dirty = False
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def evict(self, entries):
+        now = time()
+        if self.max_age:
+            entries = {k: v for k, v in entries.items() if now - v[1] <= self.max_age}
+        if self.max_entries and len(entries) > self.max_entries:
+            # 按最近访问时间淘汰
+            keep = sorted(entries.items(), key=lambda kv: -kv[1][2])[:self.max_entries]
+            entries = dict(keep)
+        return entries
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            # 与磁盘上的内容合并，避免多个实例互相覆盖
+            entries = {k: v for k, v in self.read().items() if k not in self.removed}
+            for k, v in self.entries.items():
+                if k not in entries or entries[k][2] <= v[2]:
+                    entries[k] = v
+            self.entries = self.evict(entries)
+            atomic_write(self.path, json.dumps(self.entries).encode('utf-8'))
+            self.removed = set()
+            self.dirty = False
+
+
+class OutputCache:
+    """预处理结果的磁盘缓存，按最近使用时间淘汰，总大小不超过max_size
+
+    每个结果存为一个以键的哈希命名的文件，首行为JSON格式的 [扩展名, 宽, 高]，其后为数据。命中时更新修改时间。
+    多个进程可同时读写，写入是原子的，淘汰时忽略已被其他进程删除的文件。
+    """
+
+    def __init__(self, path, max_size=200 << 20):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # 本进程估计的总大小，首次写入时扫描目录得到
+        self.size = None
+
+    @staticmethod
+    def make_key(digest, settings):
+        return hashlib.sha256(json.dumps([digest, settings], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """返回 (数据, 扩展名, 宽, 高)，未命中时返回None"""
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, 'rb') as fp:
+                ext, width, height = json.loads(fp.readline().decode('utf-8'))
+                data = fp.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError):
+            logger.debug(traceback.format_exc())
+            return None
+        return data, ext, width, height
+
+    def put(self, key, data, ext, width, height):
+        header = json.dumps([ext, width, height]).encode('utf-8') + b'\n'
+        atomic_write(os.path.join(self.path, key), header + data)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, _, size in self.scan())
+            else:
+                self.size += len(header) + len(data)
+            if self.size > self.max_size:
+                self.evict()
+
+    def scan(self):
+        """返回 [(修改时间, 路径, 大小)]"""
+        files = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        try:
+                            st = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        files.append((st.st_mtime, entry.path, st.st_size))
+        except FileNotFoundError:
+            pass
+        return files
+
+    def evict(self):
+        files = sorted(self.scan())
+        self.size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def clear(self):
+        with self.lock:
+            for _, path, _ in self.scan():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.size = 0
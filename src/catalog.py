@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+from time import time
+
+
+def data_home():
+    """数据目录，遵循XDG规范"""
+    return os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'lpic')
+
+
+class Catalog:
+    """已上传文件的本地SQLite索引"""
+    FIELDS = ('cloud', 'bucket', 'key', 'hash', 'size', 'width', 'height', 'source', 'link', 'created')
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS objects (
+            cloud TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            hash TEXT,
+            size INTEGER,
+            width INTEGER,
+            height INTEGER,
+            source TEXT,
+            link TEXT,
+            created REAL NOT NULL,
+            PRIMARY KEY (cloud, bucket, key)
+        );
+        CREATE INDEX IF NOT EXISTS objects_key ON objects (key);
+        CREATE INDEX IF NOT EXISTS objects_hash ON objects (hash);
+        CREATE INDEX IF NOT EXISTS objects_created ON objects (cloud, bucket, created);
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(self.SCHEMA)
+
+    def add(self, cloud, bucket, key, **fields):
+        fields.setdefault('created', time())
+        row = dict(fields, cloud=cloud, bucket=bucket, key=key)
+        names = [f for f in self.FIELDS if f in row]
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO objects ({}) VALUES ({})'.format(
+                ', '.join(names), ', '.join('?' * len(names))), [row[f] for f in names])
+
+    def query(self, cloud=None, bucket=None, prefix=None, pattern=None, limit=None, oldest=False):
+        """按上传时间从新到旧返回记录。prefix匹配key前缀，pattern匹配key、源文件路径或哈希"""
+        where, params = [], []
+        if cloud is not None:
+            where.append('cloud = ?')
+            params.append(cloud)
+        if bucket is not None:
+            where.append('bucket = ?')
+            params.append(bucket)
+        if prefix:
+            # 用范围查询代替LIKE，以便使用索引
+            where.append('key >= ? AND key < ?')
+            params += [prefix, prefix + '\U0010ffff']
+        if pattern:
+            where.append("(key LIKE ? ESCAPE '\\' OR source LIKE ? ESCAPE '\\' OR hash LIKE ? ESCAPE '\\')")
+            escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params += ['%' + escaped + '%', '%' + escaped + '%', escaped + '%']
+        sql = 'SELECT * FROM objects'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created {}'.format('ASC' if oldest else 'DESC')
+        if limit:
+            sql += ' LIMIT {:d}'.format(limit)
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, params).fetchall()]
+
+    def remove(self, cloud, bucket, keys):
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM objects WHERE cloud = ? AND bucket = ? AND key = ?',
+                                [(cloud, bucket, k) for k in keys])
+
+    def sync(self, cloud, bucket, objects, prefix='', link=None):
+        """按远程列举前缀下的结果 (key, 修改时间) 重建索引，保留已有记录的元数据。返回 (新增数, 删除数)"""
+        with self.lock:
+            known = {r[0] for r in self.db.execute(
+                'SELECT key FROM objects WHERE cloud = ? AND bucket = ? AND key >= ? AND key < ?',
+                (cloud, bucket, prefix, prefix + '\U0010ffff'))}
+        seen, added = set(), 0
+        for key, created in objects:
+            seen.add(key)
+            if key not in known:
+                self.add(cloud, bucket, key, created=created, link=link(key) if link else None)
+                added += 1
+        stale = known - seen
+        self.remove(cloud, bucket, stale)
+        return added, len(stale)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
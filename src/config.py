@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""配置文件的解析缓存
+
+YAML解析结果按 (路径, 修改时间, 大小) 缓存：同一进程内只解析一次，
+并以JSON保存在缓存目录中，配置未修改时后续进程不需要导入和运行YAML解析器。
+缓存新的配置文件时，顺带删除源文件已不存在的缓存。
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import traceback
+
+from cache import atomic_write, cache_home
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# {路径: (stamp, 数据)}
+_parsed = {}
+
+
+def stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cache_path(path):
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_home(), 'config', name + '.json')
+
+
+def parse(path, encodings):
+    """读取一次文件，依次尝试各编码解码后解析。有libyaml时使用C实现的加载器"""
+    import yaml
+
+    with open(path, 'rb') as fp:
+        raw = fp.read()
+    for ec in encodings:
+        try:
+            text = raw.decode(ec)
+            break
+        except UnicodeDecodeError:
+            pass
+    else:
+        raise UnicodeDecodeError(encodings[-1], raw, 0, len(raw), '无法识别配置文件的编码')
+    loader = getattr(yaml, 'CFullLoader', None) or getattr(yaml, 'FullLoader', None)
+    if loader:
+        return yaml.load(text, Loader=loader)
+    return yaml.load(text)
+
+
+def read_cache(path, st):
+    try:
+        with open(cache_path(path), encoding='utf-8') as fp:
+            cached = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if cached.get('path') != path or cached.get('stamp') != st:
+        return None
+    return cached.get('data')
+
+
+def write_cache(path, st, data):
+    try:
+        body = json.dumps({'path': path, 'stamp': st, 'data': data}, ensure_ascii=False)
+    except (TypeError, ValueError):
+        # 含有日期等JSON无法表示的值时，只在进程内缓存
+        return
+    new = not os.path.exists(cache_path(path))
+    try:
+        atomic_write(cache_path(path), body.encode('utf-8'))
+    except OSError:
+        logger.debug(traceback.format_exc())
+    if new:
+        prune()
+
+
+def prune():
+    """删除源文件已不存在的缓存"""
+    root = os.path.join(cache_home(), 'config')
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        cached = os.path.join(root, name)
+        try:
+            with open(cached, encoding='utf-8') as fp:
+                source = json.load(fp).get('path')
+            if source and not os.path.exists(source):
+                os.remove(cached)
+        except (OSError, ValueError, AttributeError):
+            continue
+
+
+def load(path, encodings=('utf-8',)):
+    """返回 (数据, 来源)，来源为memory、disk或parse。文件不存在时抛出FileNotFoundError"""
+    path = os.path.realpath(path)
+    st = stamp(path)
+    with _lock:
+        if path in _parsed and _parsed[path][0] == st:
+            return copy.deepcopy(_parsed[path][1]), 'memory'
+    source = 'disk'
+    data = read_cache(path, st)
+    if data is None:
+        import yaml
+
+        source = 'parse'
+        try:
+            data = parse(path, encodings)
+        except yaml.YAMLError:
+            logger.error(traceback.format_exc())
+            return {}, source
+        # 解析期间文件被修改时不缓存
+        if stamp(path) != st:
+            return data, source
+        write_cache(path, st, data)
+    with _lock:
+        _parsed[path] = (st, data)
+    return copy.deepcopy(data), source
+
+
+def store(path, data):
+    """文件已由本进程改写，直接更新缓存而不重新解析"""
+    path = os.path.realpath(path)
+    st = stamp(path)
+    with _lock:
+        _parsed[path] = (st, copy.deepcopy(data))
+    write_cache(path, st, data)
+
+
+def clear():
+    with _lock:
+        _parsed.clear()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""lpic守护进程
+
+守护进程常驻内存，保存已加载的配置和已认证的各云服务客户端（及其长连接）。
+lpic命令通过Unix domain socket把命令交给它执行，省去每次启动、解析配置、认证和TLS握手的开销。
+
+通信协议为每行一个JSON对象：
+    客户端 -> 守护进程  {"cmd", "dests", "options", "cwd"} 或 {"control": "stop"/"status"}
+    守护进程 -> 客户端  {"log", "level"}、{"ask"}、{"exit"}，或 {"fallback"} 表示请客户端自行执行
+    客户端 -> 守护进程  {"answer"}，回复 ask
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from time import sleep, time
+
+
+logger = logging.getLogger(__name__)
+
+
+def socket_path():
+    if os.environ.get('LPIC_SOCKET'):
+        return os.environ['LPIC_SOCKET']
+    run_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(run_dir, 'lpic-{}.sock'.format(os.getuid() if hasattr(os, 'getuid') else 0))
+
+
+def send(fp, obj):
+    fp.write(json.dumps(obj).encode('utf-8') + b'\n')
+    fp.flush()
+
+
+def trusted(path):
+    """套接字须属于当前用户且只有当前用户可读写，以免把命令交给其他用户抢先创建的套接字"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_uid != os.getuid() or st.st_mode & 0o777 != 0o600:
+        logger.warning('忽略不安全的套接字：{}'.format(path))
+        return False
+    return True
+
+
+def connect(timeout=None):
+    """连接守护进程，不可用时返回None"""
+    path = socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path) or not trusted(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def call(message, timeout=5):
+    """发送控制消息，返回回复；守护进程不可用时返回None"""
+    sock = connect(timeout)
+    if sock is None:
+        return None
+    with sock, sock.makefile('rwb') as fp:
+        send(fp, message)
+        line = fp.readline()
+    return json.loads(line.decode('utf-8')) if line else None
+
+
+def request(cmd, dests, options):
+    """交给守护进程执行命令，返回退出码；守护进程不可用时返回None"""
+    sock = connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile('rwb') as fp:
+        send(fp, {'cmd': cmd, 'dests': dests, 'options': options, 'cwd': os.getcwd()})
+        for line in fp:
+            msg = json.loads(line.decode('utf-8'))
+            if 'log' in msg:
+                logger.log(msg.get('level', logging.INFO), msg['log'])
+            elif 'ask' in msg:
+                send(fp, {'answer': input(msg['ask'])})
+            elif 'exit' in msg:
+                return msg['exit']
+            elif 'fallback' in msg:
+                return None
+    logger.error('守护进程意外断开连接')
+    return 1
+
+
+class ForwardHandler(logging.Handler):
+    """把日志转发给客户端"""
+
+    def __init__(self, fp):
+        super(ForwardHandler, self).__init__(logging.INFO)
+        self.fp = fp
+
+    def emit(self, record):
+        try:
+            send(self.fp, {'log': self.format(record), 'level': record.levelno})
+        except OSError:
+            pass
+
+
+class LPicDaemon:
+    def __init__(self, conf=None):
+        from lpic import LPic
+
+        self.conf_file = os.path.abspath(conf or LPic.LPIC_YML)
+        self.instances = {}
+        self.stamp = None
+        self.started = time()
+        self.requests = 0
+
+    def config_stamp(self):
+        try:
+            st = os.stat(self.conf_file)
+            return st.st_mtime, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """配置文件变化后，重建各云服务实例"""
+        stamp = self.config_stamp()
+        if stamp != self.stamp:
+            self.close()
+            self.stamp = stamp
+
+    def instance(self, use, cls, options):
+        p = self.instances.get(use)
+        if p is None:
+            p = cls(self.conf_file, use=use)
+            if not p.start():
+                return None
+            self.instances[use] = p
+        p.option = dict(options, use=use)
+        return p
+
+    def warm(self):
+        """预先认证全部云服务"""
+        from lpic import LPic, load_provider
+
+        self.reload()
+        lp = LPic(self.conf_file)
+        if not lp.load_config():
+            return
+        for use in lp.clouds():
+            cls = load_provider(use)
+            if cls:
+                try:
+                    self.instance(use, cls, {})
+                except Exception:
+                    logger.error(traceback.format_exc())
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'conf': self.conf_file,
+            'uptime': round(time() - self.started, 1),
+            'requests': self.requests,
+            'clouds': sorted(self.instances),
+        }
+
+    def handle(self, msg, fp):
+        from lpic import LPic
+        from main import dispatch
+
+        options = dict(msg.get('options') or {})
+        cwd = msg.get('cwd') or '/'
+        # 未指定-c时客户端使用默认配置，守护进程可能是用其他配置启动的
+        conf = options.get('conf') or LPic.LPIC_YML
+        if os.path.abspath(os.path.join(cwd, conf)) != self.conf_file:
+            send(fp, {'fallback': '配置文件不同'})
+            return
+        options['conf'] = self.conf_file
+        # 相对路径按客户端的工作目录解析，确认提示转给客户端
+        options['cwd'] = cwd
+
+        def ask(prompt):
+            send(fp, {'ask': prompt})
+            line = fp.readline()
+            if not line:
+                raise EOFError
+            return json.loads(line.decode('utf-8')).get('answer', '')
+
+        options['input'] = ask
+        root = logging.getLogger()
+        handler = ForwardHandler(fp)
+        root.addHandler(handler)
+        code = 0
+        try:
+            self.reload()
+            self.requests += 1
+            dispatch(msg.get('cmd'), msg.get('dests') or [], options,
+                     lambda use, cls: self.instance(use, cls, options))
+        except Exception:
+            logger.error(traceback.format_exc())
+            code = 1
+        finally:
+            root.removeHandler(handler)
+        send(fp, {'exit': code})
+
+    def close(self):
+        for p in self.instances.values():
+            p.exit()
+        self.instances = {}
+
+
+class RWFile:
+    """把同一连接的读写两端合为一个对象"""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def readline(self):
+        return self.rfile.readline()
+
+    def write(self, data):
+        return self.wfile.write(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def serve(conf=None):
+    path = socket_path()
+    if os.path.exists(path):
+        if call({'control': 'status'}):
+            logger.error('守护进程已在运行：{}'.format(path))
+            return 1
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error('无法删除已有的套接字：{}'.format(e))
+            return 1
+
+    daemon = LPicDaemon(conf)
+    daemon.warm()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            msg = json.loads(line.decode('utf-8'))
+            control = msg.get('control')
+            if control == 'status':
+                send(self.wfile, daemon.status())
+            elif control == 'stop':
+                send(self.wfile, {'exit': 0})
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                daemon.handle(msg, RWFile(self.rfile, self.wfile))
+
+    def terminate(*_):
+        threading.Thread(target=server.shutdown).start()
+
+    # 套接字创建时即为0600，bind与chmod之间没有空隙
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, terminate)
+    logger.info('守护进程已启动：{}'.format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        daemon.close()
+    return 0
+
+
+def control(action, conf=None):
+    """管理守护进程，返回退出码"""
+    if action == 'run':
+        return serve(conf)
+    elif action == 'start':
+        if call({'control': 'status'}):
+            logger.info('守护进程已在运行')
+            return 0
+        from cache import cache_home
+
+        os.makedirs(cache_home(), exist_ok=True)
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        argv = [sys.executable, main, 'daemon', 'run'] + (['-c', os.path.abspath(conf)] if conf else [])
+        with open(os.path.join(cache_home(), 'daemon.log'), 'ab') as log:
+            subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+        for _ in range(100):
+            status = call({'control': 'status'})
+            if status:
+                logger.info('守护进程已启动，PID：{}'.format(status['pid']))
+                return 0
+            sleep(0.1)
+        logger.error('守护进程启动失败，详见：{}'.format(os.path.join(cache_home(), 'daemon.log')))
+        return 1
+    elif action == 'stop':
+        if call({'control': 'stop'}) is None:
+            logger.info('守护进程未运行')
+        else:
+            logger.info('守护进程已停止')
+        return 0
+    elif action == 'status':
+        status = call({'control': 'status'})
+        if status is None:
+            logger.info('守护进程未运行')
+        else:
+            logger.info('PID：{pid}  运行：{uptime}秒  请求：{requests}  配置：{conf}'.format(**status))
+            logger.info('已认证：{}'.format(', '.join(status['clouds']) or '无'))
+        return 0
+    else:
+        logger.error('不支持的参数：{}'.format(action))
+        return 1
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""查找最新修改的图片
+
+基于os.scandir，复用DirEntry自带的文件类型，每个文件只stat一次。
+可选的mtime索引记录每个目录的修改时间及其中的图片，目录未变化时不再列举，只stat已知的图片。
+"""
+import heapq
+import json
+import logging
+import os
+import traceback
+
+from cache import atomic_write
+
+
+logger = logging.getLogger(__name__)
+
+
+def scan_dir(path, accept=None):
+    """列举目录，返回 ([(文件名, 修改时间)], [子目录名])"""
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.'):
+                        subdirs.append(entry.name)
+                elif entry.is_file() and (accept is None or accept(entry.name)):
+                    files.append((entry.name, entry.stat().st_mtime))
+            except OSError:
+                # 列举期间被删除
+                pass
+    return files, subdirs
+
+
+class MtimeIndex:
+    """持久化的目录索引：{目录: [目录修改时间, [[文件名, 修改时间], ...], [子目录名, ...]]}
+
+    新建、删除、重命名文件都会更新目录的修改时间，因此截图等新保存的文件总能被发现。
+    原地改写文件不会更新目录的修改时间，所以复用索引时仍重新stat其中的图片。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        try:
+            with open(path, 'rb') as fp:
+                self.dirs = json.loads(fp.read().decode('utf-8'))
+        except FileNotFoundError:
+            self.dirs = {}
+        except (ValueError, OSError):
+            logger.debug(traceback.format_exc())
+            self.dirs = {}
+
+    def scan(self, path, accept=None):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            if self.dirs.pop(path, None) is not None:
+                self.dirty = True
+            return [], []
+        cached = self.dirs.get(path)
+        if cached and cached[0] == mtime:
+            files = []
+            for name, _ in cached[1]:
+                try:
+                    files.append((name, os.stat(os.path.join(path, name)).st_mtime))
+                except OSError:
+                    continue
+            if files != [tuple(f) for f in cached[1]]:
+                cached[1] = files
+                self.dirty = True
+            return files, cached[2]
+        files, subdirs = scan_dir(path, accept)
+        self.dirs[path] = [mtime, files, subdirs]
+        self.dirty = True
+        return files, subdirs
+
+    def save(self):
+        if self.dirty:
+            atomic_write(self.path, json.dumps(self.dirs, ensure_ascii=False).encode('utf-8'))
+            self.dirty = False
+
+
+def iter_images(dirs, accept=None, recursive=False, index=None):
+    """逐个返回 (路径, 修改时间)"""
+    stack = list(reversed(dirs))
+    while stack:
+        d = stack.pop()
+        try:
+            if index is not None:
+                files, subdirs = index.scan(os.path.abspath(d), accept)
+            else:
+                files, subdirs = scan_dir(d, accept)
+        except OSError:
+            logger.debug(traceback.format_exc())
+            continue
+        for name, mtime in files:
+            yield (name if d == os.curdir else os.path.join(d, name)), mtime
+        if recursive:
+            stack.extend(os.path.join(d, s) for s in reversed(subdirs))
+
+
+def newest(dirs, count=1, accept=None, recursive=False, index=None):
+    """返回最新修改的count个图片，从新到旧排列"""
+    found = heapq.nlargest(count, iter_images(dirs, accept, recursive, index), key=lambda f: f[1])
+    if index is not None:
+        index.save()
+    return [path for path, _ in found]
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""按体积上限和/或画质下限选择输出格式和编码参数
+
+对每种格式在质量区间内做k分搜索：每一轮并发编码k个候选质量（Pillow编码时释放GIL），
+逐步缩小区间，找到满足目标的最小输出。JPEG同时比较4:2:0和4:4:4两种色度抽样。
+多种格式并发编码，取满足目标的最小结果。
+画质用SSIM衡量，需要NumPy；未安装时只按体积搜索。
+"""
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# Pillow的subsampling参数：0为4:4:4，2为4:2:0
+SUBSAMPLINGS = (2, 0)
+# 格式名: (Pillow格式, 扩展名, 是否支持Alpha通道, 额外的编码参数)
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', False, {'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', True, {'method': 4}),
+    'avif': ('AVIF', '.avif', True, {}),
+    'png': ('PNG', '.png', True, {'optimize': True, 'compress_level': 9, 'icc_profile': None}),
+}
+
+
+def available(fmt):
+    """当前Pillow能否编码该格式"""
+    from PIL import features
+
+    return fmt in ('jpeg', 'png') or (fmt in FORMATS and bool(features.check(fmt)))
+
+
+def to_palette(img):
+    """颜色不超过256种时，无损转为8位调色板图片，透明度存入tRNS；否则返回None"""
+    img = img if img.mode == 'RGBA' else img.convert('RGBA')
+    colors = img.getcolors(256)
+    if colors is None:
+        return None
+    colors = [c for _, c in colors]
+    alphas = {c[:3]: c[3] for c in colors}
+    pal = None
+    if len(alphas) == len(colors):
+        # 透明度由RGB决定时，用Pillow的量化完成映射，比逐像素查表快得多
+        pal = quantize_exact(img.convert('RGB'), len(colors))
+    if pal is None:
+        return map_palette(img, colors)
+    palette = pal.getpalette()
+    entries = [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+    if any(a != 255 for a in alphas.values()):
+        pal.info['transparency'] = bytes(alphas.get(e, 255) for e in entries)
+    return pal
+
+
+def quantize_exact(rgb, colors):
+    """颜色数不超过调色板大小时，MAXCOVERAGE量化的结果与原图一致。校验不一致时返回None"""
+    from PIL import Image
+
+    pal = rgb.quantize(colors, Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+    if pal.convert('RGB').tobytes() != rgb.tobytes():
+        return None
+    return pal
+
+
+def map_palette(img, colors):
+    """逐像素查表转为调色板图片，RGB相同而透明度不同时使用"""
+    from PIL import Image
+
+    lut = {int.from_bytes(bytes(c), sys.byteorder): i for i, c in enumerate(colors)}
+    pixels = memoryview(img.tobytes()).cast('I')
+    pal = Image.frombytes('P', img.size, bytes(map(lut.__getitem__, pixels)))
+    pal.putpalette([v for c in colors for v in c[:3]])
+    if any(c[3] != 255 for c in colors):
+        pal.info['transparency'] = bytes(c[3] for c in colors)
+    return pal
+
+
+def encode_png(img):
+    """最大压缩级别重新编码，不写入ICC、EXIF等附加数据块；颜色数允许时再试调色板，取最小者"""
+    _, _, _, extra = FORMATS['png']
+    candidates = [img]
+    pal = to_palette(img)
+    if pal is not None:
+        candidates.append(pal)
+    results = []
+    for im in candidates:
+        buf = io.BytesIO()
+        params = dict(extra)
+        if 'transparency' in im.info:
+            params['transparency'] = im.info['transparency']
+        im.save(buf, format='PNG', **params)
+        results.append(buf.getvalue())
+    return min(results, key=len)
+
+
+def encode(img, fmt='jpeg', quality=None, subsampling=None):
+    pil_format, _, alpha, extra = FORMATS[fmt]
+    if img.mode not in ('RGB', 'L') and not (alpha and img.mode == 'RGBA'):
+        img = img.convert('RGBA' if alpha and 'A' in img.getbands() else 'RGB')
+    if fmt == 'png':
+        return encode_png(img)
+    buf = io.BytesIO()
+    params = dict(extra, format=pil_format)
+    if quality is not None:
+        params['quality'] = quality
+    if subsampling is not None:
+        params['subsampling'] = subsampling
+    img.save(buf, **params)
+    return buf.getvalue()
+
+
+def encode_jpeg(img, quality=None, subsampling=None):
+    return encode(img, 'jpeg', quality, subsampling)
+
+
+def has_numpy():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def luma(img):
+    import numpy as np
+
+    return np.asarray(img.convert('L'), dtype=np.float64)
+
+
+def ssim(a, b, window=7):
+    """两幅灰度图（NumPy数组）的平均SSIM，用积分图计算滑动窗口均值"""
+    import numpy as np
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    if min(a.shape) < window:
+        window = min(a.shape)
+
+    def mean(x):
+        s = np.pad(x, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+        w = window
+        return (s[w:, w:] - s[:-w, w:] - s[w:, :-w] + s[:-w, :-w]) / (w * w)
+
+    mu_a, mu_b = mean(a), mean(b)
+    var_a = mean(a * a) - mu_a * mu_a
+    var_b = mean(b * b) - mu_b * mu_b
+    cov = mean(a * b) - mu_a * mu_b
+    num = (2 * mu_a * mu_b + c1) * (2 * cov + c2)
+    den = (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    return float((num / den).mean())
+
+
+class QualitySearch:
+    """对一幅图片搜索某种格式的质量（JPEG还有色度抽样）"""
+
+    def __init__(self, img, max_bytes=None, min_ssim=None, qmin=30, qmax=95, threads=4, fmt='jpeg'):
+        self.fmt = fmt
+        alpha = FORMATS[fmt][2] and 'A' in img.getbands()
+        if img.mode not in ('RGB', 'L') or alpha:
+            img = img.convert('RGBA' if alpha else 'RGB')
+        self.img = img
+        self.max_bytes = max_bytes
+        self.min_ssim = min_ssim
+        if min_ssim and not has_numpy():
+            logger.warning('未安装NumPy，忽略画质下限')
+            self.min_ssim = None
+        self.qmin = qmin
+        self.qmax = qmax
+        self.threads = max(1, threads)
+        self.reference = luma(self.img) if self.min_ssim else None
+        # {(质量, 色度抽样): (数据, SSIM)}
+        self.results = {}
+
+    def evaluate(self, candidate):
+        if candidate not in self.results:
+            q, sub = candidate
+            # Image.save把编码参数存在图片对象上，并发编码时每个线程使用各自的副本
+            data = encode(self.img.copy(), self.fmt, q, sub)
+            score = None
+            if self.reference is not None:
+                from PIL import Image
+
+                with Image.open(io.BytesIO(data)) as decoded:
+                    score = ssim(self.reference, luma(decoded))
+            self.results[candidate] = (data, score)
+        return self.results[candidate]
+
+    def fits(self, candidate):
+        return self.max_bytes is None or len(self.evaluate(candidate)[0]) <= self.max_bytes
+
+    def good(self, candidate):
+        return self.min_ssim is None or self.evaluate(candidate)[1] >= self.min_ssim
+
+    def meets(self, candidate):
+        return self.fits(candidate) and self.good(candidate)
+
+    def first(self, executor, sub, pred):
+        """返回使pred为真的最小质量（pred随质量单调由假变真），不存在时返回None"""
+        lo, hi = self.qmin, self.qmax + 1
+        while lo < hi:
+            # 区间[lo, hi)内取k个等分点并发编码
+            k = min(self.threads, hi - lo)
+            points = sorted({lo + (hi - lo) * (i + 1) // (k + 1) for i in range(k)})
+            list(executor.map(self.evaluate, [(q, sub) for q in points if (q, sub) not in self.results]))
+            flags = [pred((q, sub)) for q in points]
+            if flags[0]:
+                hi = points[0]
+            elif not flags[-1]:
+                lo = points[-1] + 1
+            else:
+                i = flags.index(True)
+                lo, hi = points[i - 1] + 1, points[i]
+        return lo if lo <= self.qmax else None
+
+    def search_one(self, executor, sub):
+        """返回该色度抽样下满足目标的候选"""
+        if self.min_ssim is not None:
+            q = self.first(executor, sub, self.good)
+            if q is not None and self.fits((q, sub)):
+                return q, sub
+        if self.max_bytes is not None:
+            # 画质达不到时，取体积上限内质量最高的
+            q = self.first(executor, sub, lambda c: not self.fits(c))
+            q = self.qmax if q is None else q - 1
+            return max(q, self.qmin), sub
+        return self.qmax, sub
+
+    def run(self):
+        """返回 (数据, 质量, 色度抽样)"""
+        with ThreadPoolExecutor(self.threads) as executor:
+            subs = SUBSAMPLINGS if self.fmt == 'jpeg' and self.img.mode == 'RGB' else (None,)
+            candidates = [self.search_one(executor, sub) for sub in subs]
+        # 优先满足目标，再取最小
+        best = min(candidates, key=lambda c: (not self.meets(c), len(self.results[c][0])))
+        q, sub = best
+        logger.debug('{} quality={} subsampling={} size={} ssim={}'.format(
+            self.fmt, q, sub, len(self.results[best][0]), self.results[best][1]))
+        return self.results[best][0], q, sub
+
+
+def search_jpeg(img, max_bytes=None, min_ssim=None, threads=4):
+    """返回满足体积上限和画质下限的最小JPEG数据"""
+    return QualitySearch(img, max_bytes, min_ssim, threads=threads).run()[0]
+
+
+def encode_best(img, formats, qualities=None, max_bytes=None, min_ssim=None, threads=4):
+    """用各格式并发编码同一幅图片，返回满足目标的最小结果 (格式, 数据)
+
+    qualities为{格式: 质量}；设置了max_bytes或min_ssim时按目标搜索质量，忽略qualities。
+    """
+    qualities = qualities or {}
+    searching = bool(max_bytes or min_ssim)
+
+    def run(fmt):
+        if fmt == 'png':
+            # 无损格式，不需要搜索质量
+            data = encode(img.copy(), fmt)
+            return fmt, data, max_bytes is None or len(data) <= max_bytes
+        if searching:
+            search = QualitySearch(img, max_bytes, min_ssim, threads=max(1, threads // len(formats)), fmt=fmt)
+            data, q, sub = search.run()
+            return fmt, data, search.meets((q, sub))
+        return fmt, encode(img.copy(), fmt, qualities.get(fmt)), True
+
+    with ThreadPoolExecutor(len(formats)) as executor:
+        results = list(executor.map(run, formats))
+    for fmt, data, _ in results:
+        logger.debug('{}: {} bytes'.format(fmt, len(data)))
+    # 优先满足目标，再取最小；大小相同时按formats中的顺序
+    fmt, data, _ = min(results, key=lambda r: (not r[2], len(r[1])))
+    return fmt, data
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""进程内的简易S3风格对象存储，以及访问它的LPic子类
+
+用于在没有网络的机器上压测并发、重试和批量操作。服务端可注入固定延迟、带宽限制和错误率：
+
+    with FakeS3Server(latency=0.05, bandwidth=1 << 20, error_rate=0.1, seed=1) as server:
+        ...  # 配置 Endpoint: server.url
+
+也可以单独运行：python fakes3.py --port 9000 --latency 0.05
+
+支持的请求（不校验签名）：
+    PUT/GET/HEAD/DELETE /<bucket>/<key>
+    GET /<bucket>?prefix=&marker=&max-keys=   列举，返回ListBucketResult
+    POST /<bucket>?delete                     批量删除，请求和返回均为S3格式的XML
+"""
+import argparse
+import http.client
+import logging
+import random
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlparse
+from xml.etree import ElementTree
+
+import retry
+from lpic import LPic
+
+
+logger = logging.getLogger(__name__)
+
+
+class FakeS3Server:
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None, error_rate=0, seed=None):
+        self.latency = latency
+        # 每个请求、响应体的传输速率（字节/秒）
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        # {bucket: {key: (data, 修改时间)}}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'inflight': 0, 'max_inflight': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self.handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def throttle(self, size):
+        if self.bandwidth:
+            sleep(size / self.bandwidth)
+
+    def fail(self):
+        with self.lock:
+            return self.error_rate and self.random.random() < self.error_rate
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+            def reply(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body and self.command != 'HEAD':
+                    server.throttle(len(body))
+                    self.wfile.write(body)
+
+            def dispatch(self):
+                with server.lock:
+                    server.stats['requests'] += 1
+                    server.stats['inflight'] += 1
+                    server.stats['max_inflight'] = max(server.stats['max_inflight'], server.stats['inflight'])
+                try:
+                    # 先读完请求体，注入错误后连接仍可复用
+                    body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                    server.throttle(len(body))
+                    if server.latency:
+                        sleep(server.latency)
+                    if server.fail():
+                        with server.lock:
+                            server.stats['errors'] += 1
+                        self.reply(503, b'SlowDown', {'Retry-After': '0'})
+                    else:
+                        self.reply(*self.respond(body))
+                finally:
+                    with server.lock:
+                        server.stats['inflight'] -= 1
+
+            def respond(self, body):
+                """返回 (状态码, 响应体, 响应头)"""
+                url = urlparse(self.path)
+                query = parse_qs(url.query, keep_blank_values=True)
+                bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+                xml = {'Content-Type': 'application/xml'}
+                with server.lock:
+                    objects = server.buckets.setdefault(bucket, {})
+                    if self.command == 'PUT' and key:
+                        objects[key] = (body, time())
+                        return 200, b'', None
+                    if self.command in ('GET', 'HEAD') and key:
+                        if key not in objects:
+                            return 404, b'', None
+                        return 200, objects[key][0], None
+                    if self.command == 'DELETE' and key:
+                        objects.pop(key, None)
+                        return 204, b'', None
+                    if self.command == 'GET':
+                        return 200, self.list_objects(objects, query), xml
+                    if self.command == 'POST' and 'delete' in query:
+                        return 200, self.delete_objects(objects, body), xml
+                return 400, b'', None
+
+            do_GET = do_PUT = do_HEAD = do_DELETE = do_POST = dispatch
+
+            @staticmethod
+            def list_objects(objects, query):
+                prefix = query.get('prefix', [''])[0]
+                marker = query.get('marker', [''])[0]
+                max_keys = int(query.get('max-keys', ['1000'])[0])
+                keys = sorted(k for k in objects if k.startswith(prefix) and k > marker)
+                root = ElementTree.Element('ListBucketResult')
+                for key in keys[:max_keys]:
+                    contents = ElementTree.SubElement(root, 'Contents')
+                    ElementTree.SubElement(contents, 'Key').text = key
+                    mtime = datetime.fromtimestamp(objects[key][1], timezone.utc)
+                    ElementTree.SubElement(contents, 'LastModified').text = mtime.isoformat()
+                    ElementTree.SubElement(contents, 'Size').text = str(len(objects[key][0]))
+                truncated = len(keys) > max_keys
+                ElementTree.SubElement(root, 'IsTruncated').text = 'true' if truncated else 'false'
+                if truncated:
+                    ElementTree.SubElement(root, 'NextMarker').text = keys[max_keys - 1]
+                return ElementTree.tostring(root)
+
+            @staticmethod
+            def delete_objects(objects, body):
+                root = ElementTree.Element('DeleteResult')
+                for key in ElementTree.fromstring(body).iter('Key'):
+                    objects.pop(key.text, None)
+                    ElementTree.SubElement(ElementTree.SubElement(root, 'Deleted'), 'Key').text = key.text
+                return ElementTree.tostring(root)
+
+        return Handler
+
+
+class FakeS3LPic(LPic):
+    """访问FakeS3Server（或兼容的无签名S3端点）的云服务"""
+    BATCH_DELETE_SIZE = 1000
+
+    def __init__(self, conf=None, **option):
+        super(FakeS3LPic, self).__init__(conf, **option)
+        self.cloud_name = '测试存储'
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def auth(self):
+        self.client = urlparse(self.cloud['Endpoint'])
+
+    @property
+    def web_url(self):
+        return '{}/{}?prefix='.format(self.cloud['Endpoint'].rstrip('/'), self.cloud['Bucket'])
+
+    def presign(self, method, key, headers=None, params=None):
+        # 不校验签名
+        url = '{}/{}/{}'.format(self.cloud['Endpoint'].rstrip('/'), self.cloud['Bucket'], quote(key))
+        if params:
+            url += '?' + urlencode(params)
+        return url, dict(headers or {})
+
+    def connection(self):
+        """每个线程一个长连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.client.hostname, self.client.port, timeout=60)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """返回 (状态码, 响应体)。连接被服务端关闭时重连一次，限流和5xx错误抛出TransientError"""
+        path = '/{}/{}'.format(self.cloud['Bucket'], path)
+        for attempt in range(2):
+            conn = self.connection()
+            if attempt and hasattr(body, 'seek'):
+                body.seek(0)
+            try:
+                conn.request(method, path, body, headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+                continue
+            retryable, throttled, retry_after = retry.classify_status(resp.status, resp.getheader('Retry-After'))
+            if retryable:
+                raise retry.TransientError('HTTP {} {}'.format(resp.status, data.decode('utf-8', 'replace')),
+                                           resp.status, retry_after, throttled)
+            return resp.status, data
+
+    def upload(self, file, prefix=''):
+        file = self.as_picture(file)
+        key = quote(prefix + file.name)
+        if isinstance(file.data, bytes):
+            status, _ = self.request('PUT', key, file.data)
+        else:
+            # 以文件对象作为请求体，http.client分块读取发送
+            with open(file.data, 'rb') as fp:
+                status, _ = self.request('PUT', key, fp, {'Content-Length': str(self.picture_size(file))})
+        return 200 <= status < 300
+
+    def upload_multipart(self, file, prefix=''):
+        return self.upload(file, prefix)
+
+    def iter_objects(self, prefix):
+        marker = ''
+        while True:
+            status, body = self.request('GET', '?prefix={}&marker={}&max-keys={}'.format(
+                quote(prefix), quote(marker), self.PAGE_SIZE))
+            if status != 200:
+                raise IOError('列举失败：HTTP {}'.format(status))
+            root = ElementTree.fromstring(body)
+            for contents in root.iter('Contents'):
+                mtime = datetime.fromisoformat(contents.findtext('LastModified'))
+                yield contents.findtext('Key'), mtime.timestamp()
+            if root.findtext('IsTruncated') != 'true':
+                break
+            marker = root.findtext('NextMarker')
+
+    def delete(self, key):
+        status, _ = self.request('DELETE', quote(key))
+        return 200 <= status < 300
+
+    def exists(self, key):
+        status, _ = self.request('HEAD', quote(key))
+        return status == 200
+
+    def delete_many(self, keys):
+        root = ElementTree.Element('Delete')
+        for key in keys:
+            ElementTree.SubElement(ElementTree.SubElement(root, 'Object'), 'Key').text = key
+        status, body = self.request('POST', '?delete', ElementTree.tostring(root))
+        if status != 200:
+            return [], {k: 'HTTP {}'.format(status) for k in keys}
+        deleted = {k.text for k in ElementTree.fromstring(body).iter('Key')}
+        return [k for k in keys if k in deleted], {k: '删除失败' for k in keys if k not in deleted}
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='运行简易S3风格对象存储，用于离线测试')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=LPic.parse_size, help='传输速率，如1M表示每秒1MB')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回503的概率')
+    parser.add_argument('--seed', type=int, help='随机数种子，用于复现错误序列')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    server = FakeS3Server(args.host, args.port, args.latency, args.bandwidth, args.error_rate, args.seed)
+    logger.info('Endpoint: {}'.format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
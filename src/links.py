@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""外链模板和批量外链清单
+
+UrlPrefix和LinkFormat每次上传（批量上传时每批）只解析一次：日期时间先替换好，$VAR转换为str.format的字段，
+之后每个文件只需一次format_map。
+"""
+import os
+import re
+
+# 按长度从长到短匹配，$FILENAME不会被当作$FILE...的前缀
+VARIABLES = ('PREFIX', 'KEY', 'FILENAME', 'FILEPART', 'FILEEXT', 'URL',
+             'BASENAME', 'BASEPART', 'BASEEXT', 'FULLPATH', 'DIRNAME')
+# 依赖本地文件路径的变量
+LOCAL_VARIABLES = {'BASENAME', 'BASEPART', 'BASEEXT', 'FULLPATH', 'DIRNAME'}
+VARIABLE_RE = re.compile(r'\$({})'.format('|'.join(sorted(VARIABLES, key=len, reverse=True))))
+DATETIME_RE = re.compile(r'\$(DATETIME|DATE)(?:\((.*?)\))?')
+DEFAULT_FORMATS = {'DATETIME': '%Y-%m-%d_%H%M%S', 'DATE': '%Y-%m-%d'}
+
+MANIFEST_FORMATS = ('jsonl', 'csv', 'md')
+MANIFEST_FIELDS = ('cloud', 'source', 'key', 'url', 'link', 'size')
+
+
+def replace_datetime(string, datetime_):
+    """替换$DATETIME、$DATE，括号中可指定strftime格式，如$DATE(%Y/%m)"""
+    def repl(m):
+        value = datetime_ if m.group(1) == 'DATETIME' else datetime_.date()
+        return value.strftime(m.group(2) or DEFAULT_FORMATS[m.group(1)])
+
+    return DATETIME_RE.sub(repl, string)
+
+
+def split_url_prefix(url_prefix):
+    """返回 (host, prefix)。http(s)的URL中带路径时，路径部分作为上传的前缀"""
+    parts = url_prefix.split('/', 3)
+    if len(parts) == 4 and parts[0].lower() in ('http:', 'https:') and not parts[1]:
+        prefix = parts[3]
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return '/'.join(parts[:3]), prefix
+    return url_prefix.rstrip('/'), ''
+
+
+class LinkTemplate:
+    """编译后的外链格式。host和prefix由UrlPrefix得到，prefix应已URL编码"""
+
+    def __init__(self, host, prefix='', link_format=None, markdown=False, now=None):
+        self.host = host
+        self.prefix = prefix
+        if link_format is None:
+            link_format = '![]($URL)' if markdown else '$URL'
+        if now is not None:
+            link_format = replace_datetime(link_format, now)
+        self.names = set(VARIABLE_RE.findall(link_format))
+        # 先转义原有的花括号，再把$VAR换成{VAR}
+        escaped = link_format.replace('{', '{{').replace('}', '}}')
+        self.format = VARIABLE_RE.sub(lambda m: '{' + m.group(1) + '}', escaped)
+        self.url_only = self.format == '{URL}'
+        self.local = bool(self.names & LOCAL_VARIABLES)
+
+    def variables(self, local_file, key_name):
+        key = self.prefix + key_name
+        env = {'PREFIX': self.prefix, 'KEY': key, 'FILENAME': key_name, 'URL': self.host + '/' + key}
+        env['FILEPART'], env['FILEEXT'] = os.path.splitext(key_name)
+        if self.local:
+            local_file = local_file if isinstance(local_file, str) else ''
+            env['BASENAME'] = os.path.basename(local_file)
+            env['BASEPART'], env['BASEEXT'] = os.path.splitext(env['BASENAME'])
+            env['FULLPATH'] = os.path.abspath(local_file) if local_file else ''
+            env['DIRNAME'] = os.path.dirname(local_file)
+        return env
+
+    def url(self, key_name):
+        return self.host + '/' + self.prefix + key_name
+
+    def render(self, local_file, key_name):
+        if self.url_only:
+            return self.url(key_name)
+        return self.format.format_map(self.variables(local_file, key_name))
+
+    def record(self, local_file, key_name):
+        """外链清单中的一行"""
+        return {
+            'source': os.path.abspath(local_file) if isinstance(local_file, str) else None,
+            'key': self.prefix + key_name,
+            'url': self.url(key_name),
+            'link': self.render(local_file, key_name),
+        }
+
+
+def manifest_format(path, fmt=None):
+    """未指定格式时按扩展名判断，默认jsonl"""
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path or '')[1].lower().lstrip('.')
+    return {'csv': 'csv', 'md': 'md', 'markdown': 'md'}.get(ext, 'jsonl')
+
+
+def write_manifest(records, fp, fmt='jsonl'):
+    """把外链清单一次性写入文本文件对象"""
+    records = list(records)
+    if fmt == 'csv':
+        import csv
+
+        writer = csv.DictWriter(fp, MANIFEST_FIELDS, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    elif fmt == 'md':
+        # 图片名取源文件名，没有时取key
+        lines = ['![{}]({})'.format(os.path.splitext(os.path.basename(r.get('source') or r['key']))[0], r['url'])
+                 for r in records]
+        fp.write(''.join(line + '\n' for line in lines))
+    else:
+        import json
+
+        fp.write(''.join(json.dumps({k: r.get(k) for k in MANIFEST_FIELDS}, ensure_ascii=False) + '\n'
+                         for r in records))
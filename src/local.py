@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlparse
+from urllib.request import url2pathname
+
+from cache import atomic_write
+from lpic import LPic
+
+
+class LocalLPic(LPic):
+    """把本地目录当作Bucket，用于离线测试和压测上传流程"""
+    BATCH_DELETE_SIZE = 1000
+
+    def __init__(self, conf=None, **option):
+        super(LocalLPic, self).__init__(conf, **option)
+        self.cloud_name = '本地目录'
+        self.root = None
+
+    def auth(self):
+        root = os.path.expanduser(self.cloud.get('Root') or '~/lpic')
+        self.root = os.path.abspath(os.path.join(root, self.cloud.get('Bucket') or ''))
+        os.makedirs(self.root, exist_ok=True)
+        self.client = self.root
+
+    @property
+    def web_url(self):
+        return pathlib.Path(self.root).as_uri()
+
+    def parse_url_prefix(self):
+        """UrlPrefix为空或为file:// URL时，外链指向本地文件，前缀为相对于Bucket目录的路径"""
+        url = self.replace_datetime(self.conf.get('UrlPrefix') or '', self.now)
+        if urlparse(url).scheme not in ('', 'file'):
+            return super(LocalLPic, self).parse_url_prefix()
+        path = os.path.abspath(url2pathname(urlparse(url).path)) if url else self.root
+        rel = os.path.relpath(path, self.root)
+        prefix = '' if rel == '.' or rel.startswith('..') else rel.replace(os.sep, '/') + '/'
+        return pathlib.Path(self.root).as_uri(), quote(prefix)
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, *key.split('/')))
+        if os.path.commonpath([path, self.root]) != self.root or path == self.root:
+            raise ValueError('无效的key：{}'.format(key))
+        return path
+
+    def upload(self, file, prefix=''):
+        file = self.as_picture(file)
+        if self.use_multipart(file):
+            return self.upload_multipart(file, prefix)
+        path = self.path(prefix + file.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，列举时不会看到写了一半的文件
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.lpic-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                if isinstance(file.data, bytes):
+                    fp.write(file.data)
+                else:
+                    with open(file.data, 'rb') as src:
+                        shutil.copyfileobj(src, fp, self.part_size)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return True
+
+    def upload_multipart(self, file, prefix=''):
+        """与云服务的分片上传相同：各分片并发写入暂存目录，已完成的分片记入断点文件，
+        中断后再次上传同一文件时跳过，全部完成后合并"""
+        file = self.as_picture(file)
+        path = self.path(prefix + file.name)
+        st = os.stat(file.data)
+        part_size = self.part_size
+        ident = json.dumps([os.path.abspath(file.data), st.st_mtime_ns, st.st_size, path, part_size])
+        journal = os.path.join(self.journal_dir(), hashlib.sha1(ident.encode('utf-8')).hexdigest())
+        try:
+            with open(journal + '.json', encoding='utf-8') as fp:
+                done = set(json.load(fp))
+        except (OSError, ValueError):
+            done = set()
+        os.makedirs(journal, exist_ok=True)
+        lock = threading.Lock()
+
+        def put(i):
+            self.write_part(file.data, i, part_size, os.path.join(journal, str(i)))
+            with lock:
+                done.add(i)
+                atomic_write(journal + '.json', json.dumps(sorted(done)).encode('utf-8'))
+
+        count = max(1, -(-st.st_size // part_size))
+        with ThreadPoolExecutor(self.part_threads) as executor:
+            list(executor.map(put, [i for i in range(count) if i not in done]))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.lpic-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for i in range(count):
+                    with open(os.path.join(journal, str(i)), 'rb') as part:
+                        shutil.copyfileobj(part, fp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        shutil.rmtree(journal)
+        os.remove(journal + '.json')
+        return True
+
+    @staticmethod
+    def write_part(filename, i, part_size, dest):
+        with open(filename, 'rb') as src:
+            src.seek(i * part_size)
+            atomic_write(dest, src.read(part_size))
+
+    def iter_objects(self, prefix):
+        # 只遍历前缀所在的目录
+        base = os.path.join(self.root, *prefix.split('/')[:-1])
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for name in filenames:
+                key = name if rel == '.' else rel + '/' + name
+                if name.startswith('.lpic-') or not key.startswith(prefix):
+                    continue
+                try:
+                    yield key, os.stat(os.path.join(dirpath, name)).st_mtime
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
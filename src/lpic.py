@@ -1,32 +1,56 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import glob
 import hashlib
+import heapq
+import importlib
+import io
+import itertools
 import logging
 import os
 import re
-import shutil
-import tempfile
+import sys
+import threading
 import traceback
 import uuid
-import webbrowser
+from collections import namedtuple
 from datetime import datetime
-from functools import wraps
-from urllib.parse import quote, urlparse
+from functools import partial, wraps
+from operator import itemgetter
+from urllib.parse import quote
 
-import pyperclip
-import yaml
-from PIL import Image
+import links
+import timing
 
 
 logger = logging.getLogger(__name__)
 
+# 云服务 -> (模块, 类名)。仅在使用时才导入对应模块及其SDK
+PROVIDERS = {
+    'aliyun': ('aliyun', 'AliyunLPic'),
+    'qiniu': ('qiniu_', 'QiniuLPic'),
+    'tencent': ('tencent', 'TencentLPic'),
+    'local': ('local', 'LocalLPic'),
+    'fakes3': ('fakes3', 'FakeS3LPic'),
+}
+
+# 待上传的图片。name为文件名，data为内存中的bytes或者本地文件路径，width、height为图片尺寸
+Picture = namedtuple('Picture', ['name', 'data', 'width', 'height'], defaults=(None, None))
+
 
 class LPic:
     LPIC_EXAMPLE = os.path.join(os.path.dirname(__file__), 'lpic.example.yml')
     LPIC_YML = os.path.join(os.path.dirname(__file__), 'lpic.yml')
-    NOW = datetime.now()
     MAX_KEYS = 100
+    # 单次批量删除请求的最大key数
+    BATCH_DELETE_SIZE = 1
+    # 列举对象时每页的数量
+    PAGE_SIZE = 1000
     ENCODINGS = ('utf-8', 'gb18030', 'gb2312', 'gbk', 'utf_8_sig')
+    PIC_SUFFIX = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tga', '.ppm', '.webp', '.avif')
+    # 影响预处理结果的配置项
+    PREPROCESS_KEYS = ('MaxSize', 'FillAlpha', 'AutoCompress', 'JpegQuality', 'TargetSize', 'MinSSIM',
+                       'OutputFormats', 'WebpQuality', 'AvifQuality', 'MaxPixels', 'OptimizePNG')
 
     def __init__(self, conf=None, **option):
         self.cloud_name = '云'
@@ -37,9 +61,18 @@ class LPic:
         self.conf = {}
         self.use = None
         self.cloud = {}
-        self._tmp_dir = None
-        self.tmp_dir = None
         self.option = option
+        # 命名和UrlPrefix中$DATE等使用的时间，每次上传时更新
+        self.now = datetime.now()
+        self._digests = {}
+        self._upload_cache = None
+        self._output_cache = None
+        self._catalog = None
+        self._link_template = None
+        self._limiter = None
+        self._aio = None
+        # 设置了--manifest时，收集本次上传的外链
+        self.records = []
 
     def auth(self):
         pass
@@ -51,15 +84,80 @@ class LPic:
     def upload(self, file, prefix=''):
         raise NotImplementedError
 
-    def list(self, prefix):
+    def iter_objects(self, prefix):
+        """逐页遍历前缀下的全部对象，产出 (key, 修改时间戳)"""
         raise NotImplementedError
 
+    def list(self, prefix, limit=None, oldest=False):
+        """按修改时间从新到旧（oldest为True时从旧到新）返回key，最多limit个。
+        只保留limit大小的堆，内存占用与对象总数无关"""
+        select = heapq.nsmallest if oldest else heapq.nlargest
+
+        def run():
+            return [key for key, _ in select(limit or self.MAX_KEYS, self.iter_objects(prefix), key=itemgetter(1))]
+        return self.retrying(run, name='list')
+
     def delete(self, key):
         raise NotImplementedError
 
+    def delete_many(self, keys):
+        """删除不超过BATCH_DELETE_SIZE个key，返回 (已删除的key列表, {删除失败的key: 原因})"""
+        deleted, failed = [], {}
+        for key in keys:
+            if self.delete(key):
+                deleted.append(key)
+            else:
+                failed[key] = '删除失败'
+        return deleted, failed
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def presign(self, method, key, headers=None, params=None):
+        """返回云服务签名的 (url, headers)，供aio.py用asyncio直接发送请求。key为空表示列举Bucket"""
+        raise NotImplementedError
+
+    @property
+    def aio(self):
+        """AsyncUpload为真时，上传经由后台事件循环中的连接池发送"""
+        if self._aio is None:
+            from aio import SyncProvider
+            self._aio = SyncProvider(self)
+        return self._aio
+
+    def classify_error(self, exc):
+        """返回 (可否重试, 是否被限流, Retry-After秒数)。各云服务按SDK的异常类型覆盖"""
+        import retry
+
+        return retry.classify(exc)
+
+    @property
+    def limiter(self):
+        """同一Bucket的请求共用的并发上限"""
+        if self._limiter is None:
+            import retry
+
+            self._limiter = retry.AIMDLimiter(self.conf.get('MaxInflight') or self.conf.get('UploadThreads') or 8)
+        return self._limiter
+
+    def retrying(self, func, *args, **kwargs):
+        """按Retries、RetryBackoff、RetryMaxDelay重试可重试的错误"""
+        import retry
+
+        retries = self.conf.get('Retries')
+        backoff = retry.Backoff(3 if retries is None else retries, self.conf.get('RetryBackoff') or 0.5,
+                                self.conf.get('RetryMaxDelay') or 30)
+        return retry.call(func, *args, backoff=backoff, limiter=self.limiter, classifier=self.classify_error,
+                          **kwargs)
+
+    def upload_multipart(self, file, prefix=''):
+        """分片并发上传，中断后可续传"""
+        raise NotImplementedError
+
     def close(self):
         pass
 
+    @timing.timed('config')
     def load_config(self):
         try:
             # 只加载默认的'conf'项
@@ -84,70 +182,103 @@ class LPic:
         self.cloud = self._conf[self.use]
         return True
 
-    def create_temp_dir(self):
-        self.tmp_dir = self.conf.get('TmpDir')
-        if self.tmp_dir:
-            os.makedirs(self.tmp_dir, exist_ok=True)
-        else:
-            self._tmp_dir = tempfile.TemporaryDirectory()
-            self.tmp_dir = self._tmp_dir.name
-
     def open_yaml(self, yml):
-        data = {}
-        for ec in self.ENCODINGS:
-            try:
-                with open(yml, encoding=ec) as fp:
-                    if hasattr(yaml, 'FullLoader'):
-                        data = yaml.load(fp, Loader=yaml.FullLoader)
-                    else:
-                        data = yaml.load(fp)
-                break
-            except UnicodeDecodeError:
-                pass
-            except yaml.YAMLError:
-                logger.error(traceback.format_exc())
-                return data
-        return data
+        """解析结果按文件的修改时间和大小缓存，见config.py"""
+        import config
+
+        with timing.span('yaml', file=os.path.basename(yml)) as s:
+            data, s.fields['source'] = config.load(yml, self.ENCODINGS)
+        return data or {}
 
     # noinspection PyBroadException
+    def flush(self):
+        """保存缓存等本地状态"""
+        try:
+            if self._upload_cache:
+                self._upload_cache.save()
+        except Exception:
+            logger.debug(traceback.format_exc())
+
     def exit(self):
         try:
+            if self._aio:
+                self._aio.close()
+                self._aio = None
             self.close()
         except Exception:
             logger.debug(traceback.format_exc())
+        self.flush()
         try:
-            if hasattr(self, '_tmp_dir') and self._tmp_dir:
-                self._tmp_dir.cleanup()
+            if self._catalog:
+                self._catalog.close()
+                self._catalog = None
         except Exception:
             logger.debug(traceback.format_exc())
 
-    def preprocess_resize(self, img):
-        """调整图片大小"""
+    def fit_size(self, size):
+        """按MaxSize等比缩放后的尺寸"""
         max_size = self.conf.get('MaxSize')
-        if max_size:
-            # 确定最大尺寸
-            if isinstance(max_size, int):
-                max_w, max_h = max_size, max_size
-            elif isinstance(max_size, list):
-                max_w, max_h = map(int, max_size)
-            else:
-                max_w, max_h = map(int, re.findall(r'\d+', str(max_size)))
+        if not max_size:
+            return size
+        # 确定最大尺寸
+        if isinstance(max_size, int):
+            max_w, max_h = max_size, max_size
+        elif isinstance(max_size, list):
+            max_w, max_h = map(int, max_size)
+        else:
+            max_w, max_h = map(int, re.findall(r'\d+', str(max_size)))
 
-            # 等比缩放
-            ratio = img.size[0] / img.size[1]
-            new_w, new_h = img.size
-            if img.size[0] > max_w:
-                new_w = min(new_w, max_w)
-                new_h = min(new_h, int(max_w / ratio))
-            if img.size[1] > max_h:
-                new_w = min(new_w, int(max_h * ratio))
-                new_h = min(new_h, max_h)
+        # 等比缩放
+        ratio = size[0] / size[1]
+        new_w, new_h = size
+        if size[0] > max_w:
+            new_w = min(new_w, max_w)
+            new_h = min(new_h, int(max_w / ratio))
+        if size[1] > max_h:
+            new_w = min(new_w, int(max_h * ratio))
+            new_h = min(new_h, max_h)
+        logger.debug('max_w: {}, max_h: {}, new_w: {}, new_h: {}'.format(max_w, max_h, new_w, new_h))
+        return max(new_w, 1), max(new_h, 1)
 
-            logger.debug('max_w: {}, max_h: {}, new_w: {}, new_h: {}'.format(max_w, max_h, new_w, new_h))
-            return img.resize((new_w, new_h), Image.BICUBIC)
+    def preprocess_resize(self, img):
+        """调整图片大小。先用reduce按整数倍快速缩小，再做精细重采样"""
+        from PIL import Image
+
+        new_w, new_h = self.fit_size(img.size)
+        if (new_w, new_h) == img.size:
+            return img
+        factor = min(img.size[0] // new_w, img.size[1] // new_h)
+        if factor >= 2:
+            img = img.reduce(factor)
+        return img.resize((new_w, new_h), Image.BICUBIC)
+
+    def preprocess_draft(self, img):
+        """在解码前调用。JPEG直接在DCT域按1/2、1/4、1/8缩小解码，并限制解码后的像素数"""
+        img.draft(None, self.fit_size(img.size))
+        max_pixels = self.conf.get('MaxPixels')
+        if max_pixels and img.size[0] * img.size[1] > max_pixels:
+            raise ValueError('图片过大：{}x{}，超过MaxPixels'.format(*img.size))
+        return img
+
+    def estimate_memory(self, filename, adjust):
+        """估计预处理一张图片占用的内存（字节），只读取文件头"""
+        from PIL import Image
+
+        try:
+            with Image.open(self.open_source(filename)) as img:
+                if adjust:
+                    img.draft(None, self.fit_size(img.size))
+                size = img.size
+        except Exception:
+            return 0
+        target = self.fit_size(size) if adjust else size
+        # Pillow每像素按4字节存储：解码结果，加上缩放、填充Alpha、编码时的副本
+        return 4 * (size[0] * size[1] + 3 * target[0] * target[1])
 
     def preprocess_fill_alpha(self, img):
         """填充Alpha通道"""
+        from PIL import Image
+
         fa = self.conf.get('FillAlpha')
         color = fa
         # 确定背景色
@@ -171,151 +302,469 @@ class LPic:
             mode = 'uuid'
 
         if mode in ('md5', 'sha1', 'sha256'):
-            fb = open(filename, 'rb').read()
-            algorithm = getattr(hashlib, mode)()
-            algorithm.update(fb)
-            return algorithm.hexdigest()
+            return self.hash_file(filename, mode)
         elif mode == 'uuid':
             return str(uuid.uuid1()).replace('-', '')
         elif mode == 'datetime':
-            return self.NOW.strftime('%Y%m%d%H%M%S%f')
+            return self.now.strftime('%Y%m%d%H%M%S%f')
         elif mode == 'hex-timestamp':
-            return hex(int(1000000 * self.NOW.timestamp()))[2:]
+            return hex(int(1000000 * self.now.timestamp()))[2:]
+
+    def output_formats(self, alpha=False):
+        """配置的输出格式中当前可用的，alpha为真时只保留支持Alpha通道的格式"""
+        import encoder
+
+        formats = []
+        for fmt in self.conf.get('OutputFormats') or ['jpeg']:
+            fmt = 'jpeg' if str(fmt).lower() == 'jpg' else str(fmt).lower()
+            if fmt not in encoder.FORMATS or not encoder.available(fmt):
+                logger.warning('不支持输出格式：{}'.format(fmt))
+            elif not alpha or encoder.FORMATS[fmt][2]:
+                formats.append(fmt)
+        if alpha and self.conf.get('OptimizePNG'):
+            # 保留透明度的无损压缩
+            formats.append('png')
+        return list(dict.fromkeys(formats))
+
+    def encode(self, img, formats):
+        """按各格式编码，返回最小结果的 (扩展名, 数据)。
+        配置了TargetSize或MinSSIM时，搜索满足目标的最小输出；否则按各格式的质量编码"""
+        import encoder
+
+        qualities = {'jpeg': self.conf.get('JpegQuality'), 'webp': self.conf.get('WebpQuality'),
+                     'avif': self.conf.get('AvifQuality')}
+        fmt, data = encoder.encode_best(img, formats, qualities, self.parse_size(self.conf.get('TargetSize')),
+                                        self.conf.get('MinSSIM'), self.conf.get('EncodeThreads') or os.cpu_count() or 1)
+        return encoder.FORMATS[fmt][1], data
 
     def preprocess(self, filename, adjust):
-        img = Image.open(filename)
-        suffix = os.path.splitext(os.path.abspath(filename))[1].lower()
-        tmp_name = self.generate_picname(filename)
-        self.create_temp_dir()
-        new_file = os.path.abspath(os.path.join(self.tmp_dir, tmp_name))
+        from PIL import Image
+
+        key = None
+        if self.output_cache and adjust and self.conf.get('AutoCompress'):
+            key = self.output_key(filename, adjust)
+            hit = self.output_cache.get(key)
+            if hit:
+                data, ext, width, height = hit
+                logger.debug('output cache hit: {}'.format(filename))
+                return Picture(self.generate_picname(filename) + ext, data, width, height)
+
+        img = Image.open(self.open_source(filename))
+        size = img.size
+        suffix = os.path.splitext(self.source_name(filename))[1].lower()
+        name = self.generate_picname(filename)
         compress = False
+        formats = []
         if self.conf.get('AutoCompress'):
-            if suffix in ['.jpg', '.jpeg', '.png', '.bmp']:
+            if suffix in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
                 compress = True
-            # 如果带Alpha通道，且不填充Alpha通道，则不进行压缩
-            if 'A' in img.mode.upper() and not self.conf.get('FillAlpha'):
+            # 如果带Alpha通道，且不填充Alpha通道，则只用支持Alpha通道的格式压缩
+            formats = self.output_formats('A' in img.mode.upper() and not self.conf.get('FillAlpha'))
+            if not formats:
                 compress = False
 
-        if adjust:
-            img = self.preprocess_resize(img)
-        else:
+        if not adjust:
             compress = False
 
         if compress:
-            new_file += '.jpg'
+            try:
+                with timing.span('decode', pixels=size[0] * size[1]):
+                    img = self.preprocess_draft(img)
+                    img.load()
+            except Exception:
+                img.close()
+                raise
+            with timing.span('resize'):
+                img = self.preprocess_resize(img)
             # 填充背景色
-            if 'A' in img.mode.upper():
-                img = self.preprocess_fill_alpha(img)
-            img.save(new_file, format='JPEG', optimize=True, progressive=True)
-        else:
-            new_file += suffix
-            shutil.copyfile(filename, new_file)
+            if 'A' in img.mode.upper() and self.conf.get('FillAlpha'):
+                with timing.span('fill_alpha'):
+                    img = self.preprocess_fill_alpha(img)
+            with timing.span('encode') as s:
+                ext, data = self.encode(img, formats)
+                s.fields.update(format=ext, bytes=len(data))
+            img.close()
+            if ext == suffix == '.png' and img.size == size and len(data) >= self.source_size(filename):
+                # 优化后反而更大时上传原文件
+                return Picture(name + suffix, self.source_data(filename), *size)
+            if key:
+                self.output_cache.put(key, data, ext, *img.size)
+            return Picture(name + ext, data, *img.size)
         img.close()
-        return new_file
+        # 不压缩时直接上传原文件
+        return Picture(name + suffix, self.source_data(filename), *img.size)
+
+    # 待上传的图片（pic）可以是文件路径，也可以是内存中的Picture（标准输入、剪贴板）
 
     @staticmethod
-    def replace_datetime(string, datetime_):
-        datetimes = re.findall(r'\$DATETIME(?:\(.*?\))?', string)
-        for dt in datetimes:
-            t = re.findall(r'\((.*?)\)', dt)
-            if t:
-                fmt = t[0]
-            else:
-                fmt = '%Y-%m-%d_%H%M%S'
-            string = string.replace(dt, datetime_.strftime(fmt))
-
-        dates = re.findall(r'\$DATE(?:\(.*?\))?', string)
-        for d in dates:
-            t = re.findall(r'\((.*?)\)', d)
-            if t:
-                fmt = t[0]
-            else:
-                fmt = '%Y-%m-%d'
-            string = string.replace(d, datetime_.date().strftime(fmt))
+    def open_source(pic):
+        """供Image.open使用"""
+        if isinstance(pic, Picture):
+            return io.BytesIO(pic.data) if isinstance(pic.data, bytes) else pic.data
+        return pic
+
+    @staticmethod
+    def source_name(pic):
+        return pic.name if isinstance(pic, Picture) else os.path.abspath(pic)
 
-        return string
+    @staticmethod
+    def source_data(pic):
+        return pic.data if isinstance(pic, Picture) else pic
+
+    def source_size(self, pic):
+        return self.picture_size(pic) if isinstance(pic, Picture) else os.path.getsize(pic)
+
+    @staticmethod
+    def as_picture(file):
+        """兼容直接传入本地文件路径"""
+        if isinstance(file, Picture):
+            return file
+        return Picture(os.path.basename(file), file)
+
+    @staticmethod
+    def parse_size(size):
+        """解析'10M'、'512K'等表示的字节数"""
+        if size is None or isinstance(size, int):
+            return size
+        m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*$', str(size), re.I)
+        if not m:
+            raise ValueError('无效的大小：{}'.format(size))
+        return int(float(m.group(1)) * 1024 ** ' KMG'.index(m.group(2).upper() or ' '))
+
+    def use_multipart(self, file):
+        """本地文件超过MultipartThreshold时使用分片上传"""
+        threshold = self.parse_size(self.conf.get('MultipartThreshold'))
+        return bool(threshold) and not isinstance(file.data, bytes) and self.picture_size(file) >= threshold
+
+    @property
+    def part_size(self):
+        return self.parse_size(self.conf.get('PartSize')) or 4 * 1024 * 1024
+
+    @property
+    def part_threads(self):
+        return self.conf.get('PartThreads') or 4
+
+    def journal_dir(self):
+        """分片上传的断点记录目录"""
+        from cache import cache_home
+
+        path = os.path.join(cache_home(), 'multipart', str(self.use))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def picture_size(picture):
+        if isinstance(picture.data, bytes):
+            return len(picture.data)
+        return os.path.getsize(picture.data)
+
+    @staticmethod
+    def replace_datetime(string, datetime_):
+        return links.replace_datetime(string, datetime_)
 
     def parse_url_prefix(self):
-        url_prefix = self.conf.get('UrlPrefix', '')
-        url_prefix = self.replace_datetime(url_prefix, self.NOW)
-        if urlparse(url_prefix).scheme in ('http', 'https') and url_prefix.count('/') > 2:
-            if not url_prefix.endswith('/'):
-                url_prefix += '/'
-
-            i, j = -1, 0
-            for i, c in enumerate(url_prefix):
-                j += c == '/'
-                if j == 3:
-                    break
-            host = url_prefix[:i]
-            prefix = quote(url_prefix[i + 1:])
-        else:
-            host = url_prefix.rstrip('/')
-            prefix = ''
+        url_prefix = self.replace_datetime(self.conf.get('UrlPrefix', ''), self.now)
+        host, prefix = links.split_url_prefix(url_prefix)
+        return host, quote(prefix)
 
-        return host, prefix
+    @property
+    def link_template(self):
+        """编译后的外链模板，配置改变时重新编译"""
+        key = (self.conf.get('UrlPrefix'), self.conf.get('LinkFormat'), self.conf.get('MarkdownFormat'), self.now)
+        if self._link_template is None or self._link_template[0] != key:
+            host, prefix = self.parse_url_prefix()
+            template = links.LinkTemplate(host, prefix, self.conf.get('LinkFormat'),
+                                          self.conf.get('MarkdownFormat'), self.now)
+            self._link_template = (key, template)
+        return self._link_template[1]
 
     def generate_file_link(self, local_file, key_name):
         if '/' in key_name:
             key_name = os.path.basename(key_name)
             logger.warning("参数'key_name'值错误，自动转换为'{}'".format(key_name))
+        return self.link_template.render(local_file, key_name)
+
+    def link_record(self, local_file, key_name, size=None):
+        """生成外链；设置了--manifest时同时记入外链清单"""
+        if self.option.get('manifest') is None:
+            return self.generate_file_link(local_file, key_name)
+        record = self.link_template.record(local_file, key_name)
+        record.update(cloud=self.use, size=size)
+        self.records.append(record)
+        return record['link']
+
+    def manifest_records(self):
+        records, self.records = self.records, []
+        return records
+
+    def write_manifest(self):
+        """把本次上传的外链清单一次性写入--manifest指定的文件，-表示标准输出"""
+        path = self.option.get('manifest')
+        if path is None:
+            return
+        records = self.manifest_records()
+        fmt = links.manifest_format(path, self.option.get('manifest_format'))
+        if path == '-':
+            links.write_manifest(records, sys.stdout, fmt)
+            sys.stdout.flush()
+        else:
+            path = self.local_path(path)
+            with open(path, 'w', encoding='utf-8', newline='') as fp:
+                links.write_manifest(records, fp, fmt)
+            logger.info('已写入外链清单：{}'.format(path))
+
+    def local_path(self, path):
+        """相对路径按option['cwd']（守护进程执行时为客户端的工作目录）解析"""
+        return os.path.join(self.option.get('cwd') or '', path)
+
+    @classmethod
+    def is_pic(cls, filename):
+        return os.path.splitext(filename)[1].lower() in cls.PIC_SUFFIX
+
+    def get_default_pics(self, count=1):
+        """返回当前目录（或配置的截图目录）中最新修改的count个图片"""
+        from cache import cache_home
+        from discover import MtimeIndex, newest
+
+        dirs = [self.local_path(os.path.expanduser(d)) for d in self.conf.get('PicDirs') or [os.curdir]]
+        index = None
+        if self.conf.get('PicIndex'):
+            index = MtimeIndex(os.path.join(cache_home(), 'mtime.json'))
+        return newest(dirs, count, self.is_pic, self.conf.get('PicRecursive'), index)
+
+    def get_default_pic(self):
+        pics = self.get_default_pics()
+        if pics:
+            return pics[0]
 
-        # noinspection PyDictCreation
-        env = {}
-        host, prefix = self.parse_url_prefix()
-        env['PREFIX'] = prefix
-        env['KEY'] = prefix + key_name
-        env['FILENAME'] = key_name
-        env['FILEPART'], env['FILEEXT'] = os.path.splitext(key_name)
-        env['URL'] = host + '/' + env['KEY']
-        env['BASENAME'] = os.path.basename(local_file)
-        env['BASEPART'], env['BASEEXT'] = os.path.splitext(env['BASENAME'])
-        env['FULLPATH'] = os.path.abspath(local_file)
-        env['DIRNAME'] = os.path.dirname(local_file)
-
-        link = self.conf.get('LinkFormat')
-
-        if link is None:
-            if self.conf.get('MarkdownFormat'):
-                return '![]({})'.format(env['URL'])
+    def expand_pics(self, dests):
+        """展开文件、目录和通配符，返回去重后的图片列表"""
+        pics = []
+        for dest in map(self.local_path, dests):
+            if os.path.isfile(dest):
+                pics.append(dest)
+            elif os.path.isdir(dest):
+                files = sorted(os.path.join(dest, f) for f in os.listdir(dest))
+                pics.extend(f for f in files if os.path.isfile(f) and self.is_pic(f))
             else:
-                return env['URL']
+                files = sorted(f for f in glob.glob(dest) if os.path.isfile(f))
+                if not files:
+                    logger.error('当前目录没有指定的文件：{}'.format(dest))
+                pics.extend(files)
+        return list(dict.fromkeys(pics))
 
-        link = self.replace_datetime(link, self.NOW)
-        for k, v in env.items():
-            if k not in ('DATE', 'DATETIME'):
-                link = link.replace('$' + k, v)
-        return link
+    def hash_file(self, filename, mode='sha256'):
+        """分块计算文件哈希，同一文件只计算一次。也可以传入内存中的Picture"""
+        if isinstance(filename, Picture):
+            if isinstance(filename.data, bytes):
+                with timing.span('hash', bytes=len(filename.data), mode=mode):
+                    return getattr(hashlib, mode)(filename.data).hexdigest()
+            filename = filename.data
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_mtime, st.st_size, mode)
+        if key not in self._digests:
+            algorithm = getattr(hashlib, mode)()
+            with timing.span('hash', bytes=st.st_size, mode=mode), open(filename, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b''):
+                    algorithm.update(chunk)
+            self._digests[key] = algorithm.hexdigest()
+        return self._digests[key]
 
-    @staticmethod
-    def get_default_pic():
-        pic_suffix = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tga', '.ppm']
-        files = [f for f in os.listdir('.') if os.path.isfile(f)]
-        files = list(filter(lambda f: os.path.splitext(os.path.abspath(f))[1].lower() in pic_suffix, files))
-        if files:
-            return max(files, key=lambda x: os.stat(x).st_mtime)
+    @property
+    def upload_cache(self):
+        if self._upload_cache is None and self.conf.get('UploadCache'):
+            from cache import UploadCache, cache_home
 
-    def upload_process(self, pic):
-        file = self.preprocess(pic, self.option.get('adjust'))
-        _, prefix = self.parse_url_prefix()
-        ret = self.upload(file, prefix)
-        if ret:
-            size = round(os.path.getsize(file) / 1024, 1)
-            logger.info('已上传至{}：{}  {}K'.format(self.cloud_name, os.path.basename(file), size))
-            file_key = os.path.basename(file)
-            link = self.generate_file_link(pic, file_key)
-            if self.conf.get('AutoCopy'):
-                pyperclip.copy(link)
+            path = self.conf.get('UploadCachePath') or os.path.join(cache_home(), 'upload.json')
+            max_age = self.conf.get('CacheMaxAge')
+            self._upload_cache = UploadCache(os.path.expanduser(path), self.conf.get('CacheMaxEntries'),
+                                             max_age and max_age * 86400)
+        return self._upload_cache
+
+    @property
+    def output_cache(self):
+        """预处理结果的缓存，位于TmpDir或缓存目录中"""
+        if self._output_cache is None and self.conf.get('OutputCache'):
+            from cache import OutputCache, cache_home
+
+            root = self.conf.get('TmpDir') or cache_home()
+            self._output_cache = OutputCache(os.path.join(os.path.expanduser(root), 'outputs'),
+                                             self.parse_size(self.conf.get('OutputCacheSize') or '200M'))
+        return self._output_cache
+
+    def output_key(self, filename, adjust):
+        from cache import OutputCache
+
+        settings = [adjust] + [self.conf.get(k) for k in self.PREPROCESS_KEYS]
+        return OutputCache.make_key(self.hash_file(filename), settings)
+
+    @property
+    def catalog(self):
+        """已上传文件的本地索引，配置Catalog为true或数据库路径时启用"""
+        path = self.conf.get('Catalog')
+        if self._catalog is None and path:
+            from catalog import Catalog, data_home
+
+            if path is True:
+                path = os.path.join(data_home(), 'catalog.db')
+            self._catalog = Catalog(os.path.expanduser(path))
+        return self._catalog
+
+    def record_upload(self, pic, file, key, link):
+        if isinstance(file.data, bytes):
+            digest = hashlib.sha256(file.data).hexdigest()
+        else:
+            digest = self.hash_file(file.data)
+        self.catalog.add(self.use, self.cloud.get('Bucket'), key, hash=digest, size=self.picture_size(file),
+                         width=file.width, height=file.height, source=os.path.abspath(pic) if isinstance(pic, str) else None, link=link)
+
+    def preprocess_settings(self):
+        """本实例的配置中影响预处理结果的参数"""
+        return [self.option.get('adjust')] + [self.conf.get(k) for k in self.PREPROCESS_KEYS]
+
+    def cache_key(self, pic, settings=None):
+        """settings为实际使用的预处理参数，默认为本实例的配置（--all时由MultiLPic统一预处理）"""
+        from cache import UploadCache
+
+        prefix = self.link_template.prefix
+        settings = self.preprocess_settings() if settings is None else settings
+        return UploadCache.make_key(self.hash_file(pic), self.use, self.cloud.get('Bucket'), prefix, settings)
+
+    def cached_link(self, pic, copy=True, echo=True, settings=None):
+        """相同内容已上传过时，直接返回外链"""
+        if not self.upload_cache:
+            return None
+        key = self.upload_cache.get(self.cache_key(pic, settings))
+        if not key:
+            return None
+        if self.conf.get('CacheVerify'):
+            try:
+                found = self.exists(key)
+            except NotImplementedError:
+                found = True
+            if not found:
+                self.upload_cache.discard(self.use, self.cloud.get('Bucket'), key)
+                return None
+        logger.info('{}中已存在相同图片：{}'.format(self.cloud_name, key))
+        link = self.link_record(pic, os.path.basename(key))
+        if copy and self.conf.get('AutoCopy'):
+            self.copy(link)
+        if echo:
             logger.info(link)
+        return link
+
+    def upload_file(self, pic, file, copy=True, echo=True, settings=None):
+        """上传预处理后的文件，返回外链"""
+        prefix = self.link_template.prefix
+        file = self.as_picture(file)
+        try:
+            with timing.span('upload', cloud=self.use, bytes=self.picture_size(file)):
+                upload = self.aio.upload if self.conf.get('AsyncUpload') else self.upload
+                ret = self.retrying(upload, file, prefix)
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            logger.error('上传失败：{} {}'.format(file.name, e))
+            return None
+        if ret:
+            size = round(self.picture_size(file) / 1024, 1)
+            logger.info('已上传至{}：{}  {}K'.format(self.cloud_name, file.name, size))
+            file_key = file.name
+            if self.upload_cache:
+                self.upload_cache.put(self.cache_key(pic, settings), prefix + file_key)
+            link = self.link_record(pic, file_key, self.picture_size(file))
+            if self.catalog:
+                self.record_upload(pic, file, prefix + file_key, link)
+            if copy and self.conf.get('AutoCopy'):
+                self.copy(link)
+            if echo:
+                logger.info(link)
             return link
         else:
             logger.error('上传失败！')
 
+    def reset_clock(self, now=None):
+        """watch、守护进程长时间运行，每次上传前重新取当前时间"""
+        self.now = now or datetime.now()
+
+    def upload_process(self, pic):
+        self.reset_clock()
+        link = self.cached_link(pic)
+        if link:
+            return link
+        file = self.try_preprocess(pic)
+        if file:
+            return self.upload_file(pic, file)
+
+    def try_preprocess(self, pic):
+        """预处理单个图片，失败时（如超过MaxPixels）记录错误并返回None"""
+        try:
+            return self.preprocess(pic, self.option.get('adjust'))
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            logger.error('预处理失败：{} {}'.format(self.source_name(pic), e))
+
+    def cached_upload_file(self, pic, file, **kwargs):
+        return self.cached_link(pic, **kwargs) or self.upload_file(pic, file, **kwargs)
+
+    @staticmethod
+    def unique_file(file, names, lock):
+        """批量上传时，datetime等命名模式可能重名，追加序号"""
+        with lock:
+            part, ext = os.path.splitext(file.name)
+            name, i = file.name, 0
+            while name in names:
+                i += 1
+                name = '{}_{}{}'.format(part, i, ext)
+            names.add(name)
+        return file._replace(name=name)
+
+    def uploaders(self):
+        """批量上传时，每个预处理后的文件要执行的上传函数"""
+        return [partial(self.upload_file, copy=False)]
+
+    def run_pipeline(self, pics):
+        """批量预处理并上传，返回 {pic: 各上传函数的返回值}"""
+        names, lock = set(), threading.Lock()
+        uploads = self.uploaders()
+        from pipeline import Pipeline
+
+        pipeline = Pipeline(self.conf.get('Processes'), self.conf.get('UploadThreads') or max(4, len(uploads)),
+                            memory=self.parse_size(self.conf.get('MaxMemory')))
+        preprocess = partial(preprocess_pic, self.conf, self.option.get('adjust'))
+        cost = partial(self.estimate_memory, adjust=self.option.get('adjust'))
+        results = {}
+        for pic, _, rets in pipeline.run(pics, preprocess, uploads, lambda _, f: self.unique_file(f, names, lock), cost):
+            results[pic] = rets
+        return results
+
+    def upload_batch(self, pics):
+        """批量预处理并上传，返回与pics顺序一致的外链列表"""
+        self.reset_clock()
+        cached = {pic: self.cached_link(pic, copy=False) for pic in pics}
+        results = self.run_pipeline([pic for pic in pics if not cached[pic]])
+        links = [cached[pic] or results[pic][0] for pic in pics if cached[pic] or (results.get(pic) and results[pic][0])]
+        logger.info('已上传 {}/{} 个文件至{}'.format(len(links), len(pics), self.cloud_name))
+        if links and self.conf.get('AutoCopy'):
+            self.copy('\n'.join(links))
+        return links
+
+    @staticmethod
+    def copy(text):
+        """复制到剪贴板"""
+        import pyperclip
+
+        with timing.span('copy'):
+            pyperclip.copy(text)
+
+    def input(self, prompt):
+        """守护进程执行命令时，option['input']把提示转给客户端"""
+        return (self.option.get('input') or input)(prompt)
+
     def ask_yn(self, prompt):
         if self.option.get('yes'):
             return True
         while True:
-            ans = input(prompt).strip()
+            ans = self.input(prompt).strip()
             if not ans:
                 if '[y]' in prompt or '[Y]' in prompt:
                     return True
@@ -329,60 +778,257 @@ class LPic:
                     return False
                 logger.warning("输入无效：'{}'，请重新输入".format(ans))
 
-    def handle_default(self, _):
-        pic = self.get_default_pic()
-        if pic:
-            self.handle_put(pic)
+    def handle_default(self, *_):
+        pics = self.get_default_pics(self.option.get('count') or 1)
+        if pics:
+            self.handle_put(*pics)
         else:
             logger.error('当前目录没有图片文件')
 
     def clouds(self):
         return [c for c in self._conf if c != 'use' and c != 'conf']
 
-    def handle_use(self, dest):
+    def handle_use(self, dest=None, *_):
         if dest is None:
             for c in self.clouds():
                 logger.info('{} {}'.format('->' if c == self.use else '  ', c))
         else:
             if dest in self.clouds():
+                import config
+                from cache import atomic_write
+
+                path = os.path.realpath(self.conf_file)
+                data = config.load(path, self.ENCODINGS)[0]
                 for ec in self.ENCODINGS:
                     try:
-                        with open(self.conf_file, 'r', encoding=ec) as fp:
+                        with open(path, 'r', encoding=ec) as fp:
                             raw = fp.read()
                         break
                     except UnicodeDecodeError:
                         pass
-                raw = re.sub(r'^use:\s+\S+', 'use: {}'.format(dest), raw, flags=re.M)
-                with open(self.conf_file, 'w', encoding='utf-8') as fp:
-                    fp.write(raw)
+                # 只改写use一行，保留注释和格式
+                raw, n = re.subn(r'^use:\s+\S+', 'use: {}'.format(dest), raw, flags=re.M)
+                atomic_write(path, raw.encode('utf-8'), os.stat(path).st_mode & 0o7777)
+                if n and isinstance(data, dict):
+                    config.store(path, dict(data, use=dest))
             else:
                 logger.error("不支持使用'{}'".format(dest))
 
-    def handle_put(self, dest):
-        if dest:
-            if os.path.isfile(dest):
-                if self.ask_yn('上传 {} 至{}？([y]/n) '.format(dest, self.cloud_name)):
-                    self.upload_process(dest)
-            else:
-                logger.error('当前目录没有指定的文件：{}'.format(dest))
+    def handle_put(self, *dests):
+        if not dests:
+            self.handle_default()
+            return
+        ask_yn = self.ask_yn
+        if '-' in dests:
+            # 从标准输入读取图片数据。标准输入已被占用，不再询问
+            import paste
+
+            ask_yn = lambda _: True
+            with timing.span('read', source='stdin'):
+                pic = paste.read_stdin()
+            if pic:
+                self.put_picture(pic, ask=False)
+            dests = [d for d in dests if d != '-']
+        pics = self.expand_pics(dests)
+        if len(pics) == 1:
+            if ask_yn('上传 {} 至{}？([y]/n) '.format(pics[0], self.cloud_name)):
+                self.upload_process(pics[0])
+        elif pics:
+            if ask_yn('上传 {} 个文件至{}？([y]/n) '.format(len(pics), self.cloud_name)):
+                self.upload_batch(pics)
+        self.write_manifest()
+
+    def handle_clip(self, *_):
+        """上传剪贴板中的图片"""
+        import paste
+
+        with timing.span('read', source='clipboard'):
+            pic = paste.read_clipboard()
+        if pic:
+            self.put_picture(pic)
+            self.write_manifest()
+
+    def put_picture(self, pic, ask=True):
+        """上传内存中的图片，不写入磁盘"""
+        size = round(self.picture_size(pic) / 1024, 1)
+        if not ask or self.ask_yn('上传 {}（{}K）至{}？([y]/n) '.format(pic.name, size, self.cloud_name)):
+            self.upload_process(pic)
+
+    def delete_batches(self, keys):
+        """按BATCH_DELETE_SIZE分批并发删除，返回 (已删除数, {删除失败的key: 原因})"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        threads = self.conf.get('DeleteThreads') or 4
+        slots, lock = threading.Semaphore(2 * threads), threading.Lock()
+        result = [0, {}]
+
+        def run(batch):
+            try:
+                deleted, failed = self.retrying(self.delete_many, batch)
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                deleted, failed = [], {k: str(e) for k in batch}
+            finally:
+                slots.release()
+            if deleted and self.upload_cache:
+                self.upload_cache.discard(self.use, self.cloud.get('Bucket'), *deleted)
+            if deleted and self.catalog:
+                self.catalog.remove(self.use, self.cloud.get('Bucket'), deleted)
+            with lock:
+                result[0] += len(deleted)
+                result[1].update(failed)
+
+        with ThreadPoolExecutor(threads) as executor:
+            batch = []
+            for key in keys:
+                batch.append(key)
+                if len(batch) >= self.BATCH_DELETE_SIZE:
+                    slots.acquire()
+                    executor.submit(run, batch)
+                    batch = []
+            if batch:
+                slots.acquire()
+                executor.submit(run, batch)
+        return result[0], result[1]
+
+    def catalog_keys(self, rows):
+        """确认本地索引中的文件仍在Bucket中。有已在别处删除的，删除这些记录并返回None，改为列举远程文件"""
+        keys = [r['key'] for r in rows]
+        try:
+            stale = [key for key in keys if not self.exists(key)]
+        except NotImplementedError:
+            return keys
+        if not stale:
+            return keys
+        logger.warning('本地索引中的文件已不存在：{}，改为列举{}中的文件'.format(', '.join(stale), self.cloud_name))
+        self.catalog.remove(self.use, self.cloud.get('Bucket'), stale)
+        return None
+
+    def handle_del(self, dest=None, *_):
+        prefix = dest or ''
+        count = self.option.get('count')
+        if count is None:
+            count = 1
+        keys = None
+        if count and self.catalog:
+            # 优先从本地索引查找，避免列举远程文件
+            rows = self.catalog.query(self.use, self.cloud.get('Bucket'), prefix, limit=count,
+                                      oldest=self.option.get('oldest'))
+            if rows:
+                keys = self.catalog_keys(rows)
+        if keys is None and count:
+            keys = self.list(prefix, count, self.option.get('oldest'))
+        elif keys is None:
+            # 删除全部匹配的文件时，边列举边删除
+            keys = (key for key, _ in self.iter_objects(prefix))
+            first = next(keys, None)
+            keys = itertools.chain([first], keys) if first is not None else []
+        if not keys:
+            logger.error("{}的存储库里没有以'{}'开头的文件".format(self.cloud_name, prefix))
+            return
+
+        if self.option.get('dry_run'):
+            n = 0
+            for n, key in enumerate(keys, 1):
+                logger.info(key)
+            logger.info('共 {} 个文件'.format(n))
+            return
+
+        if count == 1:
+            prompt = '从{}删除 {} ?([y]/n) '.format(self.cloud_name, keys[0])
+        elif count:
+            prompt = '从{}删除 {} 个文件？([y]/n) '.format(self.cloud_name, len(keys))
+        else:
+            prompt = "从{}删除以'{}'开头的全部文件？([y]/n) ".format(self.cloud_name, prefix)
+        if not self.ask_yn(prompt):
+            return
+
+        deleted, failed = self.delete_batches(keys)
+        for key, reason in failed.items():
+            logger.error('从{}删除失败：{}  {}'.format(self.cloud_name, key, reason))
+        if count == 1 and deleted:
+            logger.info('已从{}删除：{}'.format(self.cloud_name, keys[0]))
+        elif count != 1:
+            logger.info('已从{}删除 {} 个文件'.format(self.cloud_name, deleted))
+
+    def show_rows(self, rows):
+        for r in rows:
+            created = datetime.fromtimestamp(r['created']).strftime('%Y-%m-%d %H:%M:%S')
+            size = '{}K'.format(round(r['size'] / 1024, 1)) if r['size'] is not None else '-'
+            logger.info('{}  {:>8}  {}'.format(created, size, r['link'] or r['key']))
+
+    def handle_ls(self, dest=None, *_):
+        """从本地索引列出已上传的文件"""
+        if not self.catalog:
+            logger.error('未启用本地索引')
+            return
+        count = self.option.get('count')
+        rows = self.catalog.query(self.use, self.cloud.get('Bucket'), dest or '',
+                                  limit=self.MAX_KEYS if count is None else count, oldest=self.option.get('oldest'))
+        self.show_rows(rows)
+
+    def handle_find(self, dest=None, *_):
+        """在全部云服务的本地索引中按key、源文件路径或哈希查找"""
+        if not self.catalog:
+            logger.error('未启用本地索引')
+        elif not dest:
+            logger.error('请指定要查找的内容')
         else:
-            self.handle_default(dest)
+            count = self.option.get('count')
+            self.show_rows(self.catalog.query(pattern=dest, limit=self.MAX_KEYS if count is None else count))
 
-    def handle_del(self, dest):
+    def handle_reindex(self, dest=None, *_):
+        """按远程文件列表重建本地索引"""
+        if not self.catalog:
+            logger.error('未启用本地索引')
+            return
+        host = self.link_template.host
         prefix = dest or ''
-        keys = self.list(prefix)
-        if keys:
-            key = keys[0]
-            if self.ask_yn('从{}删除 {} ?([y]/n) '.format(self.cloud_name, key)):
-                if self.delete(key):
-                    logger.info('已从{}删除：{}'.format(self.cloud_name, key))
-                else:
-                    logger.error('从{}删除失败：{}'.format(self.cloud_name, key))
+        added, removed = self.catalog.sync(self.use, self.cloud.get('Bucket'), self.iter_objects(prefix), prefix,
+                                           lambda key: host + '/' + quote(key))
+        logger.info('已更新{}的本地索引：新增 {} 条，删除 {} 条'.format(self.cloud_name, added, removed))
+
+    def handle_watch(self, *dests):
+        """监视目录，自动上传新保存的图片"""
+        from watch import watch
+
+        dirs = [os.path.abspath(self.local_path(d)) for d in dests or ['.']]
+        missing = [d for d in dirs if not os.path.isdir(d)]
+        if missing:
+            logger.error('目录不存在：{}'.format(', '.join(missing)))
+            return
+        logger.info('正在监视 {}，按Ctrl+C退出'.format(', '.join(dirs)))
+        try:
+            watch(dirs, self.upload_process, self.is_pic,
+                  self.conf.get('WatchSettle') or 0.5, self.conf.get('WatchInterval') or 1.0)
+        except KeyboardInterrupt:
+            pass
+
+    def handle_cache(self, dest=None, *_):
+        """查看或清空上传缓存和预处理缓存"""
+        if not self.upload_cache and not self.output_cache:
+            logger.error('未启用上传缓存')
+        elif dest == 'clear':
+            if self.upload_cache:
+                self.upload_cache.clear()
+                logger.info('已清空上传缓存')
+            if self.output_cache:
+                self.output_cache.clear()
+                logger.info('已清空预处理缓存')
+        elif dest is None:
+            if self.upload_cache:
+                logger.info('上传缓存：{}，共 {} 条'.format(self.upload_cache.path, len(self.upload_cache.entries)))
+            if self.output_cache:
+                files = self.output_cache.scan()
+                logger.info('预处理缓存：{}，共 {} 个文件，{}M'.format(
+                    self.output_cache.path, len(files), round(sum(f[2] for f in files) / 1024 / 1024, 1)))
         else:
-            logger.error("{}的存储库里没有以'{}'开头的文件".format(self.cloud_name, prefix))
+            logger.error('不支持的参数：{}'.format(dest))
 
-    def handle_web(self, _):
+    def handle_web(self, *_):
         if self.web_url:
+            import webbrowser
+
             webbrowser.open(self.web_url)
 
     @staticmethod
@@ -392,21 +1038,49 @@ class LPic:
             root = logging.getLogger()
             level = root.getEffectiveLevel()
             root.setLevel(logging.ERROR)
-            ret = func(*args, **kwargs)
-            root.setLevel(level)
-            return ret
+            try:
+                return func(*args, **kwargs)
+            finally:
+                root.setLevel(level)
 
         return wrapper
 
-    def main(self, cmd, dest):
+    def start(self):
+        """加载配置并认证"""
         if self.load_config():
-            self.auth()
-            if cmd is None:
-                self.handle_default(dest)
+            with timing.span('auth', cloud=self.use):
+                self.auth()
+            return True
+        return False
+
+    def run(self, cmd, dests=()):
+        if isinstance(dests, str):
+            dests = [dests]
+        dests = dests or []
+        if cmd is None:
+            self.handle_default(*dests)
+        else:
+            if hasattr(self, 'handle_' + cmd):
+                getattr(self, 'handle_' + cmd)(*dests)
             else:
-                if hasattr(self, 'handle_' + cmd):
-                    getattr(self, 'handle_' + cmd)(dest)
-                else:
-                    logger.error('不支持的命令：{}'.format(cmd))
+                logger.error('不支持的命令：{}'.format(cmd))
 
+    def main(self, cmd, dests=()):
+        if self.start():
+            self.run(cmd, dests)
         self.exit()
+
+
+def preprocess_pic(conf, adjust, pic):
+    """在子进程中预处理图片"""
+    lp = LPic()
+    lp.conf = conf
+    return lp.preprocess(pic, adjust)
+
+
+def load_provider(use):
+    """按云服务名导入对应的LPic子类，不支持时返回None"""
+    if use not in PROVIDERS:
+        return None
+    module, cls = PROVIDERS[use]
+    return getattr(importlib.import_module(module), cls)
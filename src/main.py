@@ -1,15 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
-import importlib
-import inspect
 import logging
 import os
 import sys
 
 sys.path.append(os.path.dirname(__file__))
 
-from lpic import LPic
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(cmd, dests, options, instance):
+    """执行命令。instance(use, cls)返回已加载配置并认证的LPic实例，失败时返回None"""
+    from lpic import LPic, load_provider
+
+    lp = LPic(**options)
+    lp.load_config()
+    if cmd == 'use':
+        lp.main(cmd, dests)
+        return
+
+    use_all = options.get('use_all')
+    uses = lp.clouds() if use_all else [options.get('use') or lp.use]
+    providers = []
+    for use in uses:
+        cls = load_provider(use)
+        if cls:
+            p = instance(use, cls)
+            if p:
+                providers.append(p)
+        elif use and not use_all:
+            logger.error("不支持使用'{}'".format(use))
+    if use_all and cmd in (None, 'put', 'clip', 'watch') and providers:
+        from multi import MultiLPic
+        multi = MultiLPic(providers, **options)
+        multi.main(cmd, dests)
+    else:
+        for p in providers:
+            p.run(cmd, dests)
+            p.flush()
 
 
 def _main():
@@ -18,16 +48,36 @@ def _main():
 可用命令:
     help                显示帮助
     use [<cloud>]       查看/切换云服务
-    put [<filename>]    上传文件。默认上传当前目录最新修改的图片。
-    del [<prefix>]      删除Bucket中最新的指定前缀的文件
+    put [<filename>...] 上传文件，支持多个文件、目录和通配符。默认上传当前目录最新修改的图片，--count指定张数。
+                        -表示从标准输入读取图片数据，如：grim - | lpic put -
+    clip                上传剪贴板中的图片（需要wl-clipboard或xclip）
+    del [<prefix>]      删除Bucket中最新的指定前缀的文件。配合--count、--oldest、--dry-run批量删除
     web                 打开Bucket内容管理网页
+    ls [<prefix>]       从本地索引列出已上传的文件
+    find <pattern>      从本地索引按文件名、源文件路径或哈希查找
+    reindex [<prefix>]  按Bucket中的文件重建本地索引
+    watch [<dir>...]    监视目录，自动上传新保存的图片
+    cache [clear]       查看/清空上传缓存和预处理缓存
+    daemon [<action>]   管理守护进程。支持：start, stop, status, run
 省略命令时，上传当前目录最新修改的图片。''', epilog='''GitHub: https://github.com/jlice/lpic。欢迎start、提交PR。''')
-    parser.add_argument('cmd', nargs='?', help='命令。支持：help, use, put, del, web')
-    parser.add_argument('dest', nargs='?', help='')
+    parser.add_argument('cmd', nargs='?', help='命令。支持：help, use, put, clip, del, ls, find, reindex, web, watch, cache, daemon')
+    parser.add_argument('dest', nargs='*', help='')
     parser.add_argument('-n', action='store_false', dest='adjust', help='不进行预处理')
     parser.add_argument('-u', '--use', dest='use', help='使用指定的云服务')
     parser.add_argument('-y', '--yes', action='store_true', dest='yes', help='始终选择y')
-    parser.add_argument('-a', '--all', action='store_true', dest='use_all', help='使用全部云服务')
+    parser.add_argument('-c', '--conf', dest='conf', help='指定配置文件')
+    parser.add_argument('--count', type=int, dest='count', help='put时上传最新的图片数、del时删除的文件数（默认1），ls/find时列出的文件数（默认100）。0表示全部')
+    parser.add_argument('--oldest', action='store_true', dest='oldest', help='del时从最旧的文件开始删除')
+    parser.add_argument('--dry-run', action='store_true', dest='dry_run', help='del时只列出要删除的文件')
+    parser.add_argument('--no-daemon', action='store_true', dest='no_daemon', help='不使用守护进程')
+    parser.add_argument('-a', '--all', action='store_true', dest='use_all', help='使用全部云服务。上传时只预处理一次，并发上传至各云服务')
+    parser.add_argument('--manifest', metavar='FILE', dest='manifest',
+                        help='put后把全部外链一次性写入FILE，-表示标准输出。格式按扩展名（.jsonl/.csv/.md）判断')
+    parser.add_argument('--manifest-format', choices=('jsonl', 'csv', 'md'), dest='manifest_format',
+                        help='外链清单的格式')
+    parser.add_argument('--profile', nargs='?', const='text', choices=('text', 'json'), dest='profile',
+                        help='结束时向stderr输出各阶段（配置、认证、解码、缩放、编码、哈希、上传等）的耗时。json为每个事件一行')
+    parser.add_argument('--cprofile', metavar='FILE', dest='cprofile', help='用cProfile运行，统计结果写入FILE')
     args = parser.parse_args()
 
     root = logging.getLogger()
@@ -36,29 +86,51 @@ def _main():
     sh.setLevel(logging.INFO)
     root.addHandler(sh)
 
+    options = {
+        k: v for k, v in args.__dict__.items() if k not in ('cmd', 'dest', 'no_daemon', 'profile', 'cprofile')
+    }
     if args.cmd == 'help':
         parser.print_help()
+    elif args.cmd == 'daemon':
+        from daemon import control
+        sys.exit(control(args.dest[0] if args.dest else 'status', args.conf))
     else:
-        options = {
-            k: v for k, v in args.__dict__.items() if k not in ('cmd', 'dest')
-        }
-        lp = LPic(**options)
-        lp.load_config()
-        if args.cmd == 'use':
-            lp.main(args.cmd, args.dest)
-        else:
-            for p in os.listdir(os.path.abspath(os.path.dirname(__file__))):
-                basepart, ext = os.path.splitext(os.path.basename(p))
-                use = basepart.rstrip('_')
-                if ext.startswith('.py') and ((args.use_all and use in lp.clouds()) or (args.use or lp.use) == use):
-                    module = importlib.import_module(basepart)
-                    for cls in inspect.getmembers(module, inspect.isclass):
-                        if cls[1] != LPic:
-                            for attr in inspect.getmembers(cls[1]):
-                                if attr[0] == 'main':
-                                    options['use'] = use
-                                    cls[1](**options).main(args.cmd, args.dest)
-                                    break
+        # 统计耗时、外链清单写到标准输出、读取标准输入或剪贴板时，在本进程中执行
+        local = args.profile or args.cprofile or args.manifest == '-' or '-' in args.dest or args.cmd == 'clip'
+        if args.cmd != 'watch' and not args.no_daemon and not local:
+            # 守护进程在运行时，交给它执行
+            from daemon import request
+            code = request(args.cmd, args.dest, options)
+            if code is not None:
+                sys.exit(code)
+
+        started = []
+
+        def instance(use, cls):
+            p = cls(**dict(options, use=use))
+            started.append(p)
+            return p if p.start() else None
+
+        import timing
+
+        timing.enable(bool(args.profile))
+        profiler = None
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with timing.span('total', cmd=args.cmd or 'put'):
+                dispatch(args.cmd, args.dest, options, instance)
+        finally:
+            for p in started:
+                p.exit()
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.cprofile)
+            if args.profile:
+                report = timing.json_lines() if args.profile == 'json' else timing.summary()
+                print(report, file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from lpic import LPic
+
+
+logger = logging.getLogger(__name__)
+
+
+class MultiLPic(LPic):
+    """同时上传至多个云服务。图片按当前云服务的配置只预处理一次，再并发上传至各云服务"""
+
+    def __init__(self, providers, conf=None, **option):
+        super(MultiLPic, self).__init__(conf, **option)
+        self.cloud_name = '全部云服务'
+        self.providers = providers
+        # 共用文件哈希的缓存，每个文件只计算一次
+        if providers:
+            self._digests = providers[0]._digests
+        for p in providers:
+            p._digests = self._digests
+
+    def load_config(self):
+        if not super(MultiLPic, self).load_config():
+            return False
+        self.providers = [p for p in self.providers if p.conf or p.load_config()]
+        for p in self.providers:
+            if p.use != self.use and p.preprocess_settings() != self.preprocess_settings():
+                logger.warning('{}的预处理配置与{}不同，统一按{}的配置预处理'.format(p.use, self.use, self.use))
+        return bool(self.providers)
+
+    def auth(self):
+        for p in self.providers:
+            if p.client is None:
+                p.auth()
+
+    def flush(self):
+        super(MultiLPic, self).flush()
+        for p in self.providers:
+            p.flush()
+
+    def manifest_records(self):
+        return [r for p in self.providers for r in p.manifest_records()]
+
+    def uploaders(self):
+        # 上传缓存按实际使用的预处理参数记录
+        settings = self.preprocess_settings()
+        return [partial(p.cached_upload_file, copy=False, echo=False, settings=settings) for p in self.providers]
+
+    def report(self, links):
+        """按云服务输出外链，并复制当前云服务的外链"""
+        for p, ls in zip(self.providers, links):
+            logger.info('[{}]'.format(p.cloud_name))
+            for link in ls:
+                logger.info(link)
+        primary = [ls for p, ls in zip(self.providers, links) if p.use == self.use]
+        if primary and primary[0] and self.conf.get('AutoCopy'):
+            self.copy('\n'.join(primary[0]))
+        return links
+
+    def reset_clock(self, now=None):
+        # 各云服务的key和外链使用同一时间
+        super(MultiLPic, self).reset_clock(now)
+        for p in self.providers:
+            p.reset_clock(self.now)
+
+    def upload_process(self, pic):
+        self.reset_clock()
+        settings = self.preprocess_settings()
+        rets = [p.cached_link(pic, copy=False, echo=False, settings=settings) for p in self.providers]
+        file = None if all(rets) else self.try_preprocess(pic)
+        if file:
+            with ThreadPoolExecutor(len(self.providers)) as executor:
+                futures = [None if ret else executor.submit(p.upload_file, pic, file, copy=False, echo=False,
+                                                             settings=settings)
+                           for p, ret in zip(self.providers, rets)]
+            rets = [ret or future.result() for ret, future in zip(rets, futures)]
+        return self.report([[link] if link else [] for link in rets])
+
+    def upload_batch(self, pics):
+        self.reset_clock()
+        settings = self.preprocess_settings()
+        cached = {pic: [p.cached_link(pic, copy=False, echo=False, settings=settings) for p in self.providers]
+                  for pic in pics}
+        results = self.run_pipeline([pic for pic in pics if not all(cached[pic])])
+        for pic in pics:
+            results[pic] = results.get(pic) or cached[pic]
+        links = [[results[pic][i] for pic in pics if results[pic] and results[pic][i]]
+                 for i in range(len(self.providers))]
+        return self.report(links)
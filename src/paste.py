@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""从标准输入或剪贴板读取图片数据，返回内存中的Picture，不写入磁盘"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+from lpic import Picture
+
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'BMP': '.bmp', 'WEBP': '.webp', 'TIFF': '.tif'}
+# 剪贴板工具：按顺序尝试，取第一个成功输出数据的
+CLIPBOARD_COMMANDS = (
+    ('wl-paste', '--no-newline', '--type', 'image/png'),
+    ('xclip', '-selection', 'clipboard', '-target', 'image/png', '-out'),
+    ('pngpaste', '-'),
+)
+
+
+def as_picture(data, name):
+    """校验是否为图片，按实际格式加上扩展名。不是图片时返回None"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+    except Exception:
+        return None
+    return Picture(name + EXTENSIONS.get(fmt, '.' + str(fmt).lower()), data)
+
+
+def read_stdin(stream=None):
+    stream = stream or sys.stdin.buffer
+    if stream.isatty():
+        logger.error('请通过管道或重定向输入图片数据，如：lpic put - < shot.png')
+        return None
+    data = stream.read()
+    pic = as_picture(data, 'stdin') if data else None
+    if pic is None:
+        logger.error('标准输入中没有图片数据')
+    return pic
+
+
+def clipboard_commands():
+    """当前环境可用的剪贴板工具命令"""
+    commands = [c for c in CLIPBOARD_COMMANDS if shutil.which(c[0])]
+    if not os.environ.get('WAYLAND_DISPLAY'):
+        # 不在Wayland会话中时，wl-paste无法读取剪贴板
+        commands = [c for c in commands if c[0] != 'wl-paste']
+    return commands
+
+
+def grab_clipboard():
+    """没有剪贴板工具时用Pillow读取（Windows、macOS），编码为PNG"""
+    try:
+        from PIL import ImageGrab
+
+        img = ImageGrab.grabclipboard()
+    except Exception:
+        return None
+    if img is None or isinstance(img, list):
+        # 列表为复制的文件路径
+        return None
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def read_clipboard():
+    for command in clipboard_commands():
+        try:
+            ret = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if ret.returncode == 0 and ret.stdout:
+            pic = as_picture(ret.stdout, 'clipboard')
+            if pic:
+                return pic
+    data = grab_clipboard()
+    pic = as_picture(data, 'clipboard') if data else None
+    if pic is None:
+        logger.error('剪贴板中没有图片。Linux需要安装wl-clipboard（Wayland）或xclip（X11）')
+    return pic
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+
+logger = logging.getLogger(__name__)
+
+
+class Budget:
+    """可按数量获取的信号量。单次获取超过总量时按总量计，即独占执行"""
+
+    def __init__(self, total):
+        self.total = total
+        self.free = total
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.total)
+        with self.cond:
+            self.cond.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+
+    def release(self, n):
+        with self.cond:
+            self.free += n
+            self.cond.notify_all()
+
+
+class Pipeline:
+    """两级流水线：进程池做CPU密集的预处理，线程池做IO密集的上传"""
+
+    def __init__(self, processes=None, threads=None, backlog=None, memory=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.threads = threads or 4
+        # 在途任务上限。预处理快于上传时，阻塞提交以免结果堆积在内存里
+        self.backlog = backlog or 2 * (self.processes + self.threads)
+        # 同时预处理的图片估计占用的内存上限（字节）
+        self.memory = memory
+
+    def run(self, pics, preprocess, uploads, prepare=None, cost=None):
+        """按完成顺序产出 (pic, file, rets)
+
+        preprocess(pic) 在子进程中执行，须可被pickle；
+        prepare(pic, file) 在主进程中执行，可在上传前改写 file；
+        uploads 中的每个 upload(pic, file) 在线程池中并发执行，rets 为其返回值列表。
+        cost(pic) 估计预处理占用的内存，配合memory限制同时预处理的图片。
+        预处理失败时 file 为 None。
+        """
+        pics = list(pics)
+        slots = threading.Semaphore(self.backlog)
+        budget = Budget(self.memory) if self.memory and cost else None
+        stop = threading.Event()
+        done = queue.Queue()
+
+        def finish(pic, file, rets):
+            done.put((pic, file, rets))
+            slots.release()
+
+        def on_uploaded(pic, file, rets, left, lock, i, fut):
+            try:
+                rets[i] = fut.result()
+            except Exception:
+                logger.error(traceback.format_exc())
+            with lock:
+                left[0] -= 1
+                last = left[0] == 0
+            if last:
+                finish(pic, file, rets)
+
+        def on_preprocessed(pic, used, fut):
+            if used:
+                budget.release(used)
+            try:
+                file = fut.result()
+                if prepare:
+                    file = prepare(pic, file)
+            except Exception:
+                logger.error('预处理失败：{}\n{}'.format(pic, traceback.format_exc()))
+                finish(pic, None, [])
+                return
+            rets, left, lock = [None] * len(uploads), [len(uploads)], threading.Lock()
+            for i, upload in enumerate(uploads):
+                tp.submit(upload, pic, file).add_done_callback(partial(on_uploaded, pic, file, rets, left, lock, i))
+
+        def feed():
+            for pic in pics:
+                slots.acquire()
+                if stop.is_set():
+                    break
+                used = budget.acquire(cost(pic)) if budget else 0
+                if stop.is_set():
+                    if used:
+                        budget.release(used)
+                    break
+                pp.submit(preprocess, pic).add_done_callback(partial(on_preprocessed, pic, used))
+
+        with ProcessPoolExecutor(self.processes) as pp, ThreadPoolExecutor(self.threads) as tp:
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            try:
+                for _ in pics:
+                    yield done.get()
+            finally:
+                stop.set()
+                slots.release()
+                feeder.join()
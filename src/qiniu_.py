@@ -2,12 +2,16 @@
 # -*- coding: utf-8 -*-
 import os
 
-from qiniu import Auth, put_file, BucketManager
+from qiniu import Auth, put_data, put_file, BucketManager, UploadProgressRecorder, build_batch_delete
+from qiniu.services.storage.uploaders import ResumeUploaderV2
 
+import retry
 from lpic import LPic
 
 
 class QiniuLPic(LPic):
+    BATCH_DELETE_SIZE = 1000
+
     def __init__(self, conf=None, **option):
         super(QiniuLPic, self).__init__(conf, **option)
         self.cloud_name = '七牛云'
@@ -15,25 +19,86 @@ class QiniuLPic(LPic):
     def auth(self):
         self.client = Auth(self.cloud['AccessKey'], self.cloud['SecretKey'])
 
+    @staticmethod
+    def check(info, strict=False):
+        """七牛的SDK不抛出异常，按返回的ResponseInfo判断。可重试时抛出TransientError，
+        strict为True时其余失败抛出IOError"""
+        if info.ok():
+            return True
+        # 573为单个空间访问频率过高
+        if info.status_code in (429, 573):
+            raise retry.TransientError(info.error or info.status_code, info.status_code, throttled=True)
+        if info.connect_failed() or info.need_retry():
+            raise retry.TransientError(info.error or info.exception or info.status_code, info.status_code)
+        if strict:
+            raise IOError('HTTP {} {}'.format(info.status_code, info.error or ''))
+        return False
+
     @property
     def web_url(self):
         return 'https://portal.qiniu.com/bucket/{}/resource'.format(self.cloud['Bucket'])
 
     def upload(self, file, prefix=''):
-        _token = self.client.upload_token(self.cloud['Bucket'], os.path.basename(file), 600)
-        _, ret = put_file(_token, prefix + os.path.basename(file), file)
-        return ret.ok()
+        file = self.as_picture(file)
+        if self.use_multipart(file):
+            return self.upload_multipart(file, prefix)
+        _token = self.client.upload_token(self.cloud['Bucket'], prefix + file.name, 600)
+        if isinstance(file.data, bytes):
+            _, ret = put_data(_token, prefix + file.name, file.data)
+        else:
+            _, ret = put_file(_token, prefix + file.name, file.data)
+        return self.check(ret, True)
+
+    def upload_multipart(self, file, prefix=''):
+        file = self.as_picture(file)
+        _token = self.client.upload_token(self.cloud['Bucket'], prefix + file.name, 3600)
+        uploader = ResumeUploaderV2(self.cloud['Bucket'], auth=self.client, part_size=self.part_size,
+                                    upload_progress_recorder=UploadProgressRecorder(self.journal_dir()),
+                                    max_concurrent_workers=self.part_threads)
+        _, ret = uploader.upload(prefix + file.name, file_path=file.data, up_token=_token)
+        return self.check(ret, True)
 
-    def list(self, prefix):
+    def iter_objects(self, prefix):
         bucket = BucketManager(self.client)
-        ret, _, _ = bucket.list(self.cloud['Bucket'], prefix=prefix, limit=self.MAX_KEYS)
-        return [i['key'] for i in sorted([i for i in ret['items']], key=lambda x: -x['putTime'])]
+        marker = None
+        while True:
+            ret, eof, info = bucket.list(self.cloud['Bucket'], prefix=prefix, marker=marker, limit=self.PAGE_SIZE)
+            if ret is None:
+                # 出错时不要当作已列举完毕
+                self.check(info, True)
+                break
+            for i in ret.get('items', []):
+                # putTime的单位是100纳秒
+                yield i['key'], i['putTime'] / 1e7
+            marker = ret.get('marker')
+            if eof or not marker:
+                break
 
     def delete(self, key):
         bucket = BucketManager(self.client)
         _, ret = bucket.delete(self.cloud['Bucket'], key)
         return ret.ok()
 
+    def exists(self, key):
+        bucket = BucketManager(self.client)
+        _, ret = bucket.stat(self.cloud['Bucket'], key)
+        return ret.status_code == 200
+
+    def delete_many(self, keys):
+        bucket = BucketManager(self.client)
+        ret, info = bucket.batch(build_batch_delete(self.cloud['Bucket'], keys))
+        if ret is None:
+            self.check(info)
+            return [], {k: str(info.error) for k in keys}
+        deleted, failed = [], {}
+        # 不存在的文件（612）也视为已删除
+        for key, r in zip(keys, ret):
+            if r.get('code') in (200, 612):
+                deleted.append(key)
+            else:
+                failed[key] = (r.get('data') or {}).get('error', r.get('code'))
+        return deleted, failed
+
     def close(self):
         cache = '.qiniu_pythonsdk_hostscache.json'
         if os.path.isfile(cache):
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""云服务请求的重试和自适应并发控制
+
+各云服务通过LPic.classify_error把异常归类为 (可否重试, 是否被限流, Retry-After秒数)。
+可重试的错误按指数退避加随机抖动重试，服务端给出Retry-After时按其等待。
+同一Bucket的请求共用一个AIMD限流器：被限流时在途请求数上限减半，成功时缓慢增加，
+批量上传的吞吐量会稳定在Bucket允许的范围附近。
+"""
+import email.utils
+import logging
+import random
+import threading
+from time import monotonic, sleep, time
+
+import timing
+
+
+logger = logging.getLogger(__name__)
+
+# 通常表示限流的HTTP状态码
+THROTTLE_STATUS = (429, 503)
+# 其余可重试的HTTP状态码
+RETRY_STATUS = (408, 500, 502, 504)
+
+
+class TransientError(IOError):
+    """可重试的错误。status为HTTP状态码，retry_after为服务端要求的等待秒数"""
+
+    def __init__(self, message, status=None, retry_after=None, throttled=None):
+        super(TransientError, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.throttled = status in THROTTLE_STATUS if throttled is None else throttled
+
+
+def parse_retry_after(value):
+    """Retry-After可以是秒数或HTTP日期，无法解析时返回None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def classify_status(status, retry_after=None):
+    """按HTTP状态码归类，返回 (可否重试, 是否被限流, Retry-After秒数)"""
+    if status in THROTTLE_STATUS:
+        return True, True, parse_retry_after(retry_after)
+    if status in RETRY_STATUS:
+        return True, False, parse_retry_after(retry_after)
+    return False, False, None
+
+
+def classify(exc):
+    """通用的归类：TransientError和连接、超时错误可重试"""
+    if isinstance(exc, TransientError):
+        return True, exc.throttled, exc.retry_after
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True, False, None
+    import http.client
+
+    if isinstance(exc, (http.client.IncompleteRead, http.client.RemoteDisconnected, http.client.BadStatusLine)):
+        return True, False, None
+    return False, False, None
+
+
+class Backoff:
+    """指数退避，full jitter：第n次重试等待 [0, min(cap, base * 2^n)) 内的随机时间"""
+
+    def __init__(self, retries=3, base=0.5, cap=30.0, seed=None):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.random = random.Random(seed)
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            # 服务端指定了等待时间时以其为准，不超过cap的两倍
+            return min(retry_after, 2 * self.cap)
+        return self.random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class AIMDLimiter:
+    """加性增、乘性减的在途请求数上限
+
+    每次成功上限增加 1/上限（约每轮增加1），被限流时减半，最低minimum。
+    同一轮限流中的多个失败只减一次：请求开始于上次减小之前的失败不再减小上限。
+    """
+
+    def __init__(self, maximum=8, minimum=1, initial=None, decrease=0.5):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(initial or self.maximum)
+        self.decrease = decrease
+        self.inflight = 0
+        self.decreased = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """等待空位，返回请求开始的时刻，作为release的参数"""
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+            return monotonic()
+
+    def release(self, started, throttled=False, ok=True):
+        with self.cond:
+            self.inflight -= 1
+            if throttled:
+                if started >= self.decreased:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.decreased = monotonic()
+                    logger.debug('被限流，并发上限降为{}'.format(int(self.limit)))
+            elif ok:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+def call(func, *args, backoff=None, limiter=None, classifier=classify, name=None, **kwargs):
+    """带重试地调用func，最后一次的异常原样抛出"""
+    backoff = backoff or Backoff()
+    name = name or getattr(func, '__name__', 'request')
+    attempt = 0
+    while True:
+        started = limiter.acquire() if limiter else None
+        try:
+            ret = func(*args, **kwargs)
+        except Exception as e:
+            retryable, throttled, retry_after = classifier(e)
+            if limiter:
+                limiter.release(started, throttled, ok=False)
+            if not retryable or attempt >= backoff.retries:
+                raise
+            delay = backoff.delay(attempt, retry_after)
+            attempt += 1
+            logger.debug('{}失败（{}），{:.2f}秒后第{}次重试'.format(name, e, delay, attempt))
+            with timing.span('backoff', op=name, attempt=attempt, throttled=throttled):
+                sleep(delay)
+        else:
+            if limiter:
+                limiter.release(started)
+            return ret
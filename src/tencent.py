@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import logging
-import os
 from datetime import datetime
 from urllib.parse import urlencode
 
 # noinspection PyPackageRequirements
 from qcloud_cos import CosConfig, CosS3Client
+from qcloud_cos.cos_exception import CosClientError, CosServiceError
 
+import retry
 from lpic import LPic
 
 
 class TencentLPic(LPic):
+    BATCH_DELETE_SIZE = 1000
+
     def __init__(self, conf=None, **option):
         super(TencentLPic, self).__init__(conf, **option)
         self.cloud_name = '腾讯云'
@@ -34,27 +37,55 @@ class TencentLPic(LPic):
 
     @LPic.mute_log
     def upload(self, file, prefix=''):
-        ret = self.client.put_object_from_local_file(
+        file = self.as_picture(file)
+        if self.use_multipart(file):
+            return self.upload_multipart(file, prefix)
+        if isinstance(file.data, bytes):
+            ret = self.client.put_object(
+                Bucket=self.cloud['Bucket'],
+                Body=file.data,
+                Key=prefix + file.name
+            )
+        else:
+            ret = self.client.put_object_from_local_file(
+                Bucket=self.cloud['Bucket'],
+                LocalFilePath=file.data,
+                Key=prefix + file.name
+            )
+        return bool(ret.get('ETag'))
+
+    @LPic.mute_log
+    def upload_multipart(self, file, prefix=''):
+        # COS会在服务端查找未完成的分片上传，自动续传
+        file = self.as_picture(file)
+        ret = self.client.upload_file(
             Bucket=self.cloud['Bucket'],
-            LocalFilePath=file,
-            Key=prefix + os.path.basename(file)
+            Key=prefix + file.name,
+            LocalFilePath=file.data,
+            PartSize=max(1, self.part_size // (1024 * 1024)),
+            MAXThread=self.part_threads
         )
         return bool(ret.get('ETag'))
 
     @LPic.mute_log
-    def list(self, prefix):
-        response = self.client.list_objects(
+    def list_page(self, prefix, marker=''):
+        return self.client.list_objects(
             Bucket=self.cloud['Bucket'],
             Prefix=prefix,
-            MaxKeys=self.MAX_KEYS
+            Marker=marker,
+            MaxKeys=self.PAGE_SIZE
         )
-        if 'Contents' in response:
-            def cmp(x):
-                return -datetime.strptime(x['LastModified'], '%Y-%m-%dT%H:%M:%S.000Z').timestamp()
 
-            return [c['Key'] for c in sorted([c for c in response['Contents']], key=cmp)]
-        else:
-            return []
+    def iter_objects(self, prefix):
+        marker = ''
+        while True:
+            response = self.list_page(prefix, marker)
+            contents = response.get('Contents', [])
+            for c in contents:
+                yield c['Key'], datetime.strptime(c['LastModified'], '%Y-%m-%dT%H:%M:%S.000Z').timestamp()
+            if response.get('IsTruncated') != 'true' or not contents:
+                break
+            marker = response.get('NextMarker') or contents[-1]['Key']
 
     @LPic.mute_log
     def delete(self, key):
@@ -67,6 +98,41 @@ class TencentLPic(LPic):
         )
         return 'Deleted' in ret and len(ret['Deleted']) == 1
 
+    @LPic.mute_log
+    def exists(self, key):
+        return self.client.object_exists(Bucket=self.cloud['Bucket'], Key=key)
+
+    @LPic.mute_log
+    def delete_many(self, keys):
+        ret = self.client.delete_objects(
+            Bucket=self.cloud['Bucket'],
+            Delete={
+                'Object': [{'Key': key} for key in keys],
+                'Quiet': 'false'
+            }
+        )
+        failed = {e['Key']: '{} {}'.format(e.get('Code', ''), e.get('Message', '')).strip()
+                  for e in ret.get('Error', [])}
+        deleted = [d['Key'] for d in ret.get('Deleted', [])]
+        return deleted, failed
+
+    def presign(self, method, key, headers=None, params=None):
+        if not key:
+            raise NotImplementedError
+        url = self.client.get_presigned_url(Bucket=self.cloud['Bucket'], Key=key, Method=method, Expired=600,
+                                            Params=params or {}, Headers=headers or {})
+        return url, dict(headers or {})
+
+    def classify_error(self, exc):
+        if isinstance(exc, CosServiceError):
+            if exc.get_error_code() == 'SlowDown':
+                return True, True, None
+            return retry.classify_status(exc.get_status_code())
+        if isinstance(exc, CosClientError):
+            # 连接、超时等网络错误
+            return True, False, None
+        return super(TencentLPic, self).classify_error(exc)
+
     def close(self):
         # noinspection PyProtectedMember
         self.client._session.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""各阶段的耗时统计
+
+    with timing.span('upload', bytes=n):
+        ...
+
+未启用且没有回调时，span()返回同一个空对象，几乎没有开销。
+启用后（lpic --profile）记录每个事件，结束时输出汇总或JSON行。
+长期运行的进程可用add_hook注册回调，每个事件结束时收到一个dict，自行导出。
+只统计当前进程；批量上传时在子进程中完成的预处理不计入。
+"""
+import threading
+from functools import wraps
+from time import perf_counter, time
+
+_lock = threading.Lock()
+_hooks = []
+_events = []
+enabled = False
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def add_hook(callback):
+    """callback(event)，event为 {'name', 'ms', 'start', ...}"""
+    with _lock:
+        _hooks.append(callback)
+
+
+def remove_hook(callback):
+    with _lock:
+        _hooks.remove(callback)
+
+
+def active():
+    return enabled or bool(_hooks)
+
+
+def record(name, seconds, start=None, **fields):
+    event = dict(fields, name=name, ms=round(seconds * 1000, 3), start=start or time() - seconds)
+    if fields.get('bytes') and seconds > 0:
+        event['mb_per_s'] = round(fields['bytes'] / seconds / 1024 / 1024, 3)
+    with _lock:
+        if enabled:
+            _events.append(event)
+        hooks = list(_hooks)
+    for hook in hooks:
+        hook(event)
+    return event
+
+
+class Span:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+        self.wall = None
+
+    def __enter__(self):
+        self.wall = time()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        record(self.name, perf_counter() - self.start, self.wall, **self.fields)
+
+
+class _NullSpan:
+    fields = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+_null = _NullSpan()
+
+
+def span(name, **fields):
+    """计时的上下文管理器。可在with块中通过 s.fields[...] 补充字节数等信息"""
+    if not active():
+        # 空对象的fields被共享，写入也无妨
+        return _null
+    return Span(name, fields)
+
+
+def timed(name):
+    """装饰器形式的span"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def reset():
+    with _lock:
+        _events.clear()
+
+
+def summary(items=None):
+    """按阶段汇总，返回多行文本"""
+    items = events() if items is None else items
+    stats = {}
+    for e in items:
+        s = stats.setdefault(e['name'], {'count': 0, 'ms': 0.0, 'max': 0.0, 'bytes': 0})
+        s['count'] += 1
+        s['ms'] += e['ms']
+        s['max'] = max(s['max'], e['ms'])
+        s['bytes'] += e.get('bytes') or 0
+    lines = ['{:<14} {:>6} {:>11} {:>10} {:>10} {:>10}'.format('phase', 'count', 'total_ms', 'mean_ms', 'max_ms',
+                                                              'MB/s')]
+    for name, s in sorted(stats.items(), key=lambda kv: kv[1]['ms'], reverse=True):
+        rate = '{:.2f}'.format(s['bytes'] / (s['ms'] / 1000) / 1024 / 1024) if s['bytes'] and s['ms'] else '-'
+        lines.append('{:<14} {:>6} {:>11.2f} {:>10.2f} {:>10.2f} {:>10}'.format(
+            name, s['count'], s['ms'], s['ms'] / s['count'], s['max'], rate))
+    return '\n'.join(lines)
+
+
+def json_lines(items=None):
+    import json
+
+    items = events() if items is None else items
+    return '\n'.join(json.dumps(e, ensure_ascii=False) for e in items)
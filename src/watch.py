@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import traceback
+from time import monotonic, sleep
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollingWatcher:
+    """定时扫描目录，适用于不支持inotify的平台"""
+
+    def __init__(self, dirs, interval=1.0):
+        self.dirs = dirs
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            st = entry.stat()
+                            snapshot[entry.path] = (st.st_mtime, st.st_size)
+            except FileNotFoundError:
+                pass
+        return snapshot
+
+    def poll(self, timeout):
+        """返回新建或修改过的文件"""
+        sleep(min(timeout, self.interval))
+        snapshot = self.scan()
+        changed = [p for p, v in snapshot.items() if self.snapshot.get(p) != v]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """基于Linux inotify，文件写完或移入目录时立即得到通知"""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, dirs):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.wds = {}
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for d in dirs:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch', d)
+            self.wds[wd] = d
+
+    def poll(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed, i = [], 0
+        while i + self.EVENT.size <= len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, i)
+            i += self.EVENT.size
+            name = data[i:i + length].rstrip(b'\0')
+            i += length
+            if name and wd in self.wds:
+                changed.append(os.path.join(self.wds[wd], os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(dirs, interval=1.0):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs)
+        except (OSError, AttributeError):
+            logger.debug(traceback.format_exc())
+    return PollingWatcher(dirs, interval)
+
+
+def watch(dirs, callback, accept=None, settle=0.5, interval=1.0, stop=None):
+    """监视dirs中新出现的文件，大小和修改时间保持settle秒不变后调用callback(path)
+
+    stop为threading.Event，设置后退出。
+    """
+    watcher = create_watcher(dirs, interval)
+    # {path: ((mtime, size), 首次观察到该状态的时间)}
+    pending = {}
+    try:
+        while not (stop and stop.is_set()):
+            for path in watcher.poll(settle / 2 if pending else interval):
+                if accept is None or accept(path):
+                    pending[path] = (None, monotonic())
+            for path, (state, since) in list(pending.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    del pending[path]
+                    continue
+                if state != (st.st_mtime, st.st_size):
+                    pending[path] = ((st.st_mtime, st.st_size), monotonic())
+                elif monotonic() - since >= settle:
+                    del pending[path]
+                    try:
+                        callback(path)
+                    except Exception:
+                        logger.error(traceback.format_exc())
+    finally:
+        watcher.close()
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# 测试中的缓存、索引等写入临时目录，不影响用户目录
+_home = tempfile.TemporaryDirectory(prefix='lpic-test-')
+os.environ['XDG_CACHE_HOME'] = os.path.join(_home.name, 'cache')
+os.environ['XDG_DATA_HOME'] = os.path.join(_home.name, 'data')
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import aio
+import retry
+from fakes3 import FakeS3LPic, FakeS3Server
+from local import LocalLPic
+from lpic import Picture
+
+
+class AioTestCase(unittest.TestCase):
+    def client(self, server, **conf):
+        lp = FakeS3LPic(use='fakes3')
+        lp.use = 'fakes3'
+        lp.cloud = {'Endpoint': server.url, 'Bucket': 'img'}
+        lp.conf = dict(lp.cloud, UrlPrefix=server.url + '/img/', **conf)
+        lp.auth()
+        self.addCleanup(lp.exit)
+        return lp
+
+    def test_async_provider(self):
+        with FakeS3Server(latency=0.02) as server, tempfile.TemporaryDirectory() as tmp:
+            lp = self.client(server)
+            lp.PAGE_SIZE = 7
+            pic = os.path.join(tmp, 'big.png')
+            with open(pic, 'wb') as fp:
+                fp.write(os.urandom(3 * aio.CHUNK_SIZE + 1))
+
+            async def run():
+                provider = aio.AsyncProvider(lp, pool_size=8)
+                try:
+                    await asyncio.gather(*[provider.upload(Picture('{:03d}.jpg'.format(i), b'x' * i), 'p/')
+                                           for i in range(100)])
+                    await provider.upload(Picture('big.png', pic))
+                    keys = await provider.list('p/', limit=1000)
+                    deleted = await asyncio.gather(provider.delete('p/000.jpg'), provider.delete('missing'))
+                    return keys, deleted, len(provider.http.pools)
+                finally:
+                    await provider.close()
+
+            keys, deleted, pools = asyncio.run(run())
+            self.assertEqual(100, len(keys))
+            self.assertEqual([True, True], deleted)
+            self.assertEqual(1, pools)
+            self.assertLessEqual(server.stats['max_inflight'], 8)
+            self.assertGreater(server.stats['max_inflight'], 1)
+            self.assertEqual(b'x' * 5, server.buckets['img']['p/005.jpg'][0])
+            with open(pic, 'rb') as fp:
+                self.assertEqual(fp.read(), server.buckets['img']['big.png'][0])
+            self.assertNotIn('p/000.jpg', server.buckets['img'])
+
+    def test_sync_adapter(self):
+        with FakeS3Server(error_rate=0.3, seed=3) as server:
+            lp = self.client(server, AsyncUpload=True, Retries=10, RetryBackoff=0.001)
+            for i in range(10):
+                self.assertTrue(lp.upload_file('{}.jpg'.format(i), Picture('{}.jpg'.format(i), b'x'), copy=False))
+            self.assertEqual(10, len(server.buckets['img']))
+            self.assertGreater(server.stats['errors'], 0)
+
+            server.error_rate = 1
+            self.assertRaises(retry.TransientError, lp.aio.upload, Picture('y.jpg', b'y'))
+            server.error_rate = 0
+            self.assertEqual(10, len(lp.aio.list('')))
+
+    def test_fallback(self):
+        # 不支持presign的云服务在线程中调用同步接口
+        with tempfile.TemporaryDirectory() as tmp:
+            lp = LocalLPic(use='local')
+            lp.cloud = {'Root': tmp, 'Bucket': 'img'}
+            lp.conf = dict(lp.cloud)
+            lp.auth()
+            provider = aio.SyncProvider(lp)
+            self.assertTrue(provider.upload(Picture('a.jpg', b'a'), 'p/'))
+            self.assertEqual(['p/a.jpg'], provider.list('p/'))
+            self.assertTrue(provider.delete('p/a.jpg'))
+            provider.close()
+
+    def test_timeout(self):
+        # 超时限制每次读写，总耗时超过timeout的慢速上传不会失败
+        class SlowWriter:
+            def write(self, data):
+                pass
+
+            async def drain(self):
+                await asyncio.sleep(0.1)
+
+        async def run(body, timeout):
+            pool = aio.ConnectionPool('http', 'localhost', 80, timeout=timeout)
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+            return await pool.exchange((reader, SlowWriter()), 'PUT', '/img/a', {}, body)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'big.png')
+            with open(pic, 'wb') as fp:
+                fp.write(b'x' * (3 * aio.CHUNK_SIZE))
+            resp, keep = asyncio.run(run(pic, 0.25))
+            self.assertEqual(200, resp.status)
+            self.assertTrue(keep)
+            self.assertRaises(TimeoutError, asyncio.run, run(pic, 0.05))
+
+    def test_close_on_retry(self):
+        # 复用的连接失效后换新连接重试，重试失败时新连接也被关闭
+        stale, fresh = (None, mock.Mock()), (None, mock.Mock())
+        errors = [ConnectionResetError(), TimeoutError()]
+
+        async def exchange(*_):
+            raise errors.pop(0)
+
+        async def connect():
+            return fresh
+
+        async def run():
+            pool = aio.ConnectionPool('http', 'localhost', 80)
+            pool.idle.append(stale)
+            with mock.patch.object(pool, 'exchange', exchange), mock.patch.object(pool, 'connect', connect):
+                await pool.request('GET', '/', {})
+
+        self.assertRaises(TimeoutError, asyncio.run, run())
+        stale[1].close.assert_called_once()
+        fresh[1].close.assert_called_once()
+
+    def test_parse_listing(self):
+        body = (b'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                b'<IsTruncated>true</IsTruncated><Contents><Key>a</Key>'
+                b'<LastModified>1970-01-01T00:00:10.000Z</LastModified></Contents></ListBucketResult>')
+        self.assertEqual(([('a', 10.0)], 'a'), aio.parse_listing(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
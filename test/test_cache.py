@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from time import time
+from unittest import mock
+
+from PIL import Image
+
+from cache import OutputCache, UploadCache
+from lpic import LPic
+
+
+class UploadCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'upload.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_get(self):
+        cache = UploadCache(self.path)
+        key = UploadCache.make_key('abc', 'aliyun', 'img', 'p/', [True])
+        self.assertIsNone(cache.get(key))
+        cache.put(key, 'p/abc.jpg')
+        cache.save()
+        self.assertEqual('p/abc.jpg', UploadCache(self.path).get(key))
+
+    def test_evict(self):
+        cache = UploadCache(self.path, max_entries=2, max_age=100)
+        for i in range(3):
+            cache.put(str(i), 'k{}'.format(i))
+        cache.entries['0'][1] = time() - 200
+        cache.get('1')
+        cache.save()
+        self.assertEqual(['1', '2'], sorted(UploadCache(self.path).entries))
+
+    def test_discard_merge(self):
+        a, b = UploadCache(self.path), UploadCache(self.path)
+        ka = UploadCache.make_key('a', 'aliyun', 'img', '', [])
+        kb = UploadCache.make_key('b', 'qiniu', 'img', '', [])
+        a.put(ka, 'a.jpg')
+        b.put(kb, 'b.jpg')
+        a.save()
+        b.save()
+        self.assertEqual(2, len(UploadCache(self.path).entries))
+
+        b.discard('aliyun', 'img', 'a.jpg')
+        b.save()
+        self.assertEqual([kb], list(UploadCache(self.path).entries))
+
+
+class CachedUploadTestCase(unittest.TestCase):
+    def test_upload_process(self):
+        uploaded = []
+
+        class FakeLPic(LPic):
+            def upload(self, file, prefix=''):
+                uploaded.append(prefix + file.name)
+                return True
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGB', (4, 4)).save(pic)
+            for _ in range(2):
+                lp = FakeLPic(adjust=True)
+                lp.use = 'fake'
+                lp.conf = {'UrlPrefix': 'https://foo.org/', 'AutoCompress': True,
+                           'UploadCache': True, 'UploadCachePath': os.path.join(tmp, 'upload.json')}
+                link = lp.upload_process(pic)
+                lp.exit()
+                self.assertEqual('https://foo.org/' + uploaded[0], link)
+
+        self.assertEqual(1, len(uploaded))
+
+
+
+class OutputCacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = OutputCache(tmp, max_size=300)
+            for i in range(3):
+                cache.put(str(i), b'x' * 80, '.jpg', 4, 3)
+                os.utime(os.path.join(tmp, str(i)), (i, i))
+            self.assertEqual((b'x' * 80, '.jpg', 4, 3), cache.get('0'))
+            # 0刚被访问过，淘汰最久未使用的1
+            cache.put('3', b'y' * 80, '.webp', 4, 3)
+            self.assertIsNone(cache.get('1'))
+            self.assertIsNotNone(cache.get('0'))
+            self.assertIsNotNone(cache.get('3'))
+
+    def test_preprocess(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGB', (40, 20)).save(pic)
+            lp = LPic()
+            lp.conf = {'AutoCompress': True, 'MaxSize': 20, 'OutputCache': True, 'TmpDir': tmp}
+            first = lp.preprocess(pic, True)
+            with mock.patch('PIL.Image.open', side_effect=AssertionError):
+                second = lp.preprocess(pic, True)
+            self.assertEqual(first.data, second.data)
+            self.assertEqual((20, 10), second[2:])
+            self.assertNotEqual(first.name, second.name)
+
+            # 预处理参数变化后重新压缩
+            lp.conf['JpegQuality'] = 30
+            self.assertNotEqual(first.data, lp.preprocess(pic, True).data)
+            self.assertEqual(2, len(os.listdir(os.path.join(tmp, 'outputs'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from catalog import Catalog
+from lpic import LPic
+
+
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.catalog = Catalog(':memory:')
+        for i in range(5):
+            self.catalog.add('aliyun', 'img', 'p/{}.jpg'.format(i), hash='h{}'.format(i), created=i,
+                             source='/tmp/shot{}.png'.format(i))
+        self.catalog.add('aliyun', 'img', 'q/0.jpg', created=10)
+        self.catalog.add('qiniu', 'img', 'p/9.jpg', created=20)
+
+    def tearDown(self):
+        self.catalog.close()
+
+    def test_query(self):
+        rows = self.catalog.query('aliyun', 'img', 'p/', limit=2)
+        self.assertEqual(['p/4.jpg', 'p/3.jpg'], [r['key'] for r in rows])
+        rows = self.catalog.query('aliyun', 'img', 'p/', limit=2, oldest=True)
+        self.assertEqual(['p/0.jpg', 'p/1.jpg'], [r['key'] for r in rows])
+        self.assertEqual(['p/9.jpg', 'p/4.jpg'], [r['key'] for r in self.catalog.query(prefix='p/', limit=2)])
+        self.assertEqual(['p/2.jpg'], [r['key'] for r in self.catalog.query(pattern='shot2')])
+        self.assertEqual(['p/3.jpg'], [r['key'] for r in self.catalog.query(pattern='h3')])
+        self.assertEqual([], self.catalog.query(pattern='%'))
+
+    def test_sync(self):
+        added, removed = self.catalog.sync('aliyun', 'img', [('p/0.jpg', 0), ('p/7.jpg', 7)], 'p/')
+        self.assertEqual((1, 4), (added, removed))
+        self.assertEqual(['q/0.jpg', 'p/7.jpg', 'p/0.jpg'], [r['key'] for r in self.catalog.query('aliyun')])
+        self.assertEqual('h0', self.catalog.query(pattern='p/0')[0]['hash'])
+
+
+class CatalogUploadTestCase(unittest.TestCase):
+    def test_upload_process(self):
+        class FakeLPic(LPic):
+            def upload(self, file, prefix=''):
+                return True
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGB', (40, 20)).save(pic)
+            lp = FakeLPic(adjust=True)
+            lp.use = 'fake'
+            lp.cloud = {'Bucket': 'img'}
+            lp.conf = {'UrlPrefix': 'https://foo.org/img/', 'AutoCompress': True, 'MaxSize': 20,
+                       'Catalog': os.path.join(tmp, 'catalog.db')}
+            link = lp.upload_process(pic)
+            rows = lp.catalog.query('fake', 'img', 'img/')
+            lp.exit()
+
+        self.assertEqual(1, len(rows))
+        self.assertEqual(link, rows[0]['link'])
+        self.assertEqual((20, 10), (rows[0]['width'], rows[0]['height']))
+        self.assertEqual(pic, rows[0]['source'])
+        self.assertEqual(64, len(rows[0]['hash']))
+
+
+if __name__ == '__main__':
+    unittest.main()
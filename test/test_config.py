@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+from lpic import LPic
+
+YML = '''# 默认云服务
+use: local
+local:
+  Root: /tmp
+  Bucket: 图片
+fake:
+  Bucket: b
+'''
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.join(self.tmp.name, 'cache')})
+        self.env.start()
+        self.yml = os.path.join(self.tmp.name, 'lpic.yml')
+        with open(self.yml, 'w', encoding='gbk') as fp:
+            fp.write(YML)
+        config.clear()
+
+    def tearDown(self):
+        config.clear()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_load(self):
+        data, source = config.load(self.yml, LPic.ENCODINGS)
+        self.assertEqual(('parse', '图片'), (source, data['local']['Bucket']))
+        # 返回的是副本
+        data['use'] = 'other'
+        self.assertEqual(('local', 'memory'), (config.load(self.yml)[0]['use'], config.load(self.yml)[1]))
+
+        # 新进程从磁盘缓存读取，不解析
+        config.clear()
+        with mock.patch('config.parse', side_effect=AssertionError):
+            self.assertEqual('disk', config.load(self.yml)[1])
+
+        with open(self.yml, 'a', encoding='gbk') as fp:
+            fp.write('other:\n  Bucket: c\n')
+        data, source = config.load(self.yml, LPic.ENCODINGS)
+        self.assertEqual(('parse', 'c'), (source, data['other']['Bucket']))
+
+    def test_prune(self):
+        other = os.path.join(self.tmp.name, 'other.yml')
+        with open(other, 'w') as fp:
+            fp.write('use: fake\n')
+        config.load(other)
+        self.assertTrue(os.path.exists(config.cache_path(os.path.realpath(other))))
+        os.remove(other)
+        # 缓存新的配置文件时删除源文件已不存在的缓存
+        config.load(self.yml, LPic.ENCODINGS)
+        self.assertEqual([os.path.basename(config.cache_path(os.path.realpath(self.yml)))],
+                         os.listdir(os.path.join(self.tmp.name, 'cache', 'lpic', 'config')))
+
+    def test_invalid(self):
+        with open(self.yml, 'w') as fp:
+            fp.write('use: [\n')
+        self.assertEqual(({}, 'parse'), config.load(self.yml))
+        self.assertRaises(FileNotFoundError, config.load, self.yml + '.missing')
+
+    def test_handle_use(self):
+        lp = LPic(self.yml)
+        self.assertTrue(lp.load_config())
+        self.assertEqual('local', lp.use)
+        os.chmod(self.yml, 0o600)
+        lp.handle_use('fake')
+        with open(self.yml, encoding='utf-8') as fp:
+            raw = fp.read()
+        self.assertEqual(YML.replace('use: local', 'use: fake'), raw)
+        self.assertEqual(0o600, os.stat(self.yml).st_mode & 0o777)
+
+        with mock.patch('config.parse', side_effect=AssertionError):
+            lp = LPic(self.yml)
+            self.assertTrue(lp.load_config())
+        self.assertEqual('fake', lp.use)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from time import sleep
+from unittest import mock
+
+from PIL import Image
+
+import daemon
+import lpic
+from lpic import LPic
+
+
+class FakeLPic(LPic):
+    auths = 0
+    uploaded = []
+
+    def auth(self):
+        FakeLPic.auths += 1
+        self.client = object()
+
+    def upload(self, file, prefix=''):
+        FakeLPic.uploaded.append(prefix + file.name)
+        return True
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conf = os.path.join(self.tmp.name, 'lpic.yml')
+        with open(self.conf, 'w') as fp:
+            fp.write('use: fake\nfake:\n  UrlPrefix: https://foo.org/\nconf:\n  UploadCache: false\n  AutoCopy: false\n'
+                     '  NameMode: datetime\n')
+        self.pic = os.path.join(self.tmp.name, 'tmp.png')
+        Image.new('RGB', (4, 4)).save(self.pic)
+
+        self.env = mock.patch.dict(os.environ, {'LPIC_SOCKET': os.path.join(self.tmp.name, 'lpic.sock')})
+        self.env.start()
+        self.providers = mock.patch.dict(lpic.PROVIDERS, {'fake': ('test_daemon', 'FakeLPic')})
+        self.providers.start()
+        self.cwd = os.getcwd()
+        self.level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.INFO)
+
+        FakeLPic.auths, FakeLPic.uploaded = 0, []
+        self.server = threading.Thread(target=daemon.serve, args=(self.conf,))
+        self.server.start()
+        for _ in range(50):
+            if daemon.call({'control': 'status'}):
+                break
+            sleep(0.05)
+
+    def tearDown(self):
+        daemon.control('stop')
+        self.server.join()
+        os.chdir(self.cwd)
+        logging.getLogger().setLevel(self.level)
+        self.providers.stop()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_request(self):
+        options = {'yes': True, 'adjust': False, 'use': None, 'use_all': False, 'conf': self.conf}
+        with self.assertLogs('daemon') as logs:
+            self.assertEqual(0, daemon.request('put', [self.pic], options))
+        self.assertEqual(1, len(FakeLPic.uploaded))
+        self.assertIn('https://foo.org/' + FakeLPic.uploaded[0], '\n'.join(logs.output))
+
+        options['yes'] = False
+        with mock.patch('builtins.input', return_value='n') as ask:
+            self.assertEqual(0, daemon.request('put', [self.pic], options))
+        ask.assert_called_once()
+        self.assertEqual(1, len(FakeLPic.uploaded))
+
+        with mock.patch('builtins.input', return_value='y'):
+            self.assertEqual(0, daemon.request('put', [self.pic], options))
+        self.assertEqual(2, len(FakeLPic.uploaded))
+        # 按时间命名时，每次上传的key不同
+        self.assertNotEqual(FakeLPic.uploaded[0], FakeLPic.uploaded[1])
+
+        # 客户端认证只在启动时进行一次
+        self.assertEqual(1, FakeLPic.auths)
+        self.assertEqual(['fake'], daemon.call({'control': 'status'})['clouds'])
+
+    def test_fallback(self):
+        options = {'conf': os.path.join(self.tmp.name, 'other.yml')}
+        self.assertIsNone(daemon.request('put', [self.pic], options))
+        # 未指定-c时使用默认配置，与守护进程的配置不同
+        self.assertIsNone(daemon.request('put', [self.pic], {'conf': None}))
+        self.assertEqual([], FakeLPic.uploaded)
+
+    def test_cwd(self):
+        # 相对路径按客户端的工作目录解析，守护进程不改变进程的工作目录
+        options = {'yes': True, 'adjust': False, 'conf': self.conf}
+        with daemon.connect() as sock, sock.makefile('rwb') as fp:
+            daemon.send(fp, {'cmd': 'put', 'dests': ['tmp.png'], 'options': options, 'cwd': self.tmp.name})
+            msgs = [json.loads(line.decode('utf-8')) for line in fp]
+        self.assertEqual({'exit': 0}, msgs[-1])
+        self.assertEqual(1, len(FakeLPic.uploaded))
+        self.assertEqual(self.cwd, os.getcwd())
+
+    def test_untrusted_socket(self):
+        path = daemon.socket_path()
+        self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+        options = {'yes': True, 'conf': self.conf}
+        # 其他用户的或权限过宽的套接字不使用
+        with mock.patch('os.getuid', return_value=os.getuid() + 1), self.assertLogs('daemon', 'WARNING'):
+            self.assertIsNone(daemon.request('put', [self.pic], options))
+        os.chmod(path, 0o666)
+        with self.assertLogs('daemon', 'WARNING'):
+            self.assertIsNone(daemon.request('put', [self.pic], options))
+        os.chmod(path, 0o600)
+        self.assertEqual([], FakeLPic.uploaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from discover import MtimeIndex, newest, scan_dir
+from lpic import LPic
+
+
+class DiscoverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.mkdir(os.path.join(self.root, 'sub'))
+        os.mkdir(os.path.join(self.root, '.hidden'))
+        self.touch('a.png', 1)
+        self.touch('b.txt', 5)
+        self.touch('c.jpg', 3)
+        self.touch(os.path.join('sub', 'd.png'), 4)
+        self.touch(os.path.join('.hidden', 'e.png'), 9)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, name, mtime):
+        path = os.path.join(self.root, name)
+        open(path, 'wb').close()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_newest(self):
+        self.assertEqual([os.path.join(self.root, 'c.jpg')], newest([self.root], 1, LPic.is_pic))
+        pics = newest([self.root], 5, LPic.is_pic, recursive=True)
+        self.assertEqual(['d.png', 'c.jpg', 'a.png'], [os.path.basename(p) for p in pics])
+
+    def test_index(self):
+        # 索引文件不放在被扫描的目录中，以免改变其修改时间
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        path = os.path.join(cache.name, 'mtime.json')
+        index = MtimeIndex(path)
+        self.assertEqual(3, len(newest([self.root], 5, LPic.is_pic, True, index)))
+
+        # 目录未变化时不再列举
+        index = MtimeIndex(path)
+        with mock.patch('discover.scan_dir', side_effect=scan_dir) as scan:
+            self.assertEqual(3, len(newest([self.root], 5, LPic.is_pic, True, index)))
+            self.assertEqual(0, scan.call_count)
+            new = self.touch(os.path.join('sub', 'f.png'), 10)
+            os.utime(os.path.join(self.root, 'sub'), (11, 11))
+            self.assertEqual([new], newest([self.root], 1, LPic.is_pic, True, index))
+            self.assertEqual(1, scan.call_count)
+
+            # 原地改写文件不改变目录的修改时间，仍能按文件的修改时间找到
+            a = self.touch('a.png', 20)
+            self.assertEqual([a], newest([self.root], 1, LPic.is_pic, True, index))
+            self.assertEqual(1, scan.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
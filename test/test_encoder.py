@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageFilter
+
+import encoder
+
+
+def sample(size=(320, 240)):
+    noise = Image.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(2))
+    return Image.merge('RGB', [Image.linear_gradient('L').resize(size), noise, Image.effect_noise(size, 20)])
+
+
+class EncoderTestCase(unittest.TestCase):
+    def test_max_bytes(self):
+        img = sample()
+        for threads in (1, 4):
+            search = encoder.QualitySearch(img, max_bytes=15000, threads=threads)
+            data, q, sub = search.run()
+            self.assertLessEqual(len(data), 15000)
+            # 再提高一级质量就会超出上限
+            if q < search.qmax:
+                self.assertGreater(len(encoder.encode_jpeg(img, q + 1, sub)), 15000)
+
+    def test_unreachable_max_bytes(self):
+        # 达不到上限时，返回最低质量的结果
+        img = sample()
+        search = encoder.QualitySearch(img, max_bytes=100)
+        _, q, _ = search.run()
+        self.assertEqual(search.qmin, q)
+
+    @unittest.skipUnless(encoder.has_numpy(), 'NumPy is not installed')
+    def test_min_ssim(self):
+        img = sample()
+        search = encoder.QualitySearch(img, min_ssim=0.9, threads=4)
+        data, q, sub = search.run()
+        self.assertGreaterEqual(search.results[(q, sub)][1], 0.9)
+        self.assertLess(len(data), len(encoder.encode_jpeg(img, 95, sub)))
+        if q > search.qmin:
+            self.assertLess(search.evaluate((q - 1, sub))[1], 0.9)
+
+    @unittest.skipUnless(encoder.has_numpy(), 'NumPy is not installed')
+    def test_ssim(self):
+        a = encoder.luma(sample())
+        self.assertAlmostEqual(1.0, encoder.ssim(a, a))
+        self.assertLess(encoder.ssim(a, 255 - a), 0.5)
+
+    @unittest.skipUnless(encoder.available('webp'), 'WebP is not supported')
+    def test_encode_best(self):
+        img = sample()
+        sizes = {fmt: len(encoder.encode(img, fmt)) for fmt in ('jpeg', 'webp')}
+        fmt, data = encoder.encode_best(img, ['jpeg', 'webp'])
+        self.assertEqual(min(sizes, key=sizes.get), fmt)
+        self.assertEqual(min(sizes.values()), len(data))
+
+        fmt, data = encoder.encode_best(img, ['jpeg', 'webp'], max_bytes=8000)
+        self.assertLessEqual(len(data), 8000)
+
+    def test_encode_png(self):
+        import io
+
+        img = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+        for i in range(8):
+            img.paste((i * 30, 255 - i * 30, 100, 100 + i * 20), (i * 8, 0, i * 8 + 8, 64))
+        data = encoder.encode(img, 'png')
+        with Image.open(io.BytesIO(data)) as png:
+            self.assertEqual('P', png.mode)
+            self.assertNotIn('icc_profile', png.info)
+            self.assertEqual(img.tobytes(), png.convert('RGBA').tobytes())
+
+        # 256种相近的颜色也无损
+        many = Image.new('RGBA', (256, 16))
+        many.putdata([(i, i // 2, 255 - i, 255 if i % 3 else 0) for i in range(256)] * 16)
+        self.assertEqual(many.tobytes(), encoder.to_palette(many).convert('RGBA').tobytes())
+
+        # RGB相同而透明度不同时逐像素查表
+        img.paste((0, 0, 0, 255), (0, 0, 8, 8))
+        pal = encoder.to_palette(img)
+        self.assertEqual(img.tobytes(), pal.convert('RGBA').tobytes())
+        with mock.patch('encoder.quantize_exact') as quantize:
+            encoder.to_palette(Image.new('RGBA', (4, 4), (1, 2, 3, 255)))
+        quantize.assert_called_once()
+
+        # 超过256种颜色时保持RGBA
+        noise = Image.merge('RGBA', [Image.effect_noise((64, 64), 80).convert('L') for _ in range(3)] +
+                            [Image.new('L', (64, 64), 128)])
+        self.assertIsNone(encoder.to_palette(noise))
+        with Image.open(io.BytesIO(encoder.encode(noise, 'png'))) as png:
+            self.assertEqual('RGBA', png.mode)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import threading
+import unittest
+from time import time
+
+from fakes3 import FakeS3LPic, FakeS3Server
+from lpic import Picture
+from retry import TransientError
+
+
+class FakeS3TestCase(unittest.TestCase):
+    def client(self, server):
+        lp = FakeS3LPic(use='fakes3')
+        lp.use = 'fakes3'
+        lp.cloud = {'Endpoint': server.url, 'Bucket': 'img'}
+        lp.conf = dict(lp.cloud, UrlPrefix=server.url + '/img/')
+        lp.auth()
+        self.addCleanup(lp.exit)
+        return lp
+
+    def test_objects(self):
+        with FakeS3Server() as server:
+            lp = self.client(server)
+            lp.PAGE_SIZE = 2
+            for i in range(5):
+                self.assertTrue(lp.upload(Picture('{}.jpg'.format(i), b'x' * i), 'p/'))
+            self.assertTrue(lp.exists('p/3.jpg'))
+            self.assertEqual(['p/{}.jpg'.format(i) for i in range(5)], [k for k, _ in lp.iter_objects('p/')])
+            self.assertEqual((['p/0.jpg', 'p/1.jpg'], {}), lp.delete_many(['p/0.jpg', 'p/1.jpg']))
+            self.assertTrue(lp.delete('p/2.jpg'))
+            self.assertEqual(['p/3.jpg', 'p/4.jpg'], sorted(lp.list('p/')))
+            self.assertEqual(b'xxx', server.buckets['img']['p/3.jpg'][0])
+
+    def test_faults(self):
+        with FakeS3Server(latency=0.05, error_rate=0.5, seed=1) as server:
+            lp = self.client(server)
+            results = []
+
+            def upload(i):
+                try:
+                    results.append(lp.upload(Picture('{}.jpg'.format(i), b'x'), ''))
+                except TransientError as e:
+                    results.append(e.status)
+
+            threads = [threading.Thread(target=upload, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(8, server.stats['requests'])
+            # 服务端同时处理多个请求
+            self.assertGreater(server.stats['max_inflight'], 1)
+            self.assertEqual(server.stats['errors'], results.count(503))
+            self.assertEqual(8 - server.stats['errors'], len(server.buckets['img']))
+
+    def test_bandwidth(self):
+        with FakeS3Server(bandwidth=100000) as server:
+            lp = self.client(server)
+            start = time()
+            lp.upload(Picture('a.jpg', b'x' * 20000))
+            self.assertGreaterEqual(time() - start, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
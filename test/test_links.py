@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from PIL import Image
+
+import links
+from local import LocalLPic
+
+
+class LinkTemplateTestCase(unittest.TestCase):
+    def test_split_url_prefix(self):
+        self.assertEqual(('https://foo.org', ''), links.split_url_prefix('https://foo.org/'))
+        self.assertEqual(('https://foo.org', 'a/b/'), links.split_url_prefix('https://foo.org/a/b'))
+        self.assertEqual(('http://foo.org', ''), links.split_url_prefix('http://foo.org'))
+        self.assertEqual(('file:///tmp', ''), links.split_url_prefix('file:///tmp/'))
+
+    def test_render(self):
+        t = links.LinkTemplate('https://foo.org', 'p/', '[$FILENAME]($URL) $FILEPART$FILEEXT $BASENAME {$DATE}',
+                               now=datetime(2020, 5, 10))
+        self.assertEqual('[a.jpg](https://foo.org/p/a.jpg) a.jpg b.png {2020-05-10}', t.render('/x/b.png', 'a.jpg'))
+        # 替换后的值中的$VAR不会再被替换
+        self.assertEqual('[$URL.jpg](https://foo.org/p/$URL.jpg) $URL.jpg b.png {2020-05-10}',
+                         t.render('/x/b.png', '$URL.jpg'))
+        self.assertEqual('https://foo.org/p/a.jpg', links.LinkTemplate('https://foo.org', 'p/').render(None, 'a.jpg'))
+        self.assertEqual(' ', links.LinkTemplate('', '', '$BASEPART $DIRNAME').render(None, 'a.jpg'))
+
+    def test_manifest(self):
+        records = [{'cloud': 'local', 'source': '/x/b.png', 'key': 'p/a.jpg', 'url': 'https://foo.org/p/a.jpg',
+                    'link': 'https://foo.org/p/a.jpg', 'size': 3},
+                   {'cloud': 'local', 'source': None, 'key': 'p/c,d.jpg', 'url': 'https://foo.org/p/c,d.jpg',
+                    'link': 'https://foo.org/p/c,d.jpg', 'size': None}]
+        for fmt, expected in (('md', '![b](https://foo.org/p/a.jpg)\n![c,d](https://foo.org/p/c,d.jpg)\n'),
+                              ('csv', 'cloud,source,key,url,link,size\n'
+                                      'local,/x/b.png,p/a.jpg,https://foo.org/p/a.jpg,https://foo.org/p/a.jpg,3\n'
+                                      'local,,"p/c,d.jpg","https://foo.org/p/c,d.jpg","https://foo.org/p/c,d.jpg",\n')):
+            fp = io.StringIO()
+            links.write_manifest(records, fp, fmt)
+            self.assertEqual(expected, fp.getvalue())
+        fp = io.StringIO()
+        links.write_manifest(records, fp)
+        self.assertEqual(records, [json.loads(line) for line in fp.getvalue().splitlines()])
+        self.assertEqual('csv', links.manifest_format('out.CSV'))
+        self.assertEqual('jsonl', links.manifest_format('-'))
+        self.assertEqual('md', links.manifest_format('-', 'md'))
+
+    def test_put_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = os.path.join(tmp, 'links.jsonl')
+            lp = LocalLPic(use='local', yes=True, manifest=manifest)
+            lp.use = 'local'
+            lp.cloud = {'Root': tmp, 'Bucket': 'img'}
+            lp.conf = dict(lp.cloud, UrlPrefix='https://foo.org/pics', NameMode='md5', UploadThreads=2, Processes=1)
+            lp.auth()
+            pics = []
+            for i in range(3):
+                pics.append(os.path.join(tmp, '{}.png'.format(i)))
+                Image.new('RGB', (4, 4), (i, 0, 0)).save(pics[-1])
+            lp.handle_put(*pics)
+            lp.exit()
+            with open(manifest, encoding='utf-8') as fp:
+                rows = [json.loads(line) for line in fp]
+        self.assertEqual(sorted(pics), sorted(r['source'] for r in rows))
+        for r in rows:
+            self.assertTrue(r['key'].startswith('pics/'))
+            self.assertEqual('https://foo.org/' + r['key'], r['link'])
+        self.assertEqual([], lp.records)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from local import LocalLPic
+from lpic import Picture
+
+
+class LocalLPicTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lpic = LocalLPic(use='local', adjust=True)
+        self.lpic.use = 'local'
+        self.lpic.cloud = {'Root': self.tmp.name, 'Bucket': 'img'}
+        self.lpic.conf = dict(self.lpic.cloud, UrlPrefix='file://{}/img/pics/'.format(self.tmp.name),
+                              AutoCompress=True)
+        self.lpic.auth()
+
+    def tearDown(self):
+        self.lpic.exit()
+        self.tmp.cleanup()
+
+    def test_upload(self):
+        self.assertTrue(self.lpic.upload(Picture('a.jpg', b'foo'), 'pics/'))
+        pic = os.path.join(self.tmp.name, 'b.png')
+        Image.new('RGB', (4, 4)).save(pic)
+        link = self.lpic.upload_process(pic)
+        key = link.rsplit('/', 2)[-2] + '/' + link.rsplit('/', 1)[-1]
+        self.assertTrue(self.lpic.exists(key))
+        self.assertTrue(os.path.isfile(link[len('file://'):]))
+
+        self.assertEqual(sorted(['pics/a.jpg', key]), sorted(self.lpic.list('pics/')))
+        self.assertEqual([], self.lpic.list('other/'))
+        self.assertEqual(['pics/a.jpg'], self.lpic.list('pics/a.'))
+
+        self.assertEqual((['pics/a.jpg'], {}), self.lpic.delete_many(['pics/a.jpg']))
+        self.assertFalse(self.lpic.exists('pics/a.jpg'))
+        self.assertFalse(self.lpic.delete('pics/a.jpg'))
+
+    def test_datetime_names(self):
+        # 长时间运行时（watch、守护进程），每次上传重新取时间，不会覆盖之前的文件
+        self.lpic.conf.update(NameMode='datetime', UrlPrefix='file://{}/img/$DATETIME(%f)/'.format(self.tmp.name))
+        pic = os.path.join(self.tmp.name, 'b.png')
+        Image.new('RGB', (4, 4)).save(pic)
+        links = [self.lpic.upload_process(pic) for _ in range(2)]
+        self.assertNotEqual(links[0], links[1])
+        self.assertNotEqual(links[0].rsplit('/', 2)[-2], links[1].rsplit('/', 2)[-2])
+        for link in links:
+            self.assertTrue(os.path.isfile(link[len('file://'):]))
+
+    def test_multipart_resume(self):
+        self.lpic.conf.update(MultipartThreshold='1K', PartSize='1K', PartThreads=1)
+        pic = os.path.join(self.tmp.name, 'big.png')
+        data = os.urandom(5000)
+        with open(pic, 'wb') as fp:
+            fp.write(data)
+        written = []
+        write_part = LocalLPic.write_part
+
+        def fail_at_2(filename, i, part_size, dest):
+            if i == 2:
+                raise IOError('中断')
+            written.append(i)
+            write_part(filename, i, part_size, dest)
+
+        with mock.patch.object(LocalLPic, 'write_part', staticmethod(fail_at_2)):
+            self.assertRaises(IOError, self.lpic.upload, pic, 'pics/')
+        self.assertNotIn(2, written)
+        self.assertFalse(self.lpic.exists('pics/big.png'))
+
+        # 再次上传时跳过已完成的分片
+        done, written = set(written), []
+        with mock.patch.object(LocalLPic, 'write_part', staticmethod(lambda *args: (written.append(args[1]),
+                                                                                    write_part(*args)))):
+            self.assertTrue(self.lpic.upload(pic, 'pics/'))
+        self.assertEqual(sorted(set(range(5)) - done), sorted(written))
+        with open(os.path.join(self.tmp.name, 'img', 'pics', 'big.png'), 'rb') as fp:
+            self.assertEqual(data, fp.read())
+        self.assertEqual([], os.listdir(self.lpic.journal_dir()))
+
+    def test_invalid_key(self):
+        self.assertRaises(ValueError, self.lpic.upload, Picture('x', b''), '../')
+
+
+if __name__ == '__main__':
+    unittest.main()
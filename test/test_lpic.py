@@ -1,11 +1,15 @@
+import json
 import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from datetime import datetime
 from time import sleep
 
 from PIL import Image
 
-from lpic import LPic
+from lpic import LPic, Picture, load_provider
 
 
 class LPicTestCase(unittest.TestCase):
@@ -78,6 +82,235 @@ class LPicTestCase(unittest.TestCase):
         for i in range(2):
             os.remove(tmp.format(i))
 
+    def test_expand_pics(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('a.jpg', 'b.png', 'c.txt'):
+                open(os.path.join(tmp, name), 'wb').close()
+            a, b = os.path.join(tmp, 'a.jpg'), os.path.join(tmp, 'b.png')
+            self.assertEqual([a, b], self.lpic.expand_pics([tmp]))
+            self.assertEqual([b], self.lpic.expand_pics([os.path.join(tmp, '*.png')]))
+            self.assertEqual([a, b], self.lpic.expand_pics([a, tmp]))
+            self.assertEqual([], self.lpic.expand_pics([os.path.join(tmp, 'none.jpg')]))
+
+    def test_preprocess(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGB', (4, 4)).save(pic)
+            self.lpic.conf = {'AutoCompress': True, 'NameMode': 'md5'}
+            ret = self.lpic.preprocess(pic, True)
+            self.assertTrue(ret.name.endswith('.jpg'))
+            self.assertEqual(b'\xff\xd8', ret.data[:2])
+            self.assertEqual([], [f for f in os.listdir(tmp) if f != 'tmp.png'])
+
+            ret = self.lpic.preprocess(pic, False)
+            self.assertEqual(self.lpic.hash_file(pic, 'md5') + '.png', ret.name)
+            self.assertEqual(pic, ret.data)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'VmHWM is not available')
+    def test_preprocess_large(self):
+        # 分别在子进程中测量完整解码后缩放与按MaxSize缩小解码的峰值内存和耗时
+        code = '''
+import json, sys, time
+from PIL import Image
+from lpic import LPic
+start = time.perf_counter()
+if sys.argv[2] == 'full':
+    img = Image.open(sys.argv[1])
+    img.resize((1600, 1066), Image.BICUBIC).save('/dev/null', format='JPEG')
+else:
+    lp = LPic()
+    lp.conf = {'AutoCompress': True, 'MaxSize': 1600}
+    assert lp.preprocess(sys.argv[1], True)[2:] == (1600, 1066)
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as fp:
+    peak = [int(line.split()[1]) for line in fp if line.startswith('VmHWM')][0]
+print(json.dumps([elapsed, peak]))
+'''
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'big.jpg')
+            Image.linear_gradient('L').resize((6000, 4000)).convert('RGB').save(pic, quality=90)
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(sys.modules['lpic'].__file__))
+            results = {}
+            for mode in ('full', 'draft'):
+                out = subprocess.check_output([sys.executable, '-c', code, pic, mode], env=env)
+                results[mode] = json.loads(out.decode())
+        for mode, (elapsed, peak) in results.items():
+            print('{}: {:.0f}ms, peak RSS {}MB'.format(mode, elapsed * 1000, peak // 1024), file=sys.stderr)
+        self.assertLess(results['draft'][1], results['full'][1])
+
+    def test_preprocess_reduce(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGB', (1000, 500)).save(pic)
+            self.lpic.conf = {'AutoCompress': True, 'MaxSize': 300, 'MaxPixels': 10 ** 6}
+            self.assertEqual((300, 150), self.lpic.preprocess(pic, True)[2:])
+            self.lpic.conf['MaxPixels'] = 1000
+            self.assertRaises(ValueError, self.lpic.preprocess, pic, True)
+            # 单个文件上传时记录错误，不抛出异常
+            self.lpic.option = {'adjust': True}
+            with self.assertLogs('lpic', 'ERROR'):
+                self.assertIsNone(self.lpic.upload_process(pic))
+            self.assertGreater(self.lpic.estimate_memory(pic, True), 4 * 1000 * 500)
+
+    def test_preprocess_alpha(self):
+        import io
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pic = os.path.join(tmp, 'tmp.png')
+            Image.new('RGBA', (4, 4), (255, 0, 0, 128)).save(pic)
+            # 不填充Alpha通道时，JPEG无法保留透明度，上传原文件
+            self.lpic.conf = {'AutoCompress': True, 'FillAlpha': False}
+            self.assertEqual(pic, self.lpic.preprocess(pic, True).data)
+
+            self.lpic.conf['OutputFormats'] = ['jpeg', 'webp']
+            ret = self.lpic.preprocess(pic, True)
+            self.assertTrue(ret.name.endswith('.webp'))
+            with Image.open(io.BytesIO(ret.data)) as img:
+                self.assertEqual('RGBA', img.mode)
+            self.assertTrue(self.lpic.generate_file_link(pic, ret.name).endswith('.webp'))
+
+            self.lpic.conf.update({'OutputFormats': ['jpeg'], 'OptimizePNG': True})
+            Image.new('RGBA', (400, 400), (255, 0, 0, 128)).save(pic, icc_profile=b'\0' * 4096)
+            ret = self.lpic.preprocess(pic, True)
+            self.assertTrue(ret.name.endswith('.png'))
+            self.assertLess(len(ret.data), os.path.getsize(pic))
+            with Image.open(io.BytesIO(ret.data)) as img:
+                self.assertEqual((255, 0, 0, 128), img.convert('RGBA').getpixel((0, 0)))
+
+    def test_upload_batch(self):
+        uploaded = []
+
+        class FakeLPic(LPic):
+            def upload(self, file, prefix=''):
+                uploaded.append(prefix + file.name)
+                return True
+
+        lp = FakeLPic(adjust=True)
+        lp.conf = {'AutoCompress': True, 'NameMode': 'datetime', 'UrlPrefix': 'https://foo.org/img/',
+                   'Processes': 2, 'UploadThreads': 2}
+        with tempfile.TemporaryDirectory() as tmp:
+            pics = [os.path.join(tmp, 'tmp{}.png'.format(i)) for i in range(5)]
+            for pic in pics:
+                Image.new('RGB', (4, 4)).save(pic)
+            links = lp.upload_batch(pics)
+            lp.exit()
+
+        self.assertEqual(5, len(links))
+        self.assertEqual(5, len(set(uploaded)))
+        self.assertTrue(all(k.startswith('img/') and k.endswith('.jpg') for k in uploaded))
+        self.assertTrue(all(link.startswith('https://foo.org/img/') for link in links))
+
+    def test_parse_size(self):
+        self.assertEqual(512, self.lpic.parse_size(512))
+        self.assertEqual(512 * 1024, self.lpic.parse_size('512K'))
+        self.assertEqual(20 * 1024 * 1024, self.lpic.parse_size('20M'))
+        self.assertEqual(int(1.5 * 1024 ** 3), self.lpic.parse_size('1.5GB'))
+        self.assertRaises(ValueError, self.lpic.parse_size, '1T')
+
+    def test_use_multipart(self):
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(b'0' * 2048)
+            fp.flush()
+            self.lpic.conf = {'MultipartThreshold': '1K'}
+            self.assertTrue(self.lpic.use_multipart(self.lpic.as_picture(fp.name)))
+            self.assertFalse(self.lpic.use_multipart(Picture('a.jpg', b'0' * 2048)))
+            self.lpic.conf = {'MultipartThreshold': '4K'}
+            self.assertFalse(self.lpic.use_multipart(self.lpic.as_picture(fp.name)))
+
+    def test_list(self):
+        pages = []
+
+        class FakeLPic(LPic):
+            PAGE_SIZE = 10
+
+            def iter_objects(self, prefix):
+                for page in range(100):
+                    pages.append(page)
+                    for i in range(self.PAGE_SIZE):
+                        n = page * self.PAGE_SIZE + i
+                        # 修改时间与key的顺序无关
+                        yield '{}{}'.format(prefix, n), (n * 7919) % 1000
+
+        lp = FakeLPic()
+        self.assertEqual(['p/321', 'p/642', 'p/963'], lp.list('p/', 3))
+        self.assertEqual(100, len(lp.list('p/')))
+        self.assertEqual(200, len(pages))
+
+        pages.clear()
+        self.assertEqual(('p/0', 0), next(lp.iter_objects('p/')))
+        self.assertEqual([0], pages)
+
+    def test_handle_del(self):
+        batches = []
+
+        class FakeLPic(LPic):
+            BATCH_DELETE_SIZE = 3
+
+            def __init__(self, **option):
+                super(FakeLPic, self).__init__(**option)
+                self.objects = {'p/{}'.format(i): i for i in range(10)}
+                self.objects['q/0'] = 0
+
+            def iter_objects(self, prefix):
+                for k, t in list(self.objects.items()):
+                    if k.startswith(prefix):
+                        yield k, t
+
+            def exists(self, key):
+                return key in self.objects
+
+            def delete_many(self, keys):
+                batches.append(len(keys))
+                for k in keys:
+                    if k != 'p/5':
+                        del self.objects[k]
+                return [k for k in keys if k != 'p/5'], {'p/5': 'denied'} if 'p/5' in keys else {}
+
+        lp = FakeLPic(yes=True, count=2, oldest=True)
+        lp.handle_del('p/')
+        self.assertNotIn('p/0', lp.objects)
+        self.assertNotIn('p/1', lp.objects)
+        self.assertIn('p/2', lp.objects)
+
+        lp = FakeLPic(yes=True, count=0, dry_run=True)
+        lp.handle_del('p/')
+        self.assertEqual(11, len(lp.objects))
+
+        batches.clear()
+        lp = FakeLPic(yes=True, count=0)
+        with self.assertLogs('lpic') as logs:
+            lp.handle_del('p/')
+        self.assertEqual(['p/5', 'q/0'], sorted(lp.objects))
+        self.assertEqual([1, 3, 3, 3], sorted(batches))
+        self.assertIn('p/5  denied', '\n'.join(logs.output))
+
+        # 本地索引中的文件已在别处删除时，改为列举远程文件
+        lp = FakeLPic(yes=True)
+        lp.use, lp.cloud, lp.conf = 'fake', {'Bucket': 'img'}, {'Catalog': ':memory:'}
+        lp.catalog.add('fake', 'img', 'p/x', created=100)
+        with self.assertLogs('lpic', 'WARNING'):
+            lp.handle_del('p/')
+        self.assertNotIn('p/9', lp.objects)
+        self.assertEqual([], lp.catalog.query('fake', 'img'))
+        lp.catalog.add('fake', 'img', 'p/8', created=100)
+        lp.handle_del('p/')
+        self.assertNotIn('p/8', lp.objects)
+        self.assertIn('p/7', lp.objects)
+        lp.exit()
+
+    def test_lazy_import(self):
+        code = ('import sys; import lpic; '
+                'print(",".join(m for m in ("PIL", "yaml", "pyperclip", "oss2", "qiniu", "qcloud_cos", "sqlite3", '
+                '"retry", "cache", "email.utils", "json", "csv") '
+                'if m in sys.modules))')
+        src = os.path.dirname(os.path.abspath(sys.modules['lpic'].__file__))
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=src)
+        self.assertEqual(b'', out.strip())
+
+    def test_load_provider(self):
+        self.assertEqual('AliyunLPic', load_provider('aliyun').__name__)
+        self.assertIsNone(load_provider('foo'))
+
 
 if __name__ == '__main__':
     unittest.main()
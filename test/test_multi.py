@@ -0,0 +1,106 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from time import sleep
+from unittest import mock
+
+from PIL import Image
+
+from lpic import LPic
+from multi import MultiLPic
+
+
+class SlowLPic(LPic):
+    # 各云服务同时在上传的数量
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def __init__(self, conf=None, **option):
+        super(SlowLPic, self).__init__(conf, **option)
+        self.uploaded = []
+
+    def upload(self, file, prefix=''):
+        with SlowLPic.lock:
+            SlowLPic.active += 1
+            SlowLPic.max_active = max(SlowLPic.max_active, SlowLPic.active)
+        sleep(0.2)
+        with SlowLPic.lock:
+            SlowLPic.active -= 1
+            self.uploaded.append(prefix + file.name)
+        return True
+
+
+class MultiLPicTestCase(unittest.TestCase):
+    def setUp(self):
+        SlowLPic.active = SlowLPic.max_active = 0
+        self.providers = []
+        for use in ('foo', 'bar', 'baz'):
+            p = SlowLPic(use=use)
+            p.use = use
+            p.cloud_name = use
+            p.conf = {'UrlPrefix': 'https://{}.org/'.format(use)}
+            self.providers.append(p)
+        self.lpic = MultiLPic(self.providers, adjust=True)
+        self.lpic.use = 'foo'
+        self.lpic.conf = {'AutoCompress': True, 'NameMode': 'uuid', 'UploadThreads': 3}
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.lpic.exit()
+        self.tmp.cleanup()
+
+    def test_upload_process(self):
+        pic = os.path.join(self.tmp.name, 'tmp.png')
+        Image.new('RGB', (4, 4)).save(pic)
+        links = self.lpic.upload_process(pic)
+        # 各云服务并发上传
+        self.assertEqual(3, SlowLPic.max_active)
+        keys = [p.uploaded for p in self.providers]
+        self.assertEqual(1, len(keys[0]))
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(keys[0], keys[2])
+        self.assertEqual(['https://bar.org/' + keys[0][0]], links[1])
+        # 各云服务使用同一上传时间
+        self.assertEqual({self.lpic.now}, {p.now for p in self.providers})
+
+    def test_hash_once(self):
+        pic = os.path.join(self.tmp.name, 'tmp.png')
+        Image.new('RGB', (4, 4)).save(pic)
+        for p in self.providers:
+            p.conf['UploadCache'] = True
+            p.conf['UploadCachePath'] = os.path.join(self.tmp.name, '{}.json'.format(p.use))
+        with mock.patch('hashlib.sha256', wraps=hashlib.sha256) as sha256:
+            self.lpic.upload_process(pic)
+        self.assertEqual(1, sha256.call_count)
+
+    def test_cache_settings(self):
+        pic = os.path.join(self.tmp.name, 'tmp.png')
+        Image.new('RGB', (4, 4)).save(pic)
+        for p in self.providers:
+            p.conf['UploadCache'] = True
+            p.conf['UploadCachePath'] = os.path.join(self.tmp.name, '{}.json'.format(p.use))
+        # bar自身的预处理配置与foo不同，但图片按foo的配置预处理
+        self.providers[1].conf['JpegQuality'] = 50
+        self.lpic.upload_process(pic)
+        settings = self.lpic.preprocess_settings()
+        bar = self.providers[1]
+        self.assertIsNotNone(bar.upload_cache.get(bar.cache_key(pic, settings)))
+        self.assertIsNone(bar.upload_cache.get(bar.cache_key(pic)))
+        # 再次上传时命中缓存
+        self.lpic.upload_process(pic)
+        self.assertEqual(1, len(bar.uploaded))
+
+    def test_upload_batch(self):
+        pics = [os.path.join(self.tmp.name, 'tmp{}.png'.format(i)) for i in range(3)]
+        for pic in pics:
+            Image.new('RGB', (4, 4)).save(pic)
+        links = self.lpic.upload_batch(pics)
+        self.assertEqual([3, 3, 3], [len(ls) for ls in links])
+        self.assertEqual(sorted(self.providers[0].uploaded), sorted(self.providers[2].uploaded))
+
+
+if __name__ == '__main__':
+    unittest.main()
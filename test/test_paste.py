@@ -0,0 +1,93 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import paste
+from local import LocalLPic
+
+
+class Stdin:
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+
+def image_bytes(fmt='PNG', size=(300, 200)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buf, format=fmt)
+    return buf.getvalue()
+
+
+class PasteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lpic = LocalLPic(use='local')
+        self.lpic.use = 'local'
+        self.lpic.cloud = {'Root': os.path.join(self.tmp.name, 'root'), 'Bucket': 'img'}
+        self.lpic.conf = dict(self.lpic.cloud, AutoCompress=True, MaxSize='100x100', NameMode='md5',
+                              TmpDir=os.path.join(self.tmp.name, 'tmp'))
+        self.lpic.option = {'adjust': True}
+        self.lpic.auth()
+
+    def tearDown(self):
+        self.lpic.exit()
+        self.tmp.cleanup()
+
+    def uploaded(self):
+        root = os.path.join(self.tmp.name, 'root', 'img')
+        return sorted(os.listdir(root))
+
+    def test_as_picture(self):
+        self.assertEqual('stdin.jpg', paste.as_picture(image_bytes('JPEG'), 'stdin').name)
+        self.assertIsNone(paste.as_picture(b'not an image', 'stdin'))
+
+    def test_put_stdin(self):
+        data = image_bytes()
+        with mock.patch('sys.stdin', Stdin(data)):
+            self.lpic.handle_put('-')
+        uploaded = self.uploaded()
+        self.assertEqual(1, len(uploaded))
+        name, ext = os.path.splitext(uploaded[0])
+        self.assertEqual('.jpg', ext)
+        self.assertEqual(self.lpic.hash_file(paste.as_picture(data, 'stdin'), 'md5'), name)
+        with Image.open(os.path.join(self.tmp.name, 'root', 'img', uploaded[0])) as img:
+            self.assertEqual((100, 66), img.size)
+        # 不产生临时文件
+        tmp = os.path.join(self.tmp.name, 'tmp')
+        self.assertEqual([], os.listdir(tmp) if os.path.isdir(tmp) else [])
+
+        with mock.patch('sys.stdin', Stdin(b'')), self.assertLogs('paste', 'ERROR'):
+            self.lpic.handle_put('-')
+        self.assertEqual(1, len(self.uploaded()))
+
+    def test_put_stdin_raw(self):
+        # 不预处理时原样上传
+        self.lpic.option = {'adjust': False}
+        data = image_bytes('GIF')
+        with mock.patch('sys.stdin', Stdin(data)):
+            self.lpic.handle_put('-')
+        uploaded = self.uploaded()
+        self.assertTrue(uploaded[0].endswith('.gif'))
+        with open(os.path.join(self.tmp.name, 'root', 'img', uploaded[0]), 'rb') as fp:
+            self.assertEqual(data, fp.read())
+
+    def test_clipboard(self):
+        shot = os.path.join(self.tmp.name, 'shot.png')
+        with open(shot, 'wb') as fp:
+            fp.write(image_bytes())
+        commands = [('false',), ('cat', shot)]
+        with mock.patch('paste.clipboard_commands', return_value=commands):
+            self.lpic.option['yes'] = True
+            self.lpic.run('clip')
+        self.assertEqual(1, len(self.uploaded()))
+
+        with mock.patch('paste.clipboard_commands', return_value=[('true',)]), \
+                mock.patch('paste.grab_clipboard', return_value=None), self.assertLogs('paste', 'ERROR'):
+            self.assertIsNone(paste.read_clipboard())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import threading
+import unittest
+from time import sleep
+from unittest import mock
+
+from pipeline import Budget, Pipeline
+
+
+def square(x):
+    return x * x
+
+
+class PipelineTestCase(unittest.TestCase):
+    def test_run(self):
+        results = {pic: (file, rets) for pic, file, rets in
+                   Pipeline(2, 2).run(range(5), square, [lambda pic, file: file + 1])}
+        self.assertEqual({i: (i * i, [i * i + 1]) for i in range(5)}, results)
+
+    def test_memory(self):
+        budgets = []
+
+        class RecordingBudget(Budget):
+            def __init__(self, total):
+                super(RecordingBudget, self).__init__(total)
+                self.peak = 0
+                budgets.append(self)
+
+            def acquire(self, n):
+                n = super(RecordingBudget, self).acquire(n)
+                self.peak = max(self.peak, self.total - self.free)
+                return n
+
+        # 每张估计60，总量100，所以同时只能预处理一张
+        with mock.patch('pipeline.Budget', RecordingBudget):
+            pipeline = Pipeline(2, 2, memory=100)
+            results = list(pipeline.run(range(4), square, [lambda pic, file: file], cost=lambda pic: 60))
+        self.assertEqual(4, len(results))
+        self.assertEqual(60, budgets[0].peak)
+        self.assertEqual(100, budgets[0].free)
+
+    def test_budget(self):
+        budget = Budget(100)
+        self.assertEqual(60, budget.acquire(60))
+        acquired = threading.Event()
+
+        def worker():
+            # 超过总量时按总量获取
+            budget.acquire(500)
+            acquired.set()
+
+        threading.Thread(target=worker, daemon=True).start()
+        sleep(0.1)
+        self.assertFalse(acquired.is_set())
+        budget.release(60)
+        self.assertTrue(acquired.wait(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import threading
+import unittest
+from email.utils import formatdate
+from time import sleep, time
+
+import retry
+from fakes3 import FakeS3LPic, FakeS3Server
+from lpic import Picture
+
+
+class RetryTestCase(unittest.TestCase):
+    def test_parse_retry_after(self):
+        self.assertEqual(2.5, retry.parse_retry_after(' 2.5'))
+        self.assertEqual(0, retry.parse_retry_after('-1'))
+        self.assertAlmostEqual(10, retry.parse_retry_after(formatdate(time() + 10, usegmt=True)), delta=1.5)
+        self.assertIsNone(retry.parse_retry_after('soon'))
+        self.assertIsNone(retry.parse_retry_after(None))
+
+    def test_backoff(self):
+        backoff = retry.Backoff(base=1, cap=5, seed=1)
+        for attempt in range(6):
+            self.assertLessEqual(backoff.delay(attempt), min(5, 2 ** attempt))
+        self.assertEqual(3, backoff.delay(0, retry_after=3))
+        self.assertEqual(10, backoff.delay(0, retry_after=60))
+
+    def test_call(self):
+        calls = []
+
+        def flaky(n):
+            calls.append(n)
+            if len(calls) < 3:
+                raise retry.TransientError('slow down', 503, retry_after=0)
+            return n
+
+        limiter = retry.AIMDLimiter(4)
+        self.assertEqual(7, retry.call(flaky, 7, backoff=retry.Backoff(3, 0), limiter=limiter))
+        self.assertEqual([7, 7, 7], calls)
+        self.assertEqual(0, limiter.inflight)
+        self.assertLess(limiter.limit, 4)
+
+        calls.clear()
+        self.assertRaises(retry.TransientError, retry.call, flaky, 1, backoff=retry.Backoff(1, 0))
+        self.assertEqual(2, len(calls))
+
+        def broken():
+            calls.append(None)
+            raise ValueError
+
+        calls.clear()
+        self.assertRaises(ValueError, retry.call, broken, backoff=retry.Backoff(3, 0))
+        self.assertEqual(1, len(calls))
+
+    def test_limiter(self):
+        limiter = retry.AIMDLimiter(8)
+        # 同一轮中的多个限流只减半一次
+        tokens = [limiter.acquire() for _ in range(8)]
+        for t in tokens:
+            limiter.release(t, throttled=True)
+        self.assertEqual(4, limiter.limit)
+        limiter.release(limiter.acquire(), throttled=True)
+        self.assertEqual(2, limiter.limit)
+        for _ in range(20):
+            limiter.release(limiter.acquire())
+        self.assertTrue(5 < limiter.limit <= 8)
+        for _ in range(100):
+            limiter.release(limiter.acquire())
+        self.assertEqual(8, limiter.limit)
+
+        limiter = retry.AIMDLimiter(2)
+        state = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def work():
+            t = limiter.acquire()
+            with lock:
+                state['now'] += 1
+                state['max'] = max(state['max'], state['now'])
+            sleep(0.01)
+            with lock:
+                state['now'] -= 1
+            limiter.release(t)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(2, state['max'])
+
+    def test_upload_retry(self):
+        with FakeS3Server(error_rate=0.3, seed=2) as server:
+            lp = FakeS3LPic(use='fakes3')
+            lp.use = 'fakes3'
+            lp.cloud = {'Endpoint': server.url, 'Bucket': 'img'}
+            lp.conf = dict(lp.cloud, UrlPrefix=server.url + '/img/', Retries=8, RetryBackoff=0.001, UploadThreads=4)
+            lp.auth()
+            self.addCleanup(lp.exit)
+            links = []
+
+            def upload(i):
+                links.append(lp.upload_file('{}.jpg'.format(i), Picture('{}.jpg'.format(i), b'x'), copy=False))
+
+            threads = [threading.Thread(target=upload, args=(i,)) for i in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(16, len(list(filter(None, links))))
+            self.assertEqual(16, len(server.buckets['img']))
+            self.assertGreater(server.stats['errors'], 0)
+            self.assertLessEqual(server.stats['max_inflight'], 4)
+
+            # 重试次数用完时返回None并记录错误
+            lp.conf['Retries'] = 0
+            server.error_rate = 1
+            with self.assertLogs('lpic', 'ERROR'):
+                self.assertIsNone(lp.upload_file('x.jpg', Picture('x.jpg', b'x'), copy=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+import timing
+from local import LocalLPic
+
+
+class TimingTestCase(unittest.TestCase):
+    def setUp(self):
+        timing.reset()
+
+    def tearDown(self):
+        timing.enable(False)
+        timing.reset()
+
+    def test_disabled(self):
+        with timing.span('upload', bytes=1) as s:
+            s.fields['format'] = 'jpg'
+        self.assertEqual([], timing.events())
+
+    def test_span(self):
+        timing.enable()
+        with timing.span('upload', bytes=1 << 20) as s:
+            s.fields['cloud'] = 'local'
+        with self.assertRaises(KeyError):
+            with timing.span('decode'):
+                raise KeyError
+        upload, decode = timing.events()
+        self.assertEqual(('upload', 'local', 1 << 20), (upload['name'], upload['cloud'], upload['bytes']))
+        self.assertIn('mb_per_s', upload)
+        self.assertEqual('KeyError', decode['error'])
+
+        lines = timing.summary().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('phase'))
+        self.assertEqual(['upload', 'decode'], sorted([l.split()[0] for l in lines[1:]], reverse=True))
+        self.assertEqual(2, len([json.loads(l) for l in timing.json_lines().splitlines()]))
+
+    def test_hook(self):
+        received = []
+        timing.add_hook(received.append)
+        try:
+            self.assertTrue(timing.active())
+            timing.timed('config')(lambda: None)()
+        finally:
+            timing.remove_hook(received.append)
+        self.assertEqual(['config'], [e['name'] for e in received])
+        # 只注册回调时不保存事件
+        self.assertEqual([], timing.events())
+        self.assertFalse(timing.active())
+
+    def test_upload_phases(self):
+        timing.enable()
+        with tempfile.TemporaryDirectory() as tmp:
+            lp = LocalLPic(use='local', adjust=True)
+            lp.use = 'local'
+            lp.cloud = {'Root': tmp, 'Bucket': 'img'}
+            lp.conf = dict(lp.cloud, AutoCompress=True, MaxSize='64x64', NameMode='md5')
+            lp.auth()
+            pic = os.path.join(tmp, 'a.png')
+            Image.new('RGB', (200, 100), 'red').save(pic)
+            self.assertTrue(lp.upload_process(pic))
+            lp.exit()
+        names = {e['name'] for e in timing.events()}
+        self.assertTrue({'decode', 'resize', 'encode', 'upload'} <= names, names)
+        encode = [e for e in timing.events() if e['name'] == 'encode'][0]
+        self.assertEqual('.jpg', encode['format'])
+        self.assertGreater(encode['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
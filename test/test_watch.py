@@ -0,0 +1,59 @@
+import os
+import tempfile
+import threading
+import unittest
+from time import sleep
+
+from watch import InotifyWatcher, PollingWatcher, watch
+
+
+class WatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        open(os.path.join(self.tmp.name, 'old.png'), 'wb').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_watcher(self, watcher):
+        self.assertEqual([], watcher.poll(0.05))
+        new = os.path.join(self.tmp.name, 'new.png')
+        with open(new, 'wb') as fp:
+            fp.write(b'1')
+        changed = []
+        for _ in range(10):
+            changed += watcher.poll(0.05)
+        watcher.close()
+        self.assertIn(new, changed)
+        self.assertNotIn(os.path.join(self.tmp.name, 'old.png'), changed)
+
+    def test_polling(self):
+        self.check_watcher(PollingWatcher([self.tmp.name], 0.05))
+
+    @unittest.skipUnless(hasattr(os, 'uname') and os.uname().sysname == 'Linux', '仅支持Linux')
+    def test_inotify(self):
+        self.check_watcher(InotifyWatcher([self.tmp.name]))
+
+    def test_watch(self):
+        found, stop = [], threading.Event()
+        t = threading.Thread(target=watch, args=([self.tmp.name], found.append, lambda p: p.endswith('.png'),
+                                                 0.2, 0.05, stop))
+        t.start()
+        sleep(0.1)
+        new = os.path.join(self.tmp.name, 'new.png')
+        with open(new, 'wb') as fp:
+            fp.write(b'1')
+            fp.flush()
+            sleep(0.1)
+            # 写入未完成时不应上传
+            self.assertEqual([], found)
+            fp.write(b'2')
+        open(os.path.join(self.tmp.name, 'new.txt'), 'wb').close()
+        sleep(0.6)
+        stop.set()
+        t.join()
+        self.assertEqual([new], found)
+
+
+if __name__ == '__main__':
+    unittest.main()